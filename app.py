@@ -4,12 +4,15 @@ import streamlit as st
 import warnings
 import asyncio
 import platform
-import speech_recognition as sr
-import pyttsx3
-from PIL import Image
+import time
 import io
 import base64
-from datetime import datetime
+from startup import startup_profiler, lazy_import
+
+# 语音相关的依赖只在用到时才导入
+sr = lazy_import('speech_recognition')
+vad = lazy_import('vad')
+audio_capture = lazy_import('audio_capture')
 
 # 设置环境变量
 os.environ['STREAMLIT_SERVER_FILE_WATCHER_TYPE'] = 'none'
@@ -39,7 +42,20 @@ if 'torch.classes' not in sys.modules:
 warnings.filterwarnings("ignore", category=RuntimeWarning)
 
 # 导入自定义工具
-from utils import generate_response, select_model, detect_language, emotional_response, model_manager
+with startup_profiler.section("导入自定义模块"):
+    from utils import ConversationContext, warm_up_emotion_analyzer, emotion_analyzer, model_manager
+    from cache_manager import cache_manager
+    from chat_pipeline import chat_pipeline
+    from chat_history import ChatMessage
+    from tts_pipeline import speech_pipeline
+    from error_handler import ErrorHandler
+    from asr_orchestrator import asr_orchestrator
+    from rate_limiter import xunfei_asr_limiter
+    from resilience import get_breaker_stats
+    from metrics import MetricsRegistry, metrics, start_configured_exporter
+    from image_analyzer import image_analyzer
+    from config_loader import get_section
+    from language_detector import language_detector
 
 # 增强事件循环处理
 if platform.system() == "Windows":
@@ -96,15 +112,26 @@ st.markdown("""
 # 初始化会话状态
 if 'messages' not in st.session_state:
     st.session_state.messages = []
-    st.session_state.messages.append({
-        "role": "system",
-        "content": "👋 欢迎使用智能聊天助手！我可以帮您解答问题、编写代码、分析图片等。",
-        "timestamp": datetime.now().strftime("%H:%M:%S")
-    })
+    st.session_state.messages.append(ChatMessage.create(
+        "system",
+        "👋 欢迎使用智能聊天助手！我可以帮您解答问题、编写代码、分析图片等。"
+    ))
+
+# 历史消息只渲染最近的一段，更早的按需加载
+HISTORY_PAGE_SIZE = 20
+if 'history_window' not in st.session_state:
+    st.session_state.history_window = HISTORY_PAGE_SIZE
+
+if 'conversation' not in st.session_state:
+    st.session_state.conversation = ConversationContext()
 
 if 'current_model' not in st.session_state:
     st.session_state.current_model = 'qwen2'
 
+# 本会话的各阶段耗时，只用于侧边栏调试面板；全局指标另由metrics导出
+if 'session_metrics' not in st.session_state:
+    st.session_state.session_metrics = MetricsRegistry(metrics.enabled)
+
 if 'model_params' not in st.session_state:
     st.session_state.model_params = {
         'temperature': 0.7,
@@ -112,6 +139,25 @@ if 'model_params' not in st.session_state:
         'max_tokens': 2048
     }
 
+# 模型检测在后台进行，结果在所有会话间共享，过期后重新检测
+@st.cache_resource(ttl=get_section('generation', {'model_discovery_ttl': 300})['model_discovery_ttl'], show_spinner=False)
+def refresh_model_discovery():
+    return model_manager.discover_models()
+
+# langdetect的语言模型加载约需1秒，启动后在后台加载一次，第一条非中日韩消息不必等待
+@st.cache_resource(show_spinner=False)
+def preload_language_profiles():
+    return language_detector.preload_in_background()
+
+preload_language_profiles()
+
+# Prometheus指标导出服务，整个进程只启动一次
+@st.cache_resource(show_spinner=False)
+def get_metrics_exporter():
+    return start_configured_exporter()
+
+exporter = get_metrics_exporter()
+
 # 侧边栏配置
 with st.sidebar:
     st.title("⚙️ 系统设置")
@@ -126,6 +172,13 @@ with st.sidebar:
     
     # 模型设置
     st.subheader("🎯 模型设置")
+    refresh_model_discovery()
+    if model_manager.models_ready is None:
+        st.caption("正在检测Ollama模型...")
+    elif not model_manager.models_ready:
+        st.warning("Ollama服务不可用或缺少所需模型")
+    if model_manager.missing_optional_models:
+        st.caption(f"未安装 {', '.join(model_manager.missing_optional_models)}，图片分析不可用")
     model_mode = st.radio(
         "模型选择模式",
         ["自动选择", "手动选择"],
@@ -135,7 +188,7 @@ with st.sidebar:
     if model_mode == "手动选择":
         st.session_state.current_model = st.selectbox(
             "选择模型",
-            list(model_manager.models.keys()),
+            model_manager.chat_models(),
             help="选择要使用的AI模型"
         )
         
@@ -150,93 +203,152 @@ with st.sidebar:
             0.0, 1.0, st.session_state.model_params['top_p'],
             help="控制回答的质量，值越小回答越保守"
         )
+        st.session_state.model_params['max_tokens'] = st.slider(
+            "最大生成长度 (Max Tokens)",
+            64, 4096, st.session_state.model_params['max_tokens'],
+            step=64,
+            help="限制单次回答的最大token数，值越小响应越快"
+        )
     
     # 功能设置
     st.subheader("🎨 功能设置")
     enable_emotion = st.toggle("启用情感交互", value=True, help="开启后AI会理解并回应情感")
     enable_voice = st.toggle("启用语音交互", value=True, help="开启后可以使用语音输入和播报")
     enable_image = st.toggle("启用图片分析", value=True, help="开启后可以上传图片进行分析")
+    if enable_emotion:
+        warm_up_emotion_analyzer()
+    if enable_voice and 'tts_prewarmed' not in st.session_state:
+        # 预先合成固定短语，之后播报时直接命中语音缓存
+        speech_pipeline.prewarm(
+            list(emotion_analyzer.responses.values())
+            + [st.session_state.messages[0].content, ErrorHandler.SERVER_BUSY_MESSAGE]
+        )
+        st.session_state.tts_prewarmed = True
     
     # 系统状态
     st.subheader("📊 系统状态")
     st.info(f"当前模型: {st.session_state.current_model}")
+    residency = model_manager.residency.get_stats()
+    if residency['resident'] or residency['cold_starts']:
+        cold_starts = sum(residency['cold_starts'].values())
+        st.info(f"已加载模型: {', '.join(residency['resident']) or '无'}，冷启动 {cold_starts} 次")
     st.info(f"会话数量: {len(st.session_state.messages)}")
+    if cache_manager:
+        cache_stats = cache_manager.get_stats()
+        st.info(f"缓存命中: {cache_stats['hits']}/{cache_stats['hits'] + cache_stats['misses']}")
+    asr_limit = xunfei_asr_limiter.get_stats()
+    if asr_limit['acquired'] or asr_limit['queue_depth']:
+        st.info(f"讯飞识别排队: {asr_limit['queue_depth']}，平均等待 {asr_limit['avg_wait']:.1f}秒")
+    for backend, breaker in get_breaker_stats().items():
+        if breaker['state'] != 'closed':
+            st.warning(f"{backend}服务熔断中，已快速拒绝 {breaker['rejected']} 次请求")
     
+    # 调试面板：本会话各阶段耗时分布
+    if metrics.enabled:
+        with st.expander("🔧 性能调试"):
+            rows = st.session_state.session_metrics.stage_summary()
+            if rows:
+                st.dataframe(rows, hide_index=True, use_container_width=True)
+            else:
+                st.caption("暂无数据，完成一轮对话后显示")
+            if exporter:
+                host, port = exporter.server_address[:2]
+                st.caption(f"Prometheus指标: http://{host}:{port}/metrics")
+
     # 清空会话
     if st.button("🗑️ 清空会话记录"):
         st.session_state.messages = [st.session_state.messages[0]]  # 保留系统欢迎消息
+        st.session_state.history_window = HISTORY_PAGE_SIZE
         st.success("会话已清空")
 
 # 主界面
 st.title("🤖 智能聊天助手")
+startup_profiler.mark_first_paint()
+
+def render_message(message):
+    with st.chat_message(message.role):
+        st.markdown(message.content)
+        st.caption(f"时间: {message.timestamp}")
 
 # 显示历史消息
-for message in st.session_state.messages:
-    with st.chat_message(message["role"]):
-        st.markdown(f"{message['content']}")
-        st.caption(f"时间: {message.get('timestamp', '')}")
+messages = st.session_state.messages
+hidden_count = max(0, len(messages) - st.session_state.history_window)
+if hidden_count:
+    if st.button(f"⬆️ 加载更早的消息 (还有 {hidden_count} 条)"):
+        st.session_state.history_window += HISTORY_PAGE_SIZE
+        st.rerun()
+with metrics.span('render_history'):
+    for message in messages[hidden_count:]:
+        render_message(message)
 
 # 图片上传功能
 if enable_image:
     uploaded_file = st.file_uploader("上传图片进行分析", type=["png", "jpg", "jpeg"])
     if uploaded_file is not None:
-        image = Image.open(uploaded_file)
-        st.image(image, caption="上传的图片", use_column_width=True)
-        prompt = f"请分析这张图片的内容和特点"
-        
-        with st.spinner("正在分析图片..."):
-            response = generate_response(prompt, st.session_state.current_model)
-            timestamp = datetime.now().strftime("%H:%M:%S")
-            st.session_state.messages.append({
-                "role": "assistant",
-                "content": response,
-                "timestamp": timestamp
-            })
-            with st.chat_message("assistant"):
-                st.markdown(response)
-                st.caption(f"时间: {timestamp}")
+        image_data = uploaded_file.getvalue()
+        st.image(image_data, caption="上传的图片", use_column_width=True)
+
+        # 文件保持上传状态时页面每次重新运行都会走到这里，同一张图片只分析一次
+        image_digest = image_analyzer.content_hash(image_data)
+        if st.session_state.get('analyzed_image') != image_digest:
+            with st.spinner("正在分析图片..."):
+                response = image_analyzer.analyze(image_data)
+            # 分析失败时不记录，下次页面运行时重新分析
+            if not ErrorHandler.is_error_message(response):
+                st.session_state.analyzed_image = image_digest
+            message = ChatMessage.create("assistant", response)
+            st.session_state.messages.append(message)
+            render_message(message)
+
+# 麦克风在后台持续录音到环形缓冲区，整个进程共用一个
+@st.cache_resource(show_spinner=False)
+def get_microphone():
+    return audio_capture.MicrophoneCapture()
 
 # 语音识别
 def recognize_speech():
-    r = sr.Recognizer()
-    max_retries = 3
-    
+    # 环境噪声校准结果保存在会话中，只在第一次录音时校准
+    if 'vad' not in st.session_state:
+        st.session_state.vad = vad.VoiceActivityDetector()
+    detector = st.session_state.vad
+
+    streaming = None
     try:
-        with sr.Microphone() as source:
-            st.write("请说话...")
-            st.write("正在录音...")
-            # 调整麦克风参数以提高识别率
-            r.adjust_for_ambient_noise(source, duration=0.5)
-            audio = r.listen(source, timeout=5, phrase_time_limit=10)
-            st.write("录音完成，正在识别...")
-        
-        # 修改识别服务的优先级，优先使用讯飞语音识别
-        from xunfei_speech import recognize_with_xunfei
-        try:
-            # 1. 优先使用讯飞语音识别
-            result = recognize_with_xunfei(audio.get_raw_data())
-            if result:
-                return result
-        except Exception as e:
-            st.warning(f"讯飞语音识别失败: {str(e)}")
-
-        # 2. 备选识别服务
-        recognition_services = [
-            lambda: try_google_recognition(r, audio, max_retries),
-            lambda: try_sphinx_recognition(r, audio),
-            lambda: try_other_recognition(r, audio)
-        ]
-        
-        # 依次尝试各种识别服务
-        for service in recognition_services:
-            try:
-                result = service()
-                if result:
-                    return result
-            except Exception as e:
-                st.warning(f"识别服务尝试失败: {str(e)}")
-                continue
+        # 从按下按钮前的预录部分开始读，开头的字不会被截掉
+        reader = get_microphone().open_reader()
+        # 讯飞边录音边识别：连接期间的音频留在录音缓冲区中，连上后从预录处开始发送
+        if 'xunfei' in asr_orchestrator.backends:
+            from xunfei_speech import XunfeiStreamingSession
+            streaming = XunfeiStreamingSession()
+
+        def read_frame():
+            frame = reader.read_frame()
+            if frame and streaming:
+                streaming.feed(frame)
+            return frame
+
+        st.write("请说话...")
+        st.write("正在录音...")
+        # 检测到说话结束立即停止录音，并去掉首尾静音；
+        # 用预录之前的缓冲音频校准环境噪声，不占用预录部分
+        pcm = vad.record_until_silence(read_frame, detector, timeout=5, phrase_time_limit=10,
+                                       calibration_pcm=b'' if detector.calibrated else reader.history(300))
+        st.write("录音完成，正在识别...")
+        if not pcm:
+            st.warning("没有检测到语音")
+            return ""
+        audio = sr.AudioData(pcm, detector.sample_rate, 2)
         
+        # 离线识别与在线服务并行，在线服务慢时对冲下一个服务，采用最先得到的可用结果；
+        # 讯飞已经收到了录音，只需等待最终结果，其他服务使用完整录音
+        result = asr_orchestrator.recognize(audio, {'xunfei': streaming.recognize} if streaming else None)
+        st.session_state.session_metrics.record_seconds('asr', result.latency)
+        if result.text:
+            st.success(f"识别成功（{result.backend}，{result.latency:.1f}秒）")
+            return result.text
+        for backend, error in result.errors.items():
+            st.warning(f"语音识别失败（{backend}）: {error}")
+
         # 如果所有服务都失败，提供手动输入选项
         st.error("所有语音识别服务均不可用")
         manual_input = st.text_input("请手动输入您想说的内容:")
@@ -247,78 +359,82 @@ def recognize_speech():
     except Exception as e:
         st.error(f"麦克风访问错误: {e}")
         return ""
+    finally:
+        if streaming:
+            streaming.close()
 
-# Google语音识别，带重试机制
-def try_google_recognition(recognizer, audio, max_retries=3):
-    retry_count = 0
-    while retry_count < max_retries:
-        try:
-            st.info(f"尝试使用Google语音识别 (尝试 {retry_count+1}/{max_retries})...")
-            # 移除timeout参数，因为recognize_google不支持此参数
-            text = recognizer.recognize_google(audio, language='zh-CN')
-            st.success("Google语音识别成功")
-            return text
-        except sr.UnknownValueError:
-            st.warning("未能识别语音内容")
-            return ""
-        except sr.RequestError as e:
-            retry_count += 1
-            error_msg = str(e)
-            st.warning(f"Google语音识别请求失败 ({retry_count}/{max_retries}): {error_msg}")
-            
-            # 记录更详细的错误信息
-            if "Bad Gateway" in error_msg:
-                st.error("检测到Bad Gateway错误，可能是网络问题或Google服务在当前地区不可用")
-            elif "Connection refused" in error_msg:
-                st.error("连接被拒绝，请检查网络连接")
-            elif "timed out" in error_msg:
-                st.error("连接超时，请检查网络速度")
-                
-            if retry_count >= max_retries:
-                st.error("Google语音识别服务不可用，尝试其他服务")
-            import time
-            time.sleep(2)  # 增加等待时间到2秒
-    return ""
-
-# Sphinx离线语音识别
-def try_sphinx_recognition(recognizer, audio):
-    try:
-        st.info("尝试使用Sphinx离线识别...")
-        # 不指定language参数，因为默认的英文模型可能比不完整的中文模型效果更好
-        text = recognizer.recognize_sphinx(audio)
-        
-        if not text:
-            st.warning("未能识别语音内容")
-            return ""
-            
-        st.success("离线识别成功")
-        st.info(f"识别结果: '{text}'")
-        
-        # 不再显示警告，直接返回结果
-        return text
-    except Exception as e:
-        st.warning(f"Sphinx离线识别失败: {e}")
-        return ""
+# 处理一轮对话：显示用户输入，并流式显示模型回答
+def respond_to(user_text, speak=False):
+    user_message = ChatMessage.create("user", user_text)
+    st.session_state.messages.append(user_message)
+    render_message(user_message)
 
-# 尝试其他可用的识别服务
-def try_other_recognition(recognizer, audio):
-    # 可以添加其他语音识别服务，如百度、讯飞等
-    # 这里仅作为示例
-    try:
-        st.info("尝试使用其他语音识别服务...")
-        # 这里可以添加其他API的调用
-        return ""
-    except Exception as e:
-        st.warning(f"其他语音识别服务失败: {e}")
-        return ""
+    # 模型生成与情感分析、语言检测并行执行
+    turn = chat_pipeline.start_turn(
+        user_text,
+        model=None if model_mode == "自动选择" else st.session_state.current_model,
+        history=st.session_state.messages[:-1],
+        conversation=st.session_state.conversation,
+        enable_emotion=enable_emotion,
+        **st.session_state.model_params
+    )
 
-# 语音合成功能
-def text_to_speech(text):
-    engine = pyttsx3.init()
-    engine.setProperty('rate', 150)
-    engine.setProperty('volume', 0.9)
-    engine.say(text)
-    engine.runAndWait()
+    # 语音播报随回答流式进行，每凑齐一句就开始合成
+    utterance = speech_pipeline.open_utterance() if speak else None
+    unspoken = ""
+    prefix_spoken = False
+
+    with st.chat_message("assistant"):
+        placeholder = st.empty()
+        placeholder.markdown("思考中...")
+        shown = ""
+        render_ns = 0
+        for chunk in turn.stream:
+            shown += chunk
+            # 情感回应算好后显示在回答开头
+            emotion_response = turn.emotion_if_ready()
+            prefix = f"{emotion_response}\n" if emotion_response else ""
+            if metrics.enabled:
+                render_start = time.perf_counter_ns()
+                placeholder.markdown(prefix + shown + "▌")
+                render_ns += time.perf_counter_ns() - render_start
+            else:
+                placeholder.markdown(prefix + shown + "▌")
+
+            if utterance:
+                # 情感回应要先于回答播报，在它算好之前先积攒回答文本
+                unspoken += chunk
+                if not prefix_spoken and turn.emotion_settled():
+                    utterance.feed(prefix)
+                    prefix_spoken = True
+                if prefix_spoken:
+                    utterance.feed(unspoken)
+                    unspoken = ""
+
+        response = turn.assemble()
+        placeholder.markdown(response)
+
+        if utterance:
+            if not prefix_spoken:
+                utterance.feed(f"{turn.emotion_if_ready()}\n")
+            utterance.feed(unspoken)
+            utterance.finish()
+
+        message = ChatMessage.create("assistant", response)
+        timings = turn.timings
+        if metrics.enabled:
+            timings['render'] = render_ns / 1e9
+            metrics.record_ns('render', render_ns)
+        for stage, seconds in timings.items():
+            st.session_state.session_metrics.record_seconds(stage, seconds)
+        st.caption(f"时间: {message.timestamp} | 首字延迟: {timings['llm_ttft']:.2f}s | 总耗时: {timings['end_to_end']:.2f}s")
+        stage_names = {'model_selection': '模型选择', 'emotion': '情感分析', 'language': '语言检测'}
+        stage_text = " | ".join(f"{label}: {timings[stage] * 1000:.1f}ms"
+                                for stage, label in stage_names.items() if stage in timings)
+        st.caption(f"并行阶段 - {stage_text} | 输入语言: {turn.language}" if stage_text
+                   else f"输入语言: {turn.language}")
+
+    st.session_state.messages.append(message)
 
 # 语音输入按钮
 if enable_voice:
@@ -326,87 +442,9 @@ if enable_voice:
         speech_text = recognize_speech()
         if speech_text:
             # 直接处理识别结果，不需要额外确认
-            timestamp = datetime.now().strftime("%H:%M:%S")
-            st.session_state.messages.append({
-                "role": "user",
-                "content": speech_text,
-                "timestamp": timestamp
-            })
-            with st.chat_message("user"):
-                st.markdown(speech_text)
-                st.caption(f"时间: {timestamp}")
-            
-            # 生成回答
-            with st.spinner("思考中..."):
-                if model_mode == "自动选择":
-                    model = select_model(speech_text)
-                else:
-                    model = st.session_state.current_model
-                
-                response = generate_response(
-                    speech_text,
-                    model,
-                    **st.session_state.model_params
-                )
-                
-                # 添加情感回应
-                if enable_emotion:
-                    emotion_response = emotional_response(speech_text)
-                    response = f"{emotion_response}\n{response}"
-                
-                timestamp = datetime.now().strftime("%H:%M:%S")
-                st.session_state.messages.append({
-                    "role": "assistant",
-                    "content": response,
-                    "timestamp": timestamp
-                })
-                with st.chat_message("assistant"):
-                    st.markdown(response)
-                    st.caption(f"时间: {timestamp}")
-                
-                # 语音播放回答
-                text_to_speech(response)
+            respond_to(speech_text, speak=True)
 
 # 文本输入处理
 if prompt := st.chat_input("请输入您的问题"):
-    timestamp = datetime.now().strftime("%H:%M:%S")
-    st.session_state.messages.append({
-        "role": "user",
-        "content": prompt,
-        "timestamp": timestamp
-    })
-    with st.chat_message("user"):
-        st.markdown(prompt)
-        st.caption(f"时间: {timestamp}")
-    
-    # 生成回答
-    with st.spinner("思考中..."):
-        if model_mode == "自动选择":
-            model = select_model(prompt)
-        else:
-            model = st.session_state.current_model
-        
-        response = generate_response(
-            prompt,
-            model,
-            **st.session_state.model_params
-        )
-        
-        # 添加情感回应
-        if enable_emotion:
-            emotion_response = emotional_response(prompt)
-            response = f"{emotion_response}\n{response}"
-        
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        st.session_state.messages.append({
-            "role": "assistant",
-            "content": response,
-            "timestamp": timestamp
-        })
-        with st.chat_message("assistant"):
-            st.markdown(response)
-            st.caption(f"时间: {timestamp}")
-        
-        # 如果启用了语音，播放回答
-        if enable_voice:
-            text_to_speech(response)
+    # 如果启用了语音，播放回答
+    respond_to(prompt, speak=enable_voice)
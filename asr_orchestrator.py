@@ -0,0 +1,251 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from config_loader import get_section
+from metrics import metrics
+
+@dataclass
+class ASRBackend:
+    """一个语音识别服务；recognize(audio, cancel)返回识别文本，cancel被设置时应尽快放弃"""
+    name: str
+    recognize: Callable[[Any, threading.Event], Optional[str]]
+    online: bool = True
+
+@dataclass
+class RecognitionResult:
+    text: str = ''
+    backend: Optional[str] = None
+    latency: float = 0.0
+    errors: Dict[str, str] = field(default_factory=dict)
+
+class BackendStats:
+    """单个识别服务的延迟与成功率统计，用于调整尝试顺序"""
+
+    def __init__(self, prior_latency: float = 2.0):
+        self.prior_latency = prior_latency
+        self.attempts = 0
+        self.successes = 0
+        self.failures = 0
+        self.cancelled = 0
+        self.latency_ewma: Optional[float] = None
+
+    def record(self, success: bool, latency: float) -> None:
+        self.attempts += 1
+        if success:
+            self.successes += 1
+            if self.latency_ewma is None:
+                self.latency_ewma = latency
+            else:
+                self.latency_ewma = 0.8 * self.latency_ewma + 0.2 * latency
+        else:
+            self.failures += 1
+
+    @property
+    def success_rate(self) -> float:
+        # 拉普拉斯平滑，没有记录的服务按50%计算
+        return (self.successes + 1) / (self.successes + self.failures + 2)
+
+    @property
+    def score(self) -> float:
+        """期望得到一次成功结果的耗时，越小越优先"""
+        latency = self.latency_ewma if self.latency_ewma is not None else self.prior_latency
+        return latency / self.success_rate
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'attempts': self.attempts,
+            'successes': self.successes,
+            'failures': self.failures,
+            'cancelled': self.cancelled,
+            'latency': self.latency_ewma,
+            'score': self.score,
+        }
+
+class ASROrchestrator:
+    """并行、对冲的语音识别调度
+
+    离线识别与第一个在线服务同时开始；在线服务超过延迟预算仍未返回时，
+    再启动下一个在线服务，失败时立即换下一个。任一在线服务返回结果即采用并通知其余服务放弃；
+    离线结果识别质量较差，只有在线服务全部失败或超时时才采用。
+    在线服务的尝试顺序按历史延迟和成功率自动调整。
+    """
+
+    def __init__(self, backends: List[ASRBackend], hedge_delay: float = 1.5,
+                 min_hedge_delay: float = 0.3, timeout: float = 15.0):
+        self.backends = {backend.name: backend for backend in backends}
+        self.hedge_delay = hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.timeout = timeout
+        self.stats = {backend.name: BackendStats() for backend in backends}
+        self._lock = threading.Lock()
+        # 被放弃的服务可能还在运行（HTTP请求、离线解码无法中断），预留足够的线程
+        self._executor = ThreadPoolExecutor(max_workers=max(2, len(backends) * 2),
+                                            thread_name_prefix='asr')
+
+    @classmethod
+    def from_config(cls) -> 'ASROrchestrator':
+        settings = get_section('asr', {
+            'online_backends': ['xunfei', 'google'],
+            'offline_backends': ['sphinx'],
+            'hedge_delay': 1.5,
+            'timeout': 15,
+        })
+        backends = []
+        for name in settings['online_backends'] + settings['offline_backends']:
+            if name not in BUILTIN_BACKENDS:
+                logging.warning(f"未知的语音识别服务: {name}")
+                continue
+            backends.append(ASRBackend(name, BUILTIN_BACKENDS[name],
+                                       online=name not in settings['offline_backends']))
+        return cls(backends, hedge_delay=settings['hedge_delay'], timeout=settings['timeout'])
+
+    def ordered_online_backends(self) -> List[ASRBackend]:
+        online = [backend for backend in self.backends.values() if backend.online]
+        with self._lock:
+            # sorted是稳定排序，统计相同时保持配置中的顺序
+            return sorted(online, key=lambda backend: self.stats[backend.name].score)
+
+    def _hedge_after(self, backend: ASRBackend) -> float:
+        with self._lock:
+            latency = self.stats[backend.name].latency_ewma
+        if latency is None:
+            return self.hedge_delay
+        return min(self.hedge_delay, max(self.min_hedge_delay, latency * 2))
+
+    def _run(self, backend: ASRBackend, recognize: Callable[[Any, threading.Event], Optional[str]],
+             audio: Any, cancel: threading.Event, results: "queue.Queue") -> None:
+        start = time.perf_counter()
+        text, error = '', None
+        try:
+            text = (recognize(audio, cancel) or '').strip()
+        except Exception as e:
+            error = str(e)
+        elapsed = time.perf_counter() - start
+        metrics.record_seconds('asr_backend', elapsed, backend=backend.name,
+                               outcome='ok' if text else ('cancelled' if cancel.is_set() else 'failed'))
+        with self._lock:
+            if not text and cancel.is_set():
+                # 被主动放弃的不计为失败
+                self.stats[backend.name].cancelled += 1
+            else:
+                self.stats[backend.name].record(bool(text), elapsed)
+        results.put((backend.name, text, error, elapsed))
+
+    def recognize(self, audio: Any,
+                  streams: Optional[Dict[str, Callable[[Any, threading.Event], Optional[str]]]] = None
+                  ) -> RecognitionResult:
+        """识别一段完整录音
+
+        streams为录音时已经边录边发送的服务（服务名 -> 识别函数），这些服务改用它只等待最终结果，
+        其余服务仍使用完整录音。
+        """
+        result = self._recognize(audio, streams or {})
+        metrics.record_seconds('asr', result.latency, backend=result.backend or 'none')
+        return result
+
+    def _recognize(self, audio: Any,
+                   streams: Dict[str, Callable[[Any, threading.Event], Optional[str]]]) -> RecognitionResult:
+        start = time.perf_counter()
+        cancel = threading.Event()
+        results: "queue.Queue" = queue.Queue()
+        remaining = self.ordered_online_backends()
+        pending = set()
+        errors: Dict[str, str] = {}
+        offline_result: Optional[RecognitionResult] = None
+
+        def launch(backend: ASRBackend) -> None:
+            pending.add(backend.name)
+            recognize = streams.get(backend.name, backend.recognize)
+            self._executor.submit(self._run, backend, recognize, audio, cancel, results)
+
+        def launch_next_online() -> Optional[float]:
+            """启动下一个在线服务，返回下一次对冲的时间点"""
+            if not remaining:
+                return None
+            backend = remaining.pop(0)
+            launch(backend)
+            return time.perf_counter() + self._hedge_after(backend)
+
+        for backend in self.backends.values():
+            if not backend.online:
+                launch(backend)
+        hedge_at = launch_next_online()
+        deadline = start + self.timeout
+
+        try:
+            while pending:
+                wait_until = min(deadline, hedge_at) if hedge_at else deadline
+                try:
+                    name, text, error, elapsed = results.get(timeout=max(0.0, wait_until - time.perf_counter()))
+                except queue.Empty:
+                    if hedge_at and time.perf_counter() >= hedge_at:
+                        hedge_at = launch_next_online()
+                        continue
+                    errors['timeout'] = f"{self.timeout}秒内没有得到识别结果"
+                    break
+
+                pending.discard(name)
+                if text:
+                    result = RecognitionResult(text, name, time.perf_counter() - start, errors)
+                    if self.backends[name].online:
+                        return result
+                    offline_result = result
+                else:
+                    errors[name] = error or "未能识别语音内容"
+                    if self.backends[name].online:
+                        hedge_at = launch_next_online() or hedge_at
+
+                online_pending = any(self.backends[n].online for n in pending)
+                if offline_result and not online_pending and not remaining:
+                    return offline_result
+            return offline_result or RecognitionResult(latency=time.perf_counter() - start, errors=errors)
+        finally:
+            cancel.set()
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {name: stats.to_dict() for name, stats in self.stats.items()}
+
+def _recognize_xunfei(audio: Any, cancel: threading.Event) -> Optional[str]:
+    from xunfei_speech import recognize_with_xunfei
+    return recognize_with_xunfei(audio.get_raw_data(convert_rate=16000, convert_width=2), cancel)
+
+def _recognize_google(audio: Any, cancel: threading.Event) -> Optional[str]:
+    import speech_recognition as sr
+    from resilience import get_breaker
+    # 熔断期间抛出CircuitOpenError，编排器立即改用下一个服务
+    breaker = get_breaker('google')
+    breaker.check()
+    try:
+        text = sr.Recognizer().recognize_google(audio, language='zh-CN')
+    except sr.UnknownValueError:
+        # 服务正常响应，只是没有识别出内容
+        breaker.record_success()
+        return ''
+    except Exception as e:
+        breaker.record_error(e)
+        raise
+    breaker.record_success()
+    return text
+
+def _recognize_sphinx(audio: Any, cancel: threading.Event) -> Optional[str]:
+    import speech_recognition as sr
+    try:
+        # 不指定language参数，因为默认的英文模型可能比不完整的中文模型效果更好
+        return sr.Recognizer().recognize_sphinx(audio)
+    except sr.UnknownValueError:
+        return ''
+
+BUILTIN_BACKENDS: Dict[str, Callable[[Any, threading.Event], Optional[str]]] = {
+    'xunfei': _recognize_xunfei,
+    'google': _recognize_google,
+    'sphinx': _recognize_sphinx,
+}
+
+# 初始化全局实例
+asr_orchestrator = ASROrchestrator.from_config()
@@ -0,0 +1,120 @@
+import json
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+class ASRResultAssembler:
+    """讯飞实时语音转写结果拼装
+
+    每个服务端消息只解析一次（外层JSON与data字段各一次）。结果按seg_id分段：
+    中间结果(type=1)只保留最新的一条，同一段的最终结果(type=0)到达后替换它，
+    不会把中间结果重复拼进文本。已确定的分段保存在列表中，只在分段变化时重新拼接。
+    也兼容旧版的{"result": 文本}简化格式（视为最终结果）。
+    """
+
+    def __init__(self, on_partial: Optional[Callable[[str], None]] = None):
+        # 收到新结果时的回调，参数为当前完整文本（已确定的分段加最新中间结果），用于实时字幕
+        self.on_partial = on_partial
+        self.reset()
+
+    def reset(self) -> None:
+        self.error: Optional[Tuple[str, str]] = None
+        self._segments: Dict[int, int] = {}  # seg_id -> 在_finals中的位置
+        self._finals: List[str] = []
+        self._final_text = ''
+        self._dirty = False
+        self._partial_id: Optional[int] = None
+        self._partial = ''
+        self._next_id = 0
+
+    @staticmethod
+    def _words(sentence: Dict[str, Any]) -> str:
+        return ''.join(cw.get('w', '')
+                       for rt in sentence.get('rt', ())
+                       for ws in rt.get('ws', ())
+                       for cw in ws.get('cw', ()))
+
+    def _parse(self, message: Union[str, bytes]) -> Optional[Tuple[int, str, bool]]:
+        frame = json.loads(message)
+        code = str(frame.get('code', '0'))
+        if code != '0':
+            self.error = (code, frame.get('desc', ''))
+            return None
+        if frame.get('action') == 'started':
+            return None
+        data = frame.get('data')
+        if not data:
+            return None
+        if isinstance(data, str):
+            data = json.loads(data)
+
+        if 'cn' in data:
+            sentence = data['cn']['st']
+            seg_id = int(data.get('seg_id', self._next_id))
+            return seg_id, self._words(sentence), str(sentence.get('type', '0')) == '0'
+        if 'result' in data:
+            return self._next_id, data['result'] or '', True
+        return None
+
+    def feed(self, message: Union[str, bytes]) -> bool:
+        """处理一条服务端消息，返回识别文本是否有变化"""
+        parsed = self._parse(message)
+        if parsed is None:
+            return False
+        seg_id, text, is_final = parsed
+
+        if is_final:
+            if seg_id in self._segments:
+                self._finals[self._segments[seg_id]] = text
+            else:
+                self._segments[seg_id] = len(self._finals)
+                self._finals.append(text)
+            self._dirty = True
+            self._next_id = max(self._next_id, seg_id + 1)
+            if self._partial_id is not None and self._partial_id <= seg_id:
+                self._partial_id, self._partial = None, ''
+        elif seg_id not in self._segments:
+            self._partial_id, self._partial = seg_id, text
+        else:
+            return False
+
+        if self.on_partial:
+            self.on_partial(self.text)
+        return True
+
+    @property
+    def final_text(self) -> str:
+        """已经确定的文本"""
+        if self._dirty:
+            self._final_text = ''.join(self._finals)
+            self._dirty = False
+        return self._final_text
+
+    @property
+    def partial_text(self) -> str:
+        """当前分段的中间结果，可能还会变化"""
+        return self._partial
+
+    @property
+    def text(self) -> str:
+        return self.final_text + self._partial
+
+if __name__ == '__main__':
+    # 长会话的处理耗时；拼装逻辑的检查见test_asr_result.py
+    import time
+
+    def rtasr_frame(seg_id: int, words: List[str], result_type: str) -> str:
+        data = {'seg_id': seg_id, 'cn': {'st': {'bg': '0', 'ed': '0', 'type': result_type, 'rt': [
+            {'ws': [{'wb': 0, 'we': 0, 'cw': [{'w': word, 'wp': 'n'}]} for word in words]}
+        ]}}, 'ls': False}
+        return json.dumps({'action': 'result', 'code': '0', 'desc': 'success', 'sid': 'rta0000000a@ch',
+                           'data': json.dumps(data, ensure_ascii=False)}, ensure_ascii=False)
+
+    segments = 2000
+    frames = [rtasr_frame(i, ['这是', '第', str(i), '句'][:n], '1' if n < 4 else '0')
+              for i in range(segments) for n in range(1, 5)]
+    assembler = ASRResultAssembler()
+    start = time.perf_counter()
+    for frame in frames:
+        assembler.feed(frame)
+        assembler.text
+    elapsed = time.perf_counter() - start
+    print(f"{len(frames)} 条消息, {elapsed / len(frames) * 1e6:.1f} 微秒/条, 文本长度 {len(assembler.text)}")
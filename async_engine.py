@@ -0,0 +1,246 @@
+import asyncio
+import hashlib
+import json
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Dict, Iterator, List, Optional
+
+from error_handler import ErrorHandler, RetryStrategy
+from resilience import get_breaker
+from metrics import metrics
+from startup import lazy_import
+
+ollama = lazy_import('ollama')
+
+# 流结束标记
+_END = object()
+
+def _field(result: Any, key: str) -> Any:
+    """Ollama响应中的统计字段（纳秒或计数），没有该字段时返回None"""
+    return result[key] if key in result else None
+
+class _SharedStream:
+    """一次上游流式生成，可被多个订阅者共享
+
+    所有字段只在事件循环线程中修改；每个订阅者拥有一个线程安全的队列，
+    加入时先补发已经产生的内容，因此晚到的订阅者也能拿到完整回答。
+    """
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.done = False
+        self.subscribers: List[queue.Queue] = []
+
+    def subscribe(self) -> queue.Queue:
+        q = queue.Queue()
+        for chunk in self.chunks:
+            q.put(chunk)
+        if self.done:
+            q.put(_END)
+        else:
+            self.subscribers.append(q)
+        return q
+
+    def publish(self, chunk: str) -> None:
+        self.chunks.append(chunk)
+        for q in self.subscribers:
+            q.put(chunk)
+
+    def close(self) -> None:
+        self.done = True
+        for q in self.subscribers:
+            q.put(_END)
+        self.subscribers.clear()
+
+class AsyncGenerationEngine:
+    """基于ollama.AsyncClient的异步生成引擎
+
+    在独立线程中运行一个事件循环，Streamlit的各个会话线程通过它提交请求：
+    - 模型、参数和输入完全相同且仍在生成中的请求共享同一次上游调用；
+    - 每个模型有并发上限，避免同时压垮本地Ollama服务；
+    - 重试等待使用asyncio.sleep，不占用线程；
+    - Ollama连续不可用时熔断，之后的请求立即返回错误结果，不再逐个等待超时和重试。
+    """
+
+    def __init__(self, model_manager, max_concurrency_per_model: int = 2,
+                 retry_strategy: Optional[RetryStrategy] = None):
+        self.model_manager = model_manager
+        self.max_concurrency_per_model = max_concurrency_per_model
+        self.retry_strategy = retry_strategy or RetryStrategy(max_retries=3, delay=1.0, backoff=2.0)
+        self.breaker = get_breaker('ollama')
+        self.client: Optional['ollama.AsyncClient'] = None
+        self.coalesced = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_lock = threading.Lock()
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._streams: Dict[str, _SharedStream] = {}
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._loop_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name='ollama-async-engine', daemon=True)
+                thread.start()
+                self._loop = loop
+            return self._loop
+
+    def _request_key(self, model_name: str, prompt: Optional[str],
+                     messages: Optional[List[Dict[str, str]]], kwargs: Dict[str, Any]) -> str:
+        key_data = json.dumps([self.model_manager.resolve_model_name(model_name), prompt, messages,
+                               sorted(kwargs.items())], ensure_ascii=False, default=str)
+        return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+    def _semaphore(self, model_name: str) -> asyncio.Semaphore:
+        name = self.model_manager.resolve_model_name(model_name)
+        if name not in self._semaphores:
+            self._semaphores[name] = asyncio.Semaphore(self.max_concurrency_per_model)
+        return self._semaphores[name]
+
+    def _get_client(self) -> 'ollama.AsyncClient':
+        # AsyncClient需要在事件循环线程中创建
+        if self.client is None:
+            self.client = ollama.AsyncClient()
+        return self.client
+
+    async def _call(self, model_name: str, prompt: Optional[str],
+                    messages: Optional[List[Dict[str, str]]], stream: bool, **kwargs) -> Any:
+        client = self._get_client()
+        # 多模态模型的图片（base64）直接放在请求中，不属于生成参数
+        images = kwargs.pop('images', None)
+        name = self.model_manager.resolve_model_name(model_name)
+        was_resident = self.model_manager.residency.is_resident(name)
+        request = dict(
+            model=name,
+            stream=stream,
+            **self.model_manager.build_generation_options(model_name, **kwargs)
+        )
+        if messages is not None:
+            result = await client.chat(messages=messages, **request)
+        else:
+            if images:
+                request['images'] = images
+            result = await client.generate(prompt=prompt, **request)
+        if stream:
+            return self._track_stream(result, name, was_resident)
+        self._record_completion(name, was_resident, result)
+        return result
+
+    def _record_completion(self, name: str, was_resident: bool, result: Any) -> None:
+        """根据完成时的统计字段记录冷启动和生成速度"""
+        self.model_manager.residency.record_load(name, was_resident, _field(result, 'load_duration'))
+        eval_count, eval_duration = _field(result, 'eval_count'), _field(result, 'eval_duration')
+        if eval_count and eval_duration:
+            metrics.observe('llm_tokens_per_second', eval_count / (eval_duration / 1e9), model=name)
+
+    async def _track_stream(self, parts: Any, name: str, was_resident: bool) -> Any:
+        """原样转发流式结果，最后一块（done）带有加载耗时和生成统计"""
+        async for part in parts:
+            if 'done' in part and part['done']:
+                self._record_completion(name, was_resident, part)
+            yield part
+
+    async def _generate_once(self, model_name: str, prompt: Optional[str],
+                             messages: Optional[List[Dict[str, str]]], **kwargs) -> str:
+        @ErrorHandler.with_async_retry(self.retry_strategy, self.breaker)
+        async def _generate() -> str:
+            result = await self._call(model_name, prompt, messages, False, **kwargs)
+            if messages is not None:
+                return result['message']['content']
+            return result['response']
+
+        async with self._semaphore(model_name):
+            return await _generate()
+
+    async def agenerate(self, prompt: Optional[str], model_name: str,
+                        messages: Optional[List[Dict[str, str]]] = None, **kwargs) -> str:
+        """在引擎的事件循环中生成完整回答，相同的进行中请求会被合并"""
+        key = self._request_key(model_name, prompt, messages, kwargs)
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.ensure_future(self._generate_once(model_name, prompt, messages, **kwargs))
+        self._inflight[key] = future
+        future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(future)
+
+    def submit(self, prompt: Optional[str], model_name: str,
+               messages: Optional[List[Dict[str, str]]] = None, **kwargs) -> Future:
+        """从任意线程提交生成请求，返回concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(
+            self.agenerate(prompt, model_name, messages, **kwargs), self._ensure_loop()
+        )
+
+    def generate(self, prompt: Optional[str], model_name: str,
+                 messages: Optional[List[Dict[str, str]]] = None, **kwargs) -> str:
+        return self.submit(prompt, model_name, messages, **kwargs).result()
+
+    async def _produce(self, key: str, shared: _SharedStream, model_name: str,
+                       prompt: Optional[str], messages: Optional[List[Dict[str, str]]],
+                       **kwargs) -> None:
+        try:
+            # 熔断期间跳过流式请求，由下面的非流式接口立即返回错误结果
+            if self.breaker.allow():
+                async with self._semaphore(model_name):
+                    try:
+                        async for part in await self._call(model_name, prompt, messages, True, **kwargs):
+                            chunk = part['message']['content'] if messages is not None else part['response']
+                            if chunk:
+                                shared.publish(chunk)
+                        self.breaker.record_success()
+                    except Exception as e:
+                        if shared.chunks:
+                            # 已经输出了部分内容，无法重试；送出错误结果，不完整的回答不会被当作成功缓存
+                            self.breaker.record_error(e)
+                            logging.error(f"流式生成中断: {e}")
+                            shared.publish(ErrorHandler.format_error(e, self.breaker.name))
+                            return
+                        # 改用普通生成，由它的重试过程记录成败，同一次故障不重复计数
+                        self.breaker.release()
+                        logging.warning(f"流式生成失败，改用普通生成: {e}")
+            if not shared.chunks:
+                # 尚未收到任何内容时退回到带重试的非流式接口
+                shared.publish(await self._generate_once(model_name, prompt, messages, **kwargs))
+        except Exception as e:
+            logging.error(f"生成任务异常: {e}")
+            if not shared.chunks:
+                shared.publish(ErrorHandler.format_error(e, self.breaker.name))
+        finally:
+            self._streams.pop(key, None)
+            shared.close()
+
+    async def _subscribe(self, prompt: Optional[str], model_name: str,
+                         messages: Optional[List[Dict[str, str]]], **kwargs) -> queue.Queue:
+        key = self._request_key(model_name, prompt, messages, kwargs)
+        shared = self._streams.get(key)
+        if shared is not None:
+            self.coalesced += 1
+            return shared.subscribe()
+
+        shared = _SharedStream()
+        self._streams[key] = shared
+        q = shared.subscribe()
+        asyncio.ensure_future(self._produce(key, shared, model_name, prompt, messages, **kwargs))
+        return q
+
+    def stream(self, prompt: Optional[str], model_name: str,
+               messages: Optional[List[Dict[str, str]]] = None, **kwargs) -> Iterator[str]:
+        """从任意线程流式获取回答，相同的进行中请求共享同一个上游流"""
+        q = asyncio.run_coroutine_threadsafe(
+            self._subscribe(prompt, model_name, messages, **kwargs), self._ensure_loop()
+        ).result()
+        while True:
+            chunk = q.get()
+            if chunk is _END:
+                return
+            yield chunk
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'inflight': len(self._inflight) + len(self._streams),
+            'coalesced': self.coalesced,
+        }
@@ -0,0 +1,231 @@
+import threading
+import time
+import wave
+from typing import Callable, Optional
+
+import numpy as np
+
+# 回调参数为一段16bit PCM数据和是否发生了设备输入溢出
+InputCallback = Callable[[bytes, bool], None]
+
+class AudioRingBuffer:
+    """预分配的16bit PCM环形缓冲区，一个写入者、多个读取者
+
+    写入位置和读取游标都用累计采样数表示。容量是帧长的整数倍，
+    按帧读取时每一帧在缓冲区内都是连续的，可以直接返回memoryview而不复制。
+    读取者落后超过容量时，最旧的数据已被覆盖，计一次溢出并跳到仍然有效的位置。
+    """
+
+    def __init__(self, capacity_samples: int, frame_samples: int):
+        frames = max(2, -(-capacity_samples // frame_samples))
+        self.frame_samples = frame_samples
+        self.capacity = frames * frame_samples
+        self._samples = np.zeros(self.capacity, dtype=np.int16)
+        self._bytes = memoryview(self._samples).cast('B')
+        self.write_pos = 0
+        self.overruns = 0
+        self._cond = threading.Condition()
+
+    def write(self, data: bytes) -> None:
+        incoming = np.frombuffer(data, dtype=np.int16)
+        if len(incoming) > self.capacity:
+            incoming = incoming[-self.capacity:]
+        with self._cond:
+            start = self.write_pos % self.capacity
+            first = min(len(incoming), self.capacity - start)
+            self._samples[start:start + first] = incoming[:first]
+            self._samples[:len(incoming) - first] = incoming[first:]
+            self.write_pos += len(incoming)
+            self._cond.notify_all()
+
+    def aligned_position(self, samples_back: int = 0) -> int:
+        """返回write_pos往前samples_back个采样、按帧对齐后的位置，不早于仍然有效的数据"""
+        with self._cond:
+            oldest = max(0, self.write_pos - self.capacity + self.frame_samples)
+            position = max(oldest, self.write_pos - samples_back)
+        return -(-position // self.frame_samples) * self.frame_samples
+
+    def read_frame(self, cursor: int, timeout: Optional[float] = None):
+        """读取cursor处的一帧，返回(帧数据memoryview或None, 新游标)
+
+        返回的memoryview直接指向缓冲区，写入者绕回一圈后内容会被覆盖，读取者应及时处理。
+        """
+        end = cursor + self.frame_samples
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.write_pos >= end, timeout):
+                return None, cursor
+            if self.write_pos - cursor > self.capacity:
+                self.overruns += 1
+                cursor = -(-(self.write_pos - self.capacity) // self.frame_samples) * self.frame_samples
+                end = cursor + self.frame_samples
+        offset = (cursor % self.capacity) * 2
+        return self._bytes[offset:offset + self.frame_samples * 2], end
+
+    def read_range(self, start: int, end: int) -> bytes:
+        """复制[start, end)之间仍然有效的音频，不移动任何读取游标"""
+        with self._cond:
+            start = max(start, self.write_pos - self.capacity, 0)
+            end = min(end, self.write_pos)
+            if end <= start:
+                return b''
+            first = start % self.capacity
+            length = end - start
+            if first + length <= self.capacity:
+                return self._samples[first:first + length].tobytes()
+            return (self._samples[first:].tobytes()
+                    + self._samples[:first + length - self.capacity].tobytes())
+
+    def latest_frame(self):
+        """最近写入的完整一帧，用于音量显示"""
+        with self._cond:
+            cursor = (self.write_pos // self.frame_samples - 1) * self.frame_samples
+        if cursor < 0:
+            return None
+        offset = (cursor % self.capacity) * 2
+        return self._bytes[offset:offset + self.frame_samples * 2]
+
+class PyAudioInputDevice:
+    """PyAudio麦克风输入，由PyAudio的回调线程送出数据"""
+
+    def __init__(self, sample_rate: int, chunk_samples: int, device_index: Optional[int] = None):
+        self.sample_rate = sample_rate
+        self.chunk_samples = chunk_samples
+        self.device_index = device_index
+        self._audio = None
+        self._stream = None
+
+    def start(self, callback: InputCallback) -> None:
+        import pyaudio
+
+        def on_audio(in_data, frame_count, time_info, status):
+            callback(in_data, bool(status & pyaudio.paInputOverflow))
+            return None, pyaudio.paContinue
+
+        self._audio = pyaudio.PyAudio()
+        self._stream = self._audio.open(format=pyaudio.paInt16, channels=1, rate=self.sample_rate,
+                                        input=True, input_device_index=self.device_index,
+                                        frames_per_buffer=self.chunk_samples, stream_callback=on_audio)
+        self._stream.start_stream()
+
+    def stop(self) -> None:
+        if self._stream:
+            self._stream.stop_stream()
+            self._stream.close()
+            self._stream = None
+        if self._audio:
+            self._audio.terminate()
+            self._audio = None
+
+class FileInputDevice:
+    """用WAV文件模拟麦克风（16kHz、16bit单声道），便于不接麦克风时调试和测试
+
+    realtime为True时按实际时长送出数据；loop为True时循环播放，否则播完后停止。
+    """
+
+    def __init__(self, path: str, chunk_samples: int = 480, realtime: bool = True, loop: bool = False):
+        self.path = path
+        self.chunk_samples = chunk_samples
+        self.realtime = realtime
+        self.loop = loop
+        self.finished = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, callback: InputCallback) -> None:
+        with wave.open(self.path, 'rb') as wav:
+            if wav.getsampwidth() != 2 or wav.getnchannels() != 1:
+                raise ValueError("模拟输入只支持16bit单声道WAV")
+            self.sample_rate = wav.getframerate()
+            pcm = wav.readframes(wav.getnframes())
+        chunk_bytes = self.chunk_samples * 2
+        interval = self.chunk_samples / self.sample_rate
+
+        def run():
+            next_time = time.monotonic()
+            while not self._stop.is_set():
+                for offset in range(0, len(pcm) - chunk_bytes + 1, chunk_bytes):
+                    if self._stop.is_set():
+                        break
+                    callback(pcm[offset:offset + chunk_bytes], False)
+                    if self.realtime:
+                        next_time += interval
+                        self._stop.wait(max(0.0, next_time - time.monotonic()))
+                if not self.loop:
+                    break
+            self.finished.set()
+
+        self._thread = threading.Thread(target=run, name='fake-microphone', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=1.0)
+
+class MicrophoneCapture:
+    """后台持续录音到环形缓冲区
+
+    录音线程（PyAudio回调）只把数据写入预分配的缓冲区；VAD、流式识别、音量显示等
+    各自持有一个CaptureReader按帧读取。新读取者可以从触发前pre-roll毫秒开始读，
+    按下按钮前一刻说出的字也不会丢失。
+    """
+
+    def __init__(self, sample_rate: int = 16000, frame_ms: int = 30, buffer_seconds: float = 30.0,
+                 preroll_ms: int = 300, device=None):
+        self.sample_rate = sample_rate
+        self.frame_samples = sample_rate * frame_ms // 1000
+        self.preroll_samples = sample_rate * preroll_ms // 1000
+        self.buffer = AudioRingBuffer(int(sample_rate * buffer_seconds), self.frame_samples)
+        self.device = device or PyAudioInputDevice(sample_rate, self.frame_samples)
+        self.input_overflows = 0  # 设备层面的输入溢出（回调处理不及时）
+        self.running = False
+        self._lock = threading.Lock()
+
+    def _on_audio(self, data: bytes, overflow: bool) -> None:
+        if overflow:
+            self.input_overflows += 1
+        self.buffer.write(data)
+
+    def start(self) -> 'MicrophoneCapture':
+        with self._lock:
+            if not self.running:
+                self.device.start(self._on_audio)
+                self.running = True
+        return self
+
+    def stop(self) -> None:
+        with self._lock:
+            if self.running:
+                self.device.stop()
+                self.running = False
+
+    def open_reader(self, preroll: bool = True) -> 'CaptureReader':
+        self.start()
+        return CaptureReader(self, self.buffer.aligned_position(self.preroll_samples if preroll else 0))
+
+    @property
+    def overruns(self) -> int:
+        return self.buffer.overruns + self.input_overflows
+
+    def level(self) -> float:
+        """最近一帧的音量(RMS)"""
+        frame = self.buffer.latest_frame()
+        if frame is None:
+            return 0.0
+        samples = np.frombuffer(frame, dtype=np.int16).astype(np.float32)
+        return float(np.sqrt(np.mean(samples ** 2)))
+
+class CaptureReader:
+    def __init__(self, capture: MicrophoneCapture, cursor: int):
+        self.capture = capture
+        self.cursor = cursor
+
+    def read_frame(self, timeout: float = 1.0):
+        """返回下一帧的memoryview；录音已停止或超时没有数据时返回b''"""
+        frame, self.cursor = self.capture.buffer.read_frame(self.cursor, timeout)
+        return b'' if frame is None else frame
+
+    def history(self, ms: int) -> bytes:
+        """读取游标之前ms毫秒的音频（刚开始录音时可能不足或为空），用于校准环境噪声"""
+        samples = self.capture.sample_rate * ms // 1000
+        return self.capture.buffer.read_range(self.cursor - samples, self.cursor)
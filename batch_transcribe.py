@@ -0,0 +1,226 @@
+"""批量语音转写：把目录中的WAV文件逐个送入语音识别，结果写入JSONL
+
+每行一个文件：{"file", "text", "backend", "latency", "queue_wait", "audio_seconds", "error"}，
+latency为识别耗时，不含在讯飞限流队列中的排队时间queue_wait。
+输出文件同时作为断点记录，重新运行时跳过已经成功的文件。
+
+用法：
+    python batch_transcribe.py clips/ -o results.jsonl --backend sphinx
+    python mock_xunfei_server.py --port 8765 &
+    python batch_transcribe.py clips/ -o results.jsonl --backend xunfei --asr-url ws://127.0.0.1:8765/v1/ws
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, Optional, Set, Tuple
+
+TARGET_RATE = 16000
+
+class WavFile:
+    """只读内存映射的WAV文件，data为指向PCM数据的memoryview，不复制音频"""
+
+    def __init__(self, path: str):
+        self._file = open(path, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # 空文件无法映射
+            self._file.close()
+            raise ValueError("空文件")
+        self.channels = self.sample_rate = self.sample_width = 0
+        self.data = None
+        try:
+            self._parse()
+        except Exception:
+            self.close()
+            raise
+
+    def _parse(self) -> None:
+        buf = self._mmap
+        if len(buf) < 12 or buf[0:4] != b'RIFF' or buf[8:12] != b'WAVE':
+            raise ValueError("不是WAV文件")
+        offset = 12
+        while offset + 8 <= len(buf):
+            chunk_id = buf[offset:offset + 4]
+            chunk_size = struct.unpack_from('<I', buf, offset + 4)[0]
+            body = offset + 8
+            if chunk_id == b'fmt ':
+                audio_format, self.channels, self.sample_rate = struct.unpack_from('<HHI', buf, body)
+                self.sample_width = struct.unpack_from('<H', buf, body + 14)[0] // 8
+                if audio_format != 1:
+                    raise ValueError(f"不支持的WAV编码: {audio_format}")
+            elif chunk_id == b'data':
+                # 录音软件中断时data长度可能写错，以实际文件长度为准
+                end = min(body + chunk_size, len(buf))
+                self.data = memoryview(buf)[body:end]
+                break
+            offset = body + chunk_size + (chunk_size & 1)
+        if self.data is None or not self.sample_rate:
+            raise ValueError("WAV文件缺少fmt或data块")
+
+    @property
+    def duration(self) -> float:
+        return len(self.data) / (self.sample_rate * self.channels * self.sample_width)
+
+    def pcm16k(self) -> Any:
+        """返回16kHz、16bit单声道PCM；格式已经符合时直接返回memoryview"""
+        if self.sample_rate == TARGET_RATE and self.channels == 1 and self.sample_width == 2:
+            return self.data
+        import numpy as np
+        if self.sample_width != 2:
+            raise ValueError(f"不支持的采样位宽: {self.sample_width * 8}bit")
+        samples = np.frombuffer(self.data, dtype=np.int16)
+        samples = samples[:len(samples) // self.channels * self.channels]
+        samples = samples.reshape(-1, self.channels).mean(axis=1)
+        if self.sample_rate != TARGET_RATE:
+            count = int(len(samples) * TARGET_RATE / self.sample_rate)
+            positions = np.linspace(0, len(samples) - 1, count)
+            samples = np.interp(positions, np.arange(len(samples)), samples)
+        return samples.astype(np.int16).tobytes()
+
+    def close(self) -> None:
+        if self.data is not None:
+            self.data.release()
+            self.data = None
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self) -> 'WavFile':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+def iter_wav_files(root: str) -> Iterator[str]:
+    """按目录顺序逐个产生WAV文件路径，不预先列出整个目录树"""
+    try:
+        entries = sorted(os.scandir(root), key=lambda entry: entry.name)
+    except OSError:
+        return
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            yield from iter_wav_files(entry.path)
+        elif entry.name.lower().endswith('.wav'):
+            yield entry.path
+
+def load_checkpoint(output_path: str, retry_failed: bool = True) -> Set[str]:
+    """读取已有的结果文件，返回不需要再处理的文件"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 上次运行中断时最后一行可能不完整
+                continue
+            if not (retry_failed and record.get('error')):
+                done.add(record['file'])
+    return done
+
+def make_recognizer(backend: str, asr_url: Optional[str] = None, realtime: bool = False):
+    """返回recognize(pcm) -> (文本, 排队秒数)函数，pcm为16kHz、16bit单声道音频"""
+    if backend == 'xunfei':
+        from xunfei_speech import XunfeiASR, ASR_URL
+
+        def recognize(pcm) -> Tuple[str, float]:
+            asr = XunfeiASR(base_url=asr_url or ASR_URL)
+            # 讯飞请求经过全局限流队列，批量任务不设排队超时
+            if not asr.open_stream(max_queue_wait=None):
+                raise ConnectionError("无法连接讯飞语音识别服务")
+            try:
+                asr.send_audio(pcm, pace=realtime)
+            finally:
+                text = asr.finish_stream()
+            # 错误帧、发送失败或超时得到的文本不完整，记为失败，--retry-failed时重新处理
+            asr.raise_for_error()
+            return text.strip(), asr.queue_wait
+        return recognize
+
+    import speech_recognition as sr
+    recognizer = sr.Recognizer()
+    method = {'sphinx': recognizer.recognize_sphinx, 'google': recognizer.recognize_google}[backend]
+
+    def recognize(pcm) -> Tuple[str, float]:
+        try:
+            return method(sr.AudioData(bytes(pcm), TARGET_RATE, 2)), 0.0
+        except sr.UnknownValueError:
+            return '', 0.0
+    return recognize
+
+def transcribe_file(path: str, root: str, backend: str, recognize) -> Dict[str, Any]:
+    record: Dict[str, Any] = {'file': os.path.relpath(path, root), 'text': '', 'backend': backend,
+                              'latency': None, 'queue_wait': 0.0, 'audio_seconds': None, 'error': None}
+    try:
+        with WavFile(path) as wav:
+            record['audio_seconds'] = round(wav.duration, 3)
+            pcm = wav.pcm16k()
+            start = time.perf_counter()
+            queue_wait = 0.0
+            try:
+                record['text'], queue_wait = recognize(pcm)
+            finally:
+                record['latency'] = round(time.perf_counter() - start - queue_wait, 4)
+                record['queue_wait'] = round(queue_wait, 4)
+                if isinstance(pcm, memoryview):
+                    pcm.release()
+    except Exception as e:
+        record['error'] = str(e) or type(e).__name__
+    return record
+
+def run_batch(root: str, output_path: str, backend: str = 'sphinx', workers: int = 2,
+              asr_url: Optional[str] = None, realtime: bool = False,
+              retry_failed: bool = True) -> Tuple[int, int]:
+    """转写root下所有WAV文件，返回(本次处理数, 失败数)"""
+    done = load_checkpoint(output_path, retry_failed)
+    recognize = make_recognizer(backend, asr_url, realtime)
+    # 同时提交的任务数有上限，文件再多也不会一次性全部打开
+    slots = threading.BoundedSemaphore(workers * 2)
+    write_lock = threading.Lock()
+    counts = {'processed': 0, 'failed': 0}
+
+    with open(output_path, 'a', encoding='utf-8') as out:
+        def finish(future) -> None:
+            slots.release()
+            record = future.result()
+            with write_lock:
+                out.write(json.dumps(record, ensure_ascii=False) + '\n')
+                # 每条结果立即落盘，中断后可以从这里继续
+                out.flush()
+                counts['processed'] += 1
+                if record['error']:
+                    counts['failed'] += 1
+                    print(f"[失败] {record['file']}: {record['error']}")
+                else:
+                    print(f"[{record['latency']:.2f}s] {record['file']}: {record['text']}")
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for path in iter_wav_files(root):
+                if os.path.relpath(path, root) in done:
+                    continue
+                slots.acquire()
+                future = executor.submit(transcribe_file, path, root, backend, recognize)
+                future.add_done_callback(finish)
+    return counts['processed'], counts['failed']
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='批量转写目录中的WAV文件')
+    parser.add_argument('directory', help='WAV文件所在目录（包含子目录）')
+    parser.add_argument('-o', '--output', default='transcripts.jsonl', help='JSONL结果文件，同时用作断点记录')
+    parser.add_argument('--backend', choices=['sphinx', 'xunfei', 'google'], default='sphinx')
+    parser.add_argument('--asr-url', help='讯飞识别服务地址，可指向mock_xunfei_server.py')
+    parser.add_argument('--workers', type=int, default=2, help='并发转写的文件数')
+    parser.add_argument('--realtime', action='store_true', help='按实时速度发送音频帧')
+    parser.add_argument('--skip-failed', action='store_true', help='不重试上次失败的文件')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    processed, failed = run_batch(args.directory, args.output, args.backend, args.workers,
+                                  args.asr_url, args.realtime, not args.skip_failed)
+    print(f"完成: 处理 {processed} 个文件, 失败 {failed} 个, 用时 {time.perf_counter() - start:.1f} 秒")
@@ -0,0 +1,170 @@
+import json
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Any
+
+from config_loader import get_section, resolve_path
+
+class CacheManager:
+    """模型回答缓存
+
+    内存中使用OrderedDict实现LRU，按条目数和字节数双重限制容量；
+    配置db_path时同时写入sqlite，应用重启后可以恢复缓存的回答。
+    """
+
+    def __init__(self, cache_duration: int = 3600, max_entries: int = 1000,
+                 max_bytes: int = 16 * 1024 * 1024, db_path: Optional[str] = None):
+        self.cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.cache_duration = cache_duration
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            self._open_db(db_path)
+
+    def _open_db(self, db_path: str) -> None:
+        try:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS response_cache ('
+                'key TEXT PRIMARY KEY, response TEXT NOT NULL, '
+                'created REAL NOT NULL, accessed REAL NOT NULL)'
+            )
+            self._db.commit()
+            self._load_from_db()
+        except sqlite3.Error as e:
+            logging.warning(f"无法打开缓存数据库，仅使用内存缓存: {e}")
+            self._db = None
+
+    def _load_from_db(self) -> None:
+        expire_before = time.time() - self.cache_duration
+        self._db.execute('DELETE FROM response_cache WHERE created < ?', (expire_before,))
+        rows = self._db.execute(
+            'SELECT key, response, created FROM response_cache ORDER BY accessed ASC'
+        ).fetchall()
+        for key, response, created in rows:
+            self._store(key, response, created)
+        self._evict()
+        self._db.commit()
+
+    def _generate_cache_key(self, prompt: str, model: str, **params) -> str:
+        # 参数排序后序列化，保证相同参数得到相同的键
+        key_data = json.dumps([prompt, model, sorted(params.items())],
+                              ensure_ascii=False, default=str)
+        return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+    def _store(self, key: str, response: str, created: float) -> None:
+        old = self.cache.pop(key, None)
+        if old:
+            self.current_bytes -= old['size']
+        size = len(response.encode('utf-8'))
+        self.cache[key] = {'response': response, 'created': created, 'size': size}
+        self.current_bytes += size
+
+    def _remove(self, key: str) -> None:
+        entry = self.cache.pop(key, None)
+        if entry:
+            self.current_bytes -= entry['size']
+        if self._db:
+            self._db.execute('DELETE FROM response_cache WHERE key = ?', (key,))
+
+    def _evict(self) -> None:
+        while self.cache and (len(self.cache) > self.max_entries
+                              or self.current_bytes > self.max_bytes):
+            key = next(iter(self.cache))
+            self._remove(key)
+            self.evictions += 1
+
+    def get_cached_response(self, prompt: str, model: str, **params) -> Optional[str]:
+        cache_key = self._generate_cache_key(prompt, model, **params)
+        with self._lock:
+            cached_data = self.cache.get(cache_key)
+            if cached_data and time.time() - cached_data['created'] < self.cache_duration:
+                self.cache.move_to_end(cache_key)
+                self.hits += 1
+                if self._db:
+                    self._db.execute('UPDATE response_cache SET accessed = ? WHERE key = ?',
+                                     (time.time(), cache_key))
+                    self._db.commit()
+                return cached_data['response']
+
+            if cached_data:
+                # 已过期
+                self._remove(cache_key)
+                if self._db:
+                    self._db.commit()
+            self.misses += 1
+            return None
+
+    def cache_response(self, prompt: str, model: str, response: str, **params) -> None:
+        cache_key = self._generate_cache_key(prompt, model, **params)
+        now = time.time()
+        with self._lock:
+            self._store(cache_key, response, now)
+            if self._db:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO response_cache (key, response, created, accessed) '
+                    'VALUES (?, ?, ?, ?)', (cache_key, response, now, now)
+                )
+            self._evict()
+            if self._db:
+                self._db.commit()
+
+    def clear_expired_cache(self) -> None:
+        expire_before = time.time() - self.cache_duration
+        with self._lock:
+            expired_keys = [key for key, data in self.cache.items()
+                            if data['created'] < expire_before]
+            for key in expired_keys:
+                self._remove(key)
+            if self._db:
+                self._db.commit()
+
+    def clear_all_cache(self) -> None:
+        with self._lock:
+            self.cache.clear()
+            self.current_bytes = 0
+            if self._db:
+                self._db.execute('DELETE FROM response_cache')
+                self._db.commit()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self.cache),
+                'bytes': self.current_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+def _create_cache_manager() -> Optional[CacheManager]:
+    settings = get_section('cache', {
+        'enabled': True,
+        'ttl': 3600,
+        'max_entries': 1000,
+        'max_bytes': 16 * 1024 * 1024,
+        'db_path': None,
+    })
+    if not settings['enabled']:
+        return None
+    return CacheManager(
+        cache_duration=settings['ttl'],
+        max_entries=settings['max_entries'],
+        max_bytes=settings['max_bytes'],
+        db_path=resolve_path(settings['db_path']) if settings['db_path'] else None,
+    )
+
+# 初始化全局实例，配置中关闭缓存时为None
+cache_manager = _create_cache_manager()
@@ -0,0 +1,26 @@
+import time
+import uuid
+from dataclasses import dataclass
+
+@dataclass
+class ChatMessage:
+    """会话中的一条消息
+
+    使用__slots__并以epoch秒保存时间，长会话中每条记录只占很少内存；
+    id在进程内唯一，可作为渲染缓存的键。
+    """
+    __slots__ = ('id', 'role', 'content', 'created')
+
+    id: str
+    role: str
+    content: str
+    created: float
+
+    @classmethod
+    def create(cls, role: str, content: str) -> 'ChatMessage':
+        return cls(uuid.uuid4().hex, role, content, time.time())
+
+    @property
+    def timestamp(self) -> str:
+        """显示用的时间字符串"""
+        return time.strftime("%H:%M:%S", time.localtime(self.created))
@@ -0,0 +1,105 @@
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from chat_history import ChatMessage
+from metrics import metrics
+from utils import (ConversationContext, ResponseStream, detect_language,
+                   emotional_response, generate_response_stream, select_model)
+
+class ChatTurn:
+    """一轮对话的处理结果
+
+    stream在调用方线程中迭代；情感分析和语言检测在线程池中与模型生成并行执行，
+    在assemble()时汇合。timings记录各阶段耗时（秒），同时计入全局指标。
+    """
+
+    def __init__(self, prompt: str, model: str, stream: ResponseStream,
+                 emotion: Optional[Future], language: Future, timings: Dict[str, float], start: float):
+        self.prompt = prompt
+        self.model = model
+        self.stream = stream
+        self.timings = timings
+        self._emotion = emotion
+        self._language = language
+        self._start = start
+
+    def emotion_if_ready(self) -> str:
+        """情感回应已算好时返回它，否则返回空字符串，不阻塞"""
+        if self._emotion is not None and self._emotion.done():
+            return self._emotion.result()
+        return ""
+
+    def emotion_settled(self) -> bool:
+        """情感分析未启用或已经完成"""
+        return self._emotion is None or self._emotion.done()
+
+    @property
+    def language(self) -> str:
+        """检测到的输入语言；assemble()之后读取不会阻塞"""
+        return self._language.result()
+
+    def assemble(self) -> str:
+        """在回答生成完毕后调用，汇合并行阶段的结果并返回最终回答
+
+        等待所有并行阶段完成后才返回，之后timings不会再被线程池修改，调用方可以安全遍历。
+        """
+        response = self.stream.text
+        if self._emotion is not None:
+            response = f"{self._emotion.result()}\n{response}"
+        self._language.result()
+        self.timings['llm_ttft'] = self.stream.ttft or 0.0
+        self.timings['llm_total'] = self.stream.total_time or 0.0
+        self.timings['end_to_end'] = time.perf_counter() - self._start
+        if self.stream.clean_time is not None:
+            self.timings['response_cleaning'] = self.stream.clean_time
+        if self.stream.error is None:
+            metrics.record_seconds('llm_ttft', self.timings['llm_ttft'], model=self.model)
+            metrics.record_seconds('llm_total', self.timings['llm_total'], model=self.model)
+        for stage in ('response_cleaning', 'end_to_end'):
+            if stage in self.timings:
+                metrics.record_seconds(stage, self.timings[stage])
+        return response
+
+class ChatPipeline:
+    """对话流水线：模型选择后立即开始生成，辅助分析放入线程池并行执行"""
+
+    def __init__(self, max_workers: int = 4):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='chat-pipeline')
+
+    @staticmethod
+    def _timed(timings: Dict[str, float], stage: str, func: Callable, *args) -> Any:
+        """指标关闭时直接调用，不计时"""
+        if not metrics.enabled:
+            return func(*args)
+        start = time.perf_counter_ns()
+        try:
+            return func(*args)
+        finally:
+            elapsed = time.perf_counter_ns() - start
+            timings[stage] = elapsed / 1e9
+            metrics.record_ns(stage, elapsed)
+
+    def start_turn(self, prompt: str, model: Optional[str] = None,
+                   history: Optional[List[ChatMessage]] = None,
+                   conversation: Optional[ConversationContext] = None,
+                   enable_emotion: bool = True, **params) -> ChatTurn:
+        """model为None时自动选择模型"""
+        start = time.perf_counter()
+        timings: Dict[str, float] = {}
+
+        # 生成依赖模型选择的结果，因此它在调用方线程中先执行
+        if model is None:
+            model = self._timed(timings, 'model_selection', select_model, prompt)
+
+        emotion = None
+        if enable_emotion:
+            emotion = self.executor.submit(self._timed, timings, 'emotion', emotional_response, prompt)
+        language = self.executor.submit(self._timed, timings, 'language', detect_language, prompt)
+
+        stream = generate_response_stream(prompt, model, history=history,
+                                          conversation=conversation, **params)
+        return ChatTurn(prompt, model, stream, emotion, language, timings, start)
+
+# 初始化全局实例
+chat_pipeline = ChatPipeline()
@@ -0,0 +1,32 @@
+import json
+import logging
+import os
+from typing import Any, Dict, Optional
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.json')
+
+_config_cache: Optional[Dict[str, Any]] = None
+
+def load_config() -> Dict[str, Any]:
+    """读取config.json，结果在进程内缓存"""
+    global _config_cache
+    if _config_cache is None:
+        try:
+            with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
+                _config_cache = json.load(f)
+        except Exception as e:
+            logging.warning(f"读取配置文件失败，使用默认配置: {e}")
+            _config_cache = {}
+    return _config_cache
+
+def get_section(name: str, defaults: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """获取配置中的某一节，并用默认值补全缺失项"""
+    section = dict(defaults or {})
+    section.update(load_config().get(name) or {})
+    return section
+
+def resolve_path(path: str) -> str:
+    """相对路径按项目目录解析，避免随启动目录变化"""
+    if os.path.isabs(path):
+        return path
+    return os.path.join(os.path.dirname(CONFIG_PATH), path)
@@ -1,44 +1,146 @@
+import asyncio
 import time
 from functools import wraps
 import logging
 from typing import Callable, Any, Optional
 
+from metrics import metrics
+from resilience import (CircuitBreaker, CircuitOpenError, DecorrelatedJitterBackoff, ErrorMessage,
+                        is_retryable, retry_budget)
+
 class RetryStrategy:
-    def __init__(self, max_retries: int = 3, delay: float = 1.0, backoff: float = 2.0):
+    def __init__(self, max_retries: int = 3, delay: float = 1.0, backoff: float = 2.0,
+                 max_delay: float = 4.0):
         self.max_retries = max_retries
         self.delay = delay
         self.backoff = backoff
+        self.max_delay = max_delay
+
+    def new_backoff(self) -> DecorrelatedJitterBackoff:
+        return DecorrelatedJitterBackoff(self.delay, self.max_delay, max(self.backoff, 1.0))
+
+class _RetryAttempts:
+    """with_retry与with_async_retry共用的重试判断
+
+    每次尝试前检查熔断器；致命错误（参数错误、模型不存在等）和熔断立即返回，
+    暂时性错误在全局重试预算允许时按去相关抖动退避后重试。
+    """
+
+    def __init__(self, strategy: RetryStrategy, breaker: Optional[CircuitBreaker]):
+        self.strategy = strategy
+        self.breaker = breaker
+        self.backoff = strategy.new_backoff()
+        self.attempt = 0
+        retry_budget.record_request()
+
+    def before_attempt(self) -> None:
+        self.attempt += 1
+        if self.breaker:
+            self.breaker.check()
+
+    def succeeded(self) -> None:
+        if self.breaker:
+            self.breaker.record_success()
+
+    def next_delay(self, error: Exception) -> Optional[float]:
+        """记录失败，返回重试前的等待时间；不再重试时返回None"""
+        if self.breaker:
+            self.breaker.record_error(error)
+        if isinstance(error, CircuitOpenError):
+            logging.warning(str(error))
+            return None
+        if not is_retryable(error):
+            logging.error(f"不可重试的错误: {error}")
+            return None
+        if self.attempt >= self.strategy.max_retries:
+            logging.error(f"所有重试都失败了: {error}")
+            return None
+        if not retry_budget.try_spend():
+            logging.error(f"重试预算已用完，放弃重试: {error}")
+            return None
+        logging.warning(f"尝试 {self.attempt}/{self.strategy.max_retries} 失败: {error}")
+        return self.backoff.next_delay()
+
+    def error_result(self, error: Exception) -> ErrorMessage:
+        return ErrorHandler.format_error(error, self.breaker.name if self.breaker else None)
 
 class ErrorHandler:
+    # 错误提示都以此开头
+    ERROR_PREFIX = "抱歉，"
+    SERVER_BUSY_MESSAGE = "抱歉，服务器暂时无法响应，请稍后再试。"
+
+    @staticmethod
+    def is_error_message(text: str) -> bool:
+        """判断文本是否为错误提示（ErrorMessage），而非模型回答"""
+        return isinstance(text, ErrorMessage)
+
     @staticmethod
-    def with_retry(strategy: Optional[RetryStrategy] = None) -> Callable:
+    def with_retry(strategy: Optional[RetryStrategy] = None,
+                   breaker: Optional[CircuitBreaker] = None) -> Callable:
         if not strategy:
             strategy = RetryStrategy()
 
         def decorator(func: Callable) -> Callable:
             @wraps(func)
             def wrapper(*args, **kwargs) -> Any:
-                last_exception = None
-                delay = strategy.delay
+                attempts = _RetryAttempts(strategy, breaker)
+                while True:
+                    try:
+                        attempts.before_attempt()
+                        result = func(*args, **kwargs)
+                    except Exception as e:
+                        delay = attempts.next_delay(e)
+                        if delay is None:
+                            # 不再重试时返回友好的错误信息
+                            return attempts.error_result(e)
+                        time.sleep(delay)
+                    else:
+                        attempts.succeeded()
+                        return result
+
+            return wrapper
+        return decorator
+
+    @staticmethod
+    def with_async_retry(strategy: Optional[RetryStrategy] = None,
+                         breaker: Optional[CircuitBreaker] = None) -> Callable:
+        """with_retry的协程版本，等待期间使用asyncio.sleep，不占用线程"""
+        if not strategy:
+            strategy = RetryStrategy()
 
-                for attempt in range(strategy.max_retries):
+        def decorator(func: Callable) -> Callable:
+            @wraps(func)
+            async def wrapper(*args, **kwargs) -> Any:
+                attempts = _RetryAttempts(strategy, breaker)
+                while True:
                     try:
-                        return func(*args, **kwargs)
+                        attempts.before_attempt()
+                        result = await func(*args, **kwargs)
+                    except asyncio.CancelledError:
+                        raise
                     except Exception as e:
-                        last_exception = e
-                        if attempt < strategy.max_retries - 1:
-                            logging.warning(f"尝试 {attempt + 1}/{strategy.max_retries} 失败: {str(e)}")
-                            time.sleep(delay)
-                            delay *= strategy.backoff
-                        else:
-                            logging.error(f"所有重试都失败了: {str(e)}")
-                            break
-
-                # 如果所有重试都失败了，返回友好的错误信息
-                error_msg = str(last_exception)
-                if '502' in error_msg:
-                    return "抱歉，服务器暂时无法响应，请稍后再试。"
-                return f"抱歉，发生了错误: {error_msg}"
+                        delay = attempts.next_delay(e)
+                        if delay is None:
+                            return attempts.error_result(e)
+                        await asyncio.sleep(delay)
+                    else:
+                        attempts.succeeded()
+                        return result
 
             return wrapper
-        return decorator
\ No newline at end of file
+        return decorator
+
+    @staticmethod
+    def format_error(error: Exception, backend: Optional[str] = None) -> ErrorMessage:
+        """把异常转换为展示给用户的错误提示，保留原始异常和是否可重试"""
+        error_msg = str(error)
+        retryable = is_retryable(error)
+        if isinstance(error, CircuitOpenError):
+            text = f"抱歉，{error_msg}。"
+            backend = backend or error.backend
+        elif '502' in error_msg:
+            text = ErrorHandler.SERVER_BUSY_MESSAGE
+        else:
+            text = f"抱歉，发生了错误: {error_msg}"
+        metrics.increment('errors_total', component=backend or 'unknown', kind=type(error).__name__)
+        return ErrorMessage(text, error, retryable, backend)
@@ -0,0 +1,167 @@
+import base64
+import hashlib
+import io
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from config_loader import get_section
+from startup import lazy_import
+
+Image = lazy_import('PIL.Image')
+ImageOps = lazy_import('PIL.ImageOps')
+
+DEFAULT_PROMPT = "请分析这张图片的内容和特点"
+
+def prepare_image(data: bytes, max_side: int = 1024, quality: int = 85,
+                  max_pixels: int = 40_000_000) -> bytes:
+    """把上传的图片缩小并重新编码为JPEG
+
+    JPEG使用draft在解码阶段按1/2、1/4、1/8缩小，大尺寸手机照片不会以全分辨率解码；
+    其余格式先用reduce做整数倍缩小再thumbnail。像素数超过max_pixels的非JPEG图片直接拒绝，
+    避免解码时占用过多内存。
+    """
+    with Image.open(io.BytesIO(data)) as img:
+        if img.format == 'JPEG':
+            img.draft('RGB', (max_side, max_side))
+        elif img.width * img.height > max_pixels:
+            raise ValueError(f"图片过大: {img.width}x{img.height}")
+        img = ImageOps.exif_transpose(img)
+        factor = max(img.size) // max_side
+        if factor >= 2:
+            img = img.reduce(factor)
+        img.thumbnail((max_side, max_side))
+        img = img.convert('RGB')
+
+        output = io.BytesIO()
+        img.save(output, 'JPEG', quality=quality, optimize=True)
+    return output.getvalue()
+
+class ImageAnalyzer:
+    """图片分析：后台缩放编码后交给多模态模型，结果按图片哈希缓存
+
+    先按上传内容的SHA-256查找，同一文件不会重复解码；再按缩小后JPEG数据的SHA-256查找，
+    内容不同但缩小后完全相同的上传也能命中。只有哈希完全一致才视为同一张图片，
+    相似图片（如感知哈希相近）可能内容并不相同，不共用分析结果。
+    并发解码数受线程池大小限制，内存占用有上限。
+    """
+
+    def __init__(self, model: str = 'llava', max_side: int = 1024, quality: int = 85,
+                 max_pixels: int = 40_000_000, max_workers: int = 2, max_entries: int = 256):
+        self.model = model
+        self.max_side = max_side
+        self.quality = quality
+        self.max_pixels = max_pixels
+        self.max_entries = max_entries
+        self.analyzed = 0
+        self.hits = 0
+        self._content_hashes: "OrderedDict[str, str]" = OrderedDict()  # 上传内容哈希 -> 缩小后图片哈希
+        self._results: "OrderedDict[Tuple[str, str], str]" = OrderedDict()  # (缩小后图片哈希, 提示) -> 分析结果
+        self._inflight: Dict[Tuple[str, str], Future] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='image-analyzer')
+
+    @classmethod
+    def from_config(cls) -> 'ImageAnalyzer':
+        settings = get_section('vision', {
+            'model': 'llava',
+            'max_side': 1024,
+            'jpeg_quality': 85,
+            'max_pixels': 40_000_000,
+            'max_workers': 2,
+            'max_entries': 256,
+        })
+        return cls(settings['model'], settings['max_side'], settings['jpeg_quality'],
+                   settings['max_pixels'], settings['max_workers'], settings['max_entries'])
+
+    @staticmethod
+    def content_hash(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    def _remember(self, cache: OrderedDict, key, value) -> None:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > self.max_entries:
+            cache.popitem(last=False)
+
+    def _lookup(self, image_hash: str, prompt: str) -> Optional[str]:
+        """查找缩小后内容完全相同的已分析图片"""
+        with self._lock:
+            result = self._results.get((image_hash, prompt))
+            if result is not None:
+                self.hits += 1
+            return result
+
+    def _analyze(self, data: bytes, digest: str, prompt: str) -> str:
+        from cache_manager import cache_manager
+        from response_processor import clean_response
+        from error_handler import ErrorHandler
+        from utils import generation_engine
+
+        jpeg = prepare_image(data, self.max_side, self.quality, self.max_pixels)
+        image_hash = self.content_hash(jpeg)
+        with self._lock:
+            self._remember(self._content_hashes, digest, image_hash)
+        cached = self._lookup(image_hash, prompt)
+        if cached is not None:
+            return cached
+
+        # 持久化缓存以图片哈希区分图片，避免不同图片共用同一个提示词的缓存
+        cache_prompt = f"[image:{image_hash}] {prompt}"
+        if cache_manager:
+            cached = cache_manager.get_cached_response(cache_prompt, self.model)
+            if cached is not None:
+                with self._lock:
+                    self.hits += 1
+                    self._remember(self._results, (image_hash, prompt), cached)
+                return cached
+
+        image_b64 = base64.b64encode(jpeg).decode('ascii')
+        del jpeg
+        response = generation_engine.generate(prompt, self.model, images=[image_b64])
+        if ErrorHandler.is_error_message(response):
+            return response
+        response = clean_response(response)
+        if response:
+            with self._lock:
+                self.analyzed += 1
+                self._remember(self._results, (image_hash, prompt), response)
+            if cache_manager:
+                cache_manager.cache_response(cache_prompt, self.model, response)
+        return response
+
+    def submit(self, data: bytes, prompt: str = DEFAULT_PROMPT) -> Future:
+        """在后台分析图片，返回Future；同一图片正在分析时返回同一个Future"""
+        digest = self.content_hash(data)
+        with self._lock:
+            image_hash = self._content_hashes.get(digest)
+            result = self._results.get((image_hash, prompt)) if image_hash is not None else None
+            if result is not None:
+                self.hits += 1
+                future = Future()
+                future.set_result(result)
+                return future
+            key = (digest, prompt)
+            future = self._inflight.get(key)
+            if future is None:
+                future = self._executor.submit(self._analyze, data, digest, prompt)
+                self._inflight[key] = future
+                future.add_done_callback(lambda _: self._inflight.pop(key, None))
+            return future
+
+    def analyze(self, data: bytes, prompt: str = DEFAULT_PROMPT) -> str:
+        try:
+            return self.submit(data, prompt).result()
+        except Exception as e:
+            logging.error(f"图片分析失败: {e}")
+            from error_handler import ErrorHandler
+            return ErrorHandler.format_error(e)
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'analyzed': self.analyzed, 'hits': self.hits, 'entries': len(self._results)}
+
+# 初始化全局实例
+image_analyzer = ImageAnalyzer.from_config()
@@ -0,0 +1,147 @@
+import hashlib
+import logging
+import re
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+class LanguageDetector:
+    """语言检测：先按Unicode文字比例快速判断，无法判断时才调用langdetect
+
+    中文、日文、韩文的文字特征很明显，绝大部分输入都能在快速路径中得出结果；
+    langdetect只处理拉丁字母等其他文字，语言模型每个进程只加载一次并固定随机种子，
+    结果按文本哈希缓存在有界的LRU中。返回值与langdetect一致（如'zh-cn'、'en'、'ja'、'ko'）。
+    """
+
+    _KANA_RE = re.compile(r'[\u3040-\u30ff\u31f0-\u31ff]')
+    _HANGUL_RE = re.compile(r'[\u1100-\u11ff\u3130-\u318f\uac00-\ud7af]')
+    _HAN_RE = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]')
+    _LATIN_RE = re.compile(r'[A-Za-z]')
+
+    # 只检查开头这么多字符，足以判断文字类型
+    SAMPLE_LENGTH = 256
+
+    def __init__(self, cache_size: int = 4096, default: str = 'en'):
+        self.cache_size = cache_size
+        self.default = default
+        self._cache: "OrderedDict[bytes, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._factory_lock = threading.Lock()
+        self._detect = None
+        self.fast_path_hits = 0
+        self.cache_hits = 0
+        self.fallback_calls = 0
+
+    def _script_language(self, text: str) -> Optional[str]:
+        sample = text[:self.SAMPLE_LENGTH]
+        kana = len(self._KANA_RE.findall(sample))
+        hangul = len(self._HANGUL_RE.findall(sample))
+        han = len(self._HAN_RE.findall(sample))
+        latin = len(self._LATIN_RE.findall(sample))
+        letters = kana + hangul + han + latin
+        if not letters:
+            return None
+
+        # 日文夹杂大量汉字，只要假名占一定比例即可判定
+        if kana / letters >= 0.1:
+            return 'ja'
+        if hangul / letters >= 0.3:
+            return 'ko'
+        if han / letters >= 0.3:
+            return 'zh-cn'
+        # 拉丁字母无法区分英、法、德等语言，交给langdetect
+        return None
+
+    def _load_langdetect(self):
+        with self._factory_lock:
+            if self._detect is None:
+                from langdetect import DetectorFactory, detect
+                from langdetect.detector_factory import init_factory
+                # 固定种子使结果可复现，并提前加载语言模型
+                DetectorFactory.seed = 0
+                init_factory()
+                self._detect = detect
+        return self._detect
+
+    def preload(self) -> None:
+        """提前加载langdetect语言模型，可在后台线程中调用"""
+        self._load_langdetect()
+
+    def preload_in_background(self) -> threading.Thread:
+        """在后台线程中加载语言模型，加载失败时检测会退回默认语言"""
+        def run():
+            try:
+                self.preload()
+            except Exception as e:
+                logging.warning(f"加载langdetect语言模型失败: {e}")
+
+        thread = threading.Thread(target=run, name='langdetect-preload', daemon=True)
+        thread.start()
+        return thread
+
+    def detect(self, text: str) -> str:
+        language = self._script_language(text)
+        if language:
+            self.fast_path_hits += 1
+            return language
+
+        key = hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return cached
+
+        self.fallback_calls += 1
+        try:
+            language = self._load_langdetect()(text)
+        except Exception:
+            language = self.default
+
+        with self._lock:
+            self._cache[key] = language
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return language
+
+# 初始化全局实例
+language_detector = LanguageDetector()
+
+if __name__ == '__main__':
+    # 基准测试：与直接调用langdetect比较中英日韩混合语料的吞吐量
+    import random
+    import time
+
+    from langdetect import DetectorFactory, detect
+
+    DetectorFactory.seed = 0
+    corpus = [
+        '今天天气怎么样？', '帮我写一段快速排序的代码', '我最近心情不太好，想找人聊聊',
+        'What is the capital of France?', 'hello', 'Please explain how transformers work in detail.',
+        '今日はいい天気ですね。', 'このプログラムの使い方を教えてください',
+        '안녕하세요, 만나서 반갑습니다.', '오늘 날씨가 어때요?',
+        'Bonjour, comment allez-vous?', 'Wie spät ist es?',
+    ]
+    random.seed(0)
+    samples = [random.choice(corpus) + ' ' * random.randint(0, 3) for _ in range(2000)]
+    detect(samples[0])
+
+    start = time.perf_counter()
+    for text in samples:
+        try:
+            detect(text)
+        except Exception:
+            pass
+    baseline = time.perf_counter() - start
+
+    detector = LanguageDetector()
+    detector.preload()
+    start = time.perf_counter()
+    for text in samples:
+        detector.detect(text)
+    elapsed = time.perf_counter() - start
+
+    print(f"langdetect: {len(samples) / baseline:.0f} 条/秒")
+    print(f"LanguageDetector: {len(samples) / elapsed:.0f} 条/秒 (快速路径 {detector.fast_path_hits}, "
+          f"缓存命中 {detector.cache_hits}, 回退 {detector.fallback_calls})")
@@ -0,0 +1,156 @@
+"""本地模拟的Ollama服务，用于在没有GPU和模型时调试模型常驻、预加载和冷启动统计
+
+模拟模型的加载与换出：请求未加载的模型时等待--load-time秒，已加载模型数超过--max-loaded时
+换出最久未使用的模型；keep_alive到期的模型自动卸载。支持/api/tags、/api/ps、
+/api/generate和/api/chat（含流式），响应中带有load_duration。
+
+用法：
+    python mock_ollama_server.py --port 11435 --load-time 2 --max-loaded 1
+然后设置环境变量 OLLAMA_HOST=http://127.0.0.1:11435 再启动应用
+"""
+import argparse
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from model_residency import parse_keep_alive
+
+class ModelPool:
+    def __init__(self, models, load_time: float, max_loaded: int):
+        self.models = models
+        self.load_time = load_time
+        self.max_loaded = max_loaded
+        self.loaded = {}  # 模型名 -> [最近使用时间, 卸载时间]
+        self.loads = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _full_name(name: str) -> str:
+        return name if ':' in name else f'{name}:latest'
+
+    def _expire(self) -> None:
+        now = time.time()
+        for name in [name for name, (_, expires) in self.loaded.items() if expires <= now]:
+            del self.loaded[name]
+
+    def use(self, name: str, keep_alive) -> int:
+        """使用模型，返回本次加载耗时（纳秒），已加载时为0"""
+        name = self._full_name(name)
+        with self._lock:
+            self._expire()
+            load_ns = 0
+            if name not in self.loaded:
+                # 同一时间只加载一个模型，与Ollama的行为一致
+                time.sleep(self.load_time)
+                load_ns = int(self.load_time * 1e9)
+                self.loads += 1
+                while len(self.loaded) >= self.max_loaded:
+                    oldest = min(self.loaded, key=lambda key: self.loaded[key][0])
+                    del self.loaded[oldest]
+            keep_seconds = parse_keep_alive(keep_alive)
+            now = time.time()
+            self.loaded[name] = [now, now + min(keep_seconds, 10 * 365 * 86400)]
+            if keep_seconds == 0:
+                del self.loaded[name]
+            return load_ns
+
+    def running(self):
+        with self._lock:
+            self._expire()
+            return [{
+                'name': name, 'model': name, 'size': 0, 'size_vram': 0, 'digest': '',
+                'expires_at': datetime.fromtimestamp(expires, timezone.utc).isoformat(),
+            } for name, (_, expires) in self.loaded.items()]
+
+class OllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    pool: ModelPool = None
+    reply = '这是模拟的回答。'
+    token_time = 0.01
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status: int = 200) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/api/tags':
+            now = datetime.now(timezone.utc).isoformat()
+            self._send_json({'models': [{'name': self.pool._full_name(name), 'model': self.pool._full_name(name),
+                                         'modified_at': now, 'size': 0, 'digest': ''}
+                                        for name in self.pool.models]})
+        elif self.path == '/api/ps':
+            self._send_json({'models': self.pool.running()})
+        else:
+            self._send_json({'error': 'not found'}, 404)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        model = request.get('model', '')
+        if self.path not in ('/api/generate', '/api/chat'):
+            self._send_json({'error': 'not found'}, 404)
+            return
+        if model.split(':')[0] not in self.pool.models:
+            self._send_json({'error': f"model '{model}' not found"}, 404)
+            return
+
+        start = time.perf_counter()
+        load_ns = self.pool.use(model, request.get('keep_alive'))
+        is_chat = self.path == '/api/chat'
+        empty = not is_chat and not request.get('prompt')
+        text = '' if empty else self.reply
+
+        def part(chunk: str, done: bool):
+            payload = {'model': model, 'created_at': datetime.now(timezone.utc).isoformat(), 'done': done}
+            if is_chat:
+                payload['message'] = {'role': 'assistant', 'content': chunk}
+            else:
+                payload['response'] = chunk
+            if done:
+                payload.update(done_reason='load' if empty else 'stop', load_duration=load_ns,
+                               eval_count=len(text), eval_duration=int(len(text) * self.token_time * 1e9),
+                               total_duration=int((time.perf_counter() - start) * 1e9))
+            return payload
+
+        if not request.get('stream', True):
+            time.sleep(len(text) * self.token_time)
+            self._send_json(part(text, True))
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for index, payload in enumerate([part(ch, False) for ch in text] + [part('', True)]):
+            if index < len(text):
+                time.sleep(self.token_time)
+            line = json.dumps(payload, ensure_ascii=False).encode('utf-8') + b'\n'
+            self.wfile.write(f'{len(line):x}\r\n'.encode() + line + b'\r\n')
+            self.wfile.flush()
+        self.wfile.write(b'0\r\n\r\n')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='本地模拟Ollama服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--models', default='qwen2,deepseek-r1,llava')
+    parser.add_argument('--load-time', type=float, default=2.0, help='模型加载耗时（秒）')
+    parser.add_argument('--max-loaded', type=int, default=1, help='同时加载的模型数上限')
+    parser.add_argument('--token-time', type=float, default=0.01, help='每个token的生成耗时（秒）')
+    args = parser.parse_args()
+    OllamaHandler.token_time = args.token_time
+
+    OllamaHandler.pool = ModelPool(args.models.split(','), args.load_time, args.max_loaded)
+    server = ThreadingHTTPServer((args.host, args.port), OllamaHandler)
+    print(f"模拟Ollama服务: http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,185 @@
+"""本地模拟的讯飞语音服务，用于在没有网络和API密钥时调试、压测语音模块
+
+实时语音转写(websocket)：接收二进制音频帧，收到{"end": true}后按rtasr协议先返回中间结果、
+再返回同一分段的最终结果，然后关闭连接。
+语音合成(HTTP POST)：返回与文本长度成正比的静音PCM，支持keep-alive长连接。
+
+用法：
+    python mock_xunfei_server.py --port 8765 --text "你好世界"
+然后把XunfeiASR的base_url指向 ws://127.0.0.1:8765/v1/ws
+"""
+import argparse
+import base64
+import hashlib
+import json
+import socketserver
+import struct
+import threading
+import time
+
+_WS_MAGIC = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+OPCODE_TEXT = 0x1
+OPCODE_BINARY = 0x2
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+def _read_exact(rfile, size: int) -> bytes:
+    data = rfile.read(size)
+    if len(data) < size:
+        raise ConnectionError("连接已关闭")
+    return data
+
+def read_frame(rfile):
+    """读取一个websocket帧，返回(opcode, payload)"""
+    first, second = _read_exact(rfile, 2)
+    opcode = first & 0x0F
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack('>H', _read_exact(rfile, 2))[0]
+    elif length == 127:
+        length = struct.unpack('>Q', _read_exact(rfile, 8))[0]
+    mask = _read_exact(rfile, 4) if second & 0x80 else None
+    payload = _read_exact(rfile, length)
+    if mask:
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return opcode, payload
+
+def write_frame(wfile, opcode: int, payload: bytes) -> None:
+    header = bytes([0x80 | opcode])
+    length = len(payload)
+    if length < 126:
+        header += bytes([length])
+    elif length < 65536:
+        header += bytes([126]) + struct.pack('>H', length)
+    else:
+        header += bytes([127]) + struct.pack('>Q', length)
+    wfile.write(header + payload)
+    wfile.flush()
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        # 每个TCP连接计一次握手，同一连接上可以处理多个HTTP请求
+        self.server.handshakes += 1
+        while True:
+            request_line = self.rfile.readline().decode('latin-1').strip()
+            if not request_line:
+                return
+            headers = {}
+            while True:
+                line = self.rfile.readline().decode('latin-1').strip()
+                if not line:
+                    break
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            if headers.get('upgrade', '').lower() == 'websocket':
+                self._handle_websocket(headers)
+                return
+            self.server.http_requests += 1
+            if not self._handle_tts(headers):
+                return
+
+    def _handle_tts(self, headers) -> bool:
+        body = json.loads(self.rfile.read(int(headers.get('content-length', 0))) or b'{}')
+        text = base64.b64decode(body.get('data', {}).get('text', '')).decode('utf-8')
+        time.sleep(self.server.latency)
+        # 每个字约0.1秒的16kHz 16bit静音
+        audio = b'\0' * (3200 * len(text))
+        payload = json.dumps({'code': 0, 'data': {'audio': base64.b64encode(audio).decode()}}).encode()
+        keep_alive = headers.get('connection', '').lower() != 'close'
+        self.wfile.write(
+            'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+            f'Content-Length: {len(payload)}\r\n'
+            f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode() + payload
+        )
+        self.wfile.flush()
+        return keep_alive
+
+    def _handle_websocket(self, headers):
+        accept = base64.b64encode(
+            hashlib.sha1((headers['sec-websocket-key'] + _WS_MAGIC).encode()).digest()
+        ).decode()
+        self.wfile.write(
+            'HTTP/1.1 101 Switching Protocols\r\n'
+            'Upgrade: websocket\r\nConnection: Upgrade\r\n'
+            f'Sec-WebSocket-Accept: {accept}\r\n\r\n'.encode()
+        )
+        self.wfile.flush()
+
+        received = 0
+        while True:
+            try:
+                opcode, payload = read_frame(self.rfile)
+            except (ConnectionError, OSError):
+                return
+            if opcode == OPCODE_BINARY:
+                received += len(payload)
+                self.server.audio_bytes += len(payload)
+            elif opcode == OPCODE_PING:
+                write_frame(self.wfile, OPCODE_PONG, payload)
+            elif opcode == OPCODE_CLOSE:
+                write_frame(self.wfile, OPCODE_CLOSE, payload[:2])
+                return
+            elif opcode == OPCODE_TEXT and json.loads(payload.decode('utf-8')).get('end'):
+                time.sleep(self.server.latency)
+                self._send_result(received)
+                write_frame(self.wfile, OPCODE_CLOSE, struct.pack('>H', 1000))
+                return
+
+    def _send_result(self, received: int) -> None:
+        text = self.server.text if received else ''
+        if not text:
+            return
+        # 前半句作为中间结果(type=1)，随后是同一seg_id的最终结果(type=0)
+        for words, result_type in ((text[:max(1, len(text) // 2)], '1'), (text, '0')):
+            data = {'seg_id': 0, 'ls': result_type == '0', 'cn': {'st': {
+                'bg': '0', 'ed': '0', 'type': result_type,
+                'rt': [{'ws': [{'wb': 0, 'we': 0, 'cw': [{'w': words, 'wp': 'n'}]}]}],
+            }}}
+            message = {'action': 'result', 'code': '0', 'desc': 'success', 'sid': 'mock',
+                       'data': json.dumps(data, ensure_ascii=False)}
+            write_frame(self.wfile, OPCODE_TEXT, json.dumps(message, ensure_ascii=False).encode('utf-8'))
+
+class MockXunfeiServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, text: str = '模拟识别结果', latency: float = 0.0):
+        super().__init__((host, port), _Handler)
+        self.text = text
+        self.latency = latency
+        self.handshakes = 0
+        self.http_requests = 0
+        self.audio_bytes = 0
+
+    @property
+    def asr_url(self) -> str:
+        host, port = self.server_address
+        return f'ws://{host}:{port}/v1/ws'
+
+    @property
+    def tts_url(self) -> str:
+        host, port = self.server_address
+        return f'http://{host}:{port}/v2/tts'
+
+    def start(self) -> 'MockXunfeiServer':
+        """在后台线程中运行"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='本地模拟讯飞语音服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--text', default='模拟识别结果')
+    parser.add_argument('--latency', type=float, default=0.0, help='返回结果前的模拟处理延迟（秒）')
+    args = parser.parse_args()
+
+    server = MockXunfeiServer(args.host, args.port, args.text, args.latency)
+    print(f"模拟讯飞服务已启动: {server.asr_url} {server.tts_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,202 @@
+import logging
+import math
+import re
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Optional, Union
+
+from config_loader import get_section
+
+DEFAULT_RESIDENCY = {
+    'preload': True,
+    'default_keep_alive': '5m',
+    # 每个模型在显存中的保留时间，格式同Ollama的keep_alive（如"30m"、"1h"、-1表示一直保留）
+    'keep_alive': {'qwen2': '30m', 'deepseek-r1': '10m'},
+    # 路由得分差距小于该值时优先使用已加载的模型
+    'switch_margin': 0.5,
+    # 多久向Ollama查询一次已加载模型（ps）
+    'ps_interval': 10,
+    # load_duration超过该秒数计为一次冷启动
+    'cold_start_threshold': 0.5,
+}
+
+_DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+def parse_keep_alive(value: Union[str, int, float, None]) -> float:
+    """把keep_alive换算为秒；负数表示一直保留，返回inf"""
+    if value is None:
+        return 300.0
+    if isinstance(value, (int, float)):
+        seconds = float(value)
+    else:
+        seconds = 0.0
+        parts = re.findall(r'(-?\d+(?:\.\d+)?)(ms|s|m|h)?', value.strip())
+        for number, unit in parts:
+            seconds += float(number) * _DURATION_UNITS[unit or 's']
+    return math.inf if seconds < 0 else seconds
+
+def _base_name(name: str) -> str:
+    # Ollama返回的名称带有标签（qwen2:latest），与配置中的名称比较时去掉
+    return name.split(':')[0]
+
+def _field(item: Any, key: str) -> Any:
+    """兼容Ollama返回的字典和响应对象"""
+    if isinstance(item, dict):
+        return item.get(key)
+    return getattr(item, key, None)
+
+class ModelResidencyManager:
+    """跟踪和控制Ollama中哪些模型常驻内存
+
+    多个模型轮流使用时Ollama会换入换出模型，切换后的第一个请求要等待数秒加载。
+    本类负责：启动时用空提示预加载默认模型；为每个模型设置keep_alive；
+    定期通过ps查询已加载的模型，冷启动加载后立即刷新以发现被换出的模型；
+    路由选择勉强时优先使用已加载的模型；统计各模型的冷启动次数。
+    """
+
+    def __init__(self, client_factory: Callable[[], Any], settings: Optional[Dict[str, Any]] = None):
+        settings = dict(DEFAULT_RESIDENCY, **(settings or {}))
+        self._client_factory = client_factory
+        self.preload_enabled = settings['preload']
+        self.default_keep_alive = settings['default_keep_alive']
+        self.keep_alive = settings['keep_alive']
+        self.switch_margin = settings['switch_margin']
+        self.ps_interval = settings['ps_interval']
+        self.cold_start_threshold = settings['cold_start_threshold']
+        self.cold_starts: Dict[str, int] = {}
+        self.warm_requests: Dict[str, int] = {}
+        self.load_seconds = 0.0
+        self.rerouted = 0
+        self._resident: Dict[str, float] = {}  # 模型基础名 -> 预计被卸载的monotonic时间
+        self._checked_at: Optional[float] = None
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, client_factory: Callable[[], Any]) -> 'ModelResidencyManager':
+        return cls(client_factory, get_section('residency', DEFAULT_RESIDENCY))
+
+    def keep_alive_for(self, model_key: str) -> Union[str, int, float]:
+        return self.keep_alive.get(model_key, self.default_keep_alive)
+
+    def _expiry(self, model_key: str) -> float:
+        return time.monotonic() + parse_keep_alive(self.keep_alive_for(model_key))
+
+    def refresh(self) -> bool:
+        """通过ps查询Ollama当前加载的模型，返回是否查询成功"""
+        try:
+            response = self._client_factory().ps()
+        except Exception as e:
+            # 失败后同样等待ps_interval再重试，Ollama未启动时不会每次路由都发起查询
+            self._checked_at = time.monotonic()
+            logging.warning(f"查询已加载模型失败: {e}")
+            return False
+        resident = {}
+        now_wall, now = time.time(), time.monotonic()
+        for model in _field(response, 'models') or []:
+            name = _base_name(_field(model, 'model') or _field(model, 'name') or '')
+            expires_at = _field(model, 'expires_at')
+            if isinstance(expires_at, str):
+                try:
+                    expires_at = datetime.fromisoformat(expires_at)
+                except ValueError:
+                    expires_at = None
+            if isinstance(expires_at, datetime):
+                resident[name] = now + (expires_at.timestamp() - now_wall)
+            else:
+                resident[name] = self._expiry(name)
+        with self._lock:
+            self._resident = resident
+            self._checked_at = now
+        return True
+
+    def _refresh_in_background(self) -> None:
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name='ollama-ps', daemon=True).start()
+
+    def resident_models(self) -> Dict[str, float]:
+        """当前已加载的模型及剩余保留秒数；数据过期时在后台刷新，本次返回已知状态"""
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.ps_interval:
+            self._refresh_in_background()
+        with self._lock:
+            return {name: expires - now for name, expires in self._resident.items() if expires > now}
+
+    def is_resident(self, model_name: str) -> bool:
+        return _base_name(model_name) in self.resident_models()
+
+    def record_load(self, model_name: str, was_resident: bool, load_duration_ns: Optional[int] = None) -> None:
+        """一次请求完成后调用：统计冷启动并把模型标记为已加载
+
+        Ollama返回load_duration时以它为准，否则按请求前是否已加载推断。
+        冷启动可能导致其他模型被换出，因此随后刷新一次已加载列表。
+        """
+        name = _base_name(model_name)
+        if load_duration_ns is not None:
+            load_seconds = load_duration_ns / 1e9
+            cold = load_seconds >= self.cold_start_threshold
+        else:
+            load_seconds = 0.0
+            cold = not was_resident
+        with self._lock:
+            self._resident[name] = self._expiry(name)
+            counter = self.cold_starts if cold else self.warm_requests
+            counter[name] = counter.get(name, 0) + 1
+            if cold:
+                self.load_seconds += load_seconds
+        if cold:
+            logging.info(f"模型 {name} 冷启动，加载耗时 {load_seconds:.1f}秒")
+            self._refresh_in_background()
+
+    def preload(self, model_name: str, model_key: Optional[str] = None) -> bool:
+        """用空提示让Ollama加载模型并按keep_alive保留，不生成内容"""
+        was_resident = self.is_resident(model_name)
+        try:
+            result = self._client_factory().generate(model=model_name, prompt='',
+                                                     keep_alive=self.keep_alive_for(model_key or model_name))
+        except Exception as e:
+            logging.warning(f"预加载模型 {model_name} 失败: {e}")
+            return False
+        self.record_load(model_name, was_resident, _field(result, 'load_duration'))
+        return True
+
+    def prefer_resident(self, decision: Any, candidates: Iterable[str],
+                        resolve: Callable[[str], str] = lambda name: name) -> str:
+        """路由结果得分差距小且所选模型未加载时，改用得分最高的已加载模型
+
+        decision为model_router.RoutingDecision；resolve把模型键换算为Ollama中的名称。
+        """
+        if decision.margin >= self.switch_margin:
+            return decision.model
+        resident = self.resident_models()
+        if _base_name(resolve(decision.model)) in resident:
+            return decision.model
+        loaded = [name for name in candidates if _base_name(resolve(name)) in resident]
+        if not loaded:
+            return decision.model
+        choice = max(loaded, key=lambda name: decision.scores.get(name, 0.0))
+        with self._lock:
+            self.rerouted += 1
+        return choice
+
+    def get_stats(self) -> Dict[str, Any]:
+        resident = self.resident_models()
+        with self._lock:
+            return {
+                'resident': sorted(resident),
+                'cold_starts': dict(self.cold_starts),
+                'warm_requests': dict(self.warm_requests),
+                'load_seconds': self.load_seconds,
+                'rerouted': self.rerouted,
+            }
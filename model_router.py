@@ -0,0 +1,181 @@
+import logging
+from collections import deque
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from config_loader import get_section
+
+DEFAULT_ROUTING = {
+    'default_model': 'qwen2',
+    # 得分低于该值时使用默认模型
+    'min_score': 1.0,
+    'rules': [
+        {
+            'model': 'deepseek-r1',
+            'weight': 1.0,
+            'keywords': ['专业', '技术', '学术', '代码', '编程', '算法', '推理', '证明',
+                         'code', 'python', 'algorithm', 'debug'],
+        },
+    ],
+    'length_rules': [
+        {'min_length': 500, 'model': 'deepseek-r1', 'weight': 1.0},
+    ],
+    'language_rules': {},
+}
+
+class _AhoCorasick:
+    """多关键词匹配自动机，扫描一遍文本即可找出全部命中的关键词，耗时与关键词数量无关"""
+
+    def __init__(self, patterns: List[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[Tuple[int, ...]] = [()]
+        for index, pattern in enumerate(patterns):
+            self._insert(pattern, index)
+        self._build_failure_links()
+
+    def _insert(self, pattern: str, index: int) -> None:
+        state = 0
+        for ch in pattern:
+            next_state = self._goto[state].get(ch)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][ch] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+            state = next_state
+        self._output[state] += (index,)
+
+    def _build_failure_links(self) -> None:
+        pending = deque(self._goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for ch, next_state in self._goto[state].items():
+                pending.append(next_state)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(ch, 0)
+                if self._fail[next_state] == next_state:
+                    self._fail[next_state] = 0
+                self._output[next_state] += self._output[self._fail[next_state]]
+
+    def find_all(self, text: str) -> Iterator[int]:
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if output[state]:
+                yield from output[state]
+
+class RoutingDecision:
+    __slots__ = ('model', 'scores', 'margin')
+
+    def __init__(self, model: str, scores: Dict[str, float], margin: float):
+        self.model = model
+        # 各模型的得分
+        self.scores = scores
+        # 选中模型比第二名高出的分数（默认模型未命中规则时按0分参与比较），越小说明选择越勉强；
+        # 得分不足而退回默认模型时为距离最低得分要求的差值
+        self.margin = margin
+
+class ModelRouter:
+    """根据配置规则为输入选择模型
+
+    特征包括关键词命中（预编译为一个Aho-Corasick自动机）、输入长度和语言。
+    返回的模型一定是available_models中的键，引用未知模型的规则在加载时被丢弃。
+    """
+
+    def __init__(self, available_models: Iterable[str], settings: Optional[Dict[str, Any]] = None,
+                 language_detector: Optional[Callable[[str], str]] = None):
+        settings = settings or DEFAULT_ROUTING
+        self.available_models = set(available_models)
+        self.language_detector = language_detector
+        self.min_score = settings.get('min_score', 1.0)
+
+        self.default_model = settings.get('default_model', 'qwen2')
+        if self.default_model not in self.available_models:
+            logging.warning(f"路由默认模型 {self.default_model} 不可用")
+            self.default_model = sorted(self.available_models)[0]
+
+        keywords: List[str] = []
+        self._keyword_targets: List[Tuple[str, float]] = []
+        for rule in settings.get('rules', []):
+            if not self._is_valid(rule.get('model')):
+                continue
+            for keyword in rule.get('keywords', []):
+                keywords.append(keyword.lower())
+                self._keyword_targets.append((rule['model'], rule.get('weight', 1.0)))
+        self._matcher = _AhoCorasick(keywords)
+
+        self._length_rules = [rule for rule in settings.get('length_rules', [])
+                              if self._is_valid(rule.get('model'))]
+        self._language_rules = {language: rule for language, rule in settings.get('language_rules', {}).items()
+                                if self._is_valid(rule.get('model'))}
+
+    @classmethod
+    def from_config(cls, available_models: Iterable[str],
+                    language_detector: Optional[Callable[[str], str]] = None) -> 'ModelRouter':
+        return cls(available_models, get_section('routing', DEFAULT_ROUTING), language_detector)
+
+    def _is_valid(self, model: Optional[str]) -> bool:
+        if model in self.available_models:
+            return True
+        logging.warning(f"路由规则引用了未知模型 {model}，已忽略")
+        return False
+
+    def route(self, prompt: str, language: Optional[str] = None) -> RoutingDecision:
+        scores: Dict[str, float] = {}
+
+        # 同一个关键词在一次输入中只计一次
+        for index in set(self._matcher.find_all(prompt.lower())):
+            model, weight = self._keyword_targets[index]
+            scores[model] = scores.get(model, 0.0) + weight
+
+        for rule in self._length_rules:
+            if len(prompt) >= rule['min_length']:
+                scores[rule['model']] = scores.get(rule['model'], 0.0) + rule.get('weight', 1.0)
+
+        if self._language_rules:
+            if language is None and self.language_detector:
+                language = self.language_detector(prompt)
+            rule = self._language_rules.get(language)
+            if rule:
+                scores[rule['model']] = scores.get(rule['model'], 0.0) + rule.get('weight', 1.0)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        if not ranked or ranked[0][1] < self.min_score:
+            best_score = ranked[0][1] if ranked else 0.0
+            return RoutingDecision(self.default_model, scores, self.min_score - best_score)
+
+        model, best = ranked[0]
+        # 与其他模型比较，默认模型即使没有命中规则也是备选，按其得分（可能为0）计入
+        others = [score for _, score in ranked[1:]]
+        if model != self.default_model:
+            others.append(scores.get(self.default_model, 0.0))
+        return RoutingDecision(model, scores, best - max(others, default=0.0))
+
+    def select(self, prompt: str, language: Optional[str] = None) -> str:
+        return self.route(prompt, language).model
+
+if __name__ == '__main__':
+    # 路由性能基准：数千条关键词规则下每条输入的平均耗时
+    import random
+    import time
+
+    random.seed(0)
+    chars = '的一是在不了有和人这中大为上们个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政四日那社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意建月公无系军很情者最立代想已通并提直题党程展五果料象员革位入常文总次品式活设及管特件长求老头基资边流路级少图山统接知较将组见计别她手角期根论运农指几九区强放决西被干做必战先回则任取据处队南给色光门即保治北造百规热领七海口东导器压志世金增争济阶油思术极交受联什认六共权收证改清己美再采转更单风切打白教速花带安场身车例真务具万每目至达走积示议声报斗完类八离华名确才科张信马节话米整空元况今集温传土许步群广石记需段研界拉林律叫且究观越织装影算低持音众书布复容儿须际商非验连断深难近矿千周委素技备半办青省列习响约支般史感劳便团往酸历市克何除消构府称太准精值号率族维划选标写存候毛亲快效斯院查江型眼王按格养易置派层片始却专状育厂京识适属圆包火住调满县局照参红细引听该铁价严'
+    rules = [{'model': 'deepseek-r1', 'weight': 1.0,
+              'keywords': [''.join(random.sample(chars, 3)) for _ in range(5000)]}]
+    router = ModelRouter(['qwen2', 'deepseek-r1'],
+                         dict(DEFAULT_ROUTING, rules=DEFAULT_ROUTING['rules'] + rules))
+    prompts = [''.join(random.choices(chars, k=random.randint(10, 200))) for _ in range(2000)]
+
+    start = time.perf_counter()
+    for prompt in prompts:
+        router.select(prompt)
+    elapsed = time.perf_counter() - start
+    print(f"关键词数量: {len(router._keyword_targets)}")
+    print(f"平均每条输入路由耗时: {elapsed / len(prompts) * 1e6:.1f} 微秒")
@@ -0,0 +1,145 @@
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+from config_loader import get_section, resolve_path
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+_STATE_FORMAT = '<dd'
+_STATE_SIZE = struct.calcsize(_STATE_FORMAT)
+
+class TokenBucket:
+    """令牌桶限流，进程内所有会话共用
+
+    每次请求在锁内预约一个令牌：令牌不足时记为欠账，按欠账算出需要等待的时间，
+    因此先到的请求先得到令牌（FIFO），等待的线程只在自己的时刻醒来一次，不会轮询或盲目退避。
+    指定state_path时桶的状态保存在文件中并用文件锁保护，多个Streamlit进程共用同一个额度。
+    """
+
+    def __init__(self, rate: float, burst: float = 1.0, state_path: Optional[str] = None):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.state_path = state_path
+        self._tokens = self.burst
+        self._updated = time.time()
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self.acquired = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.longest_wait = 0.0
+
+    @classmethod
+    def from_config(cls, name: str) -> 'TokenBucket':
+        settings = get_section('rate_limit', {
+            'state_dir': None,
+            'xunfei_asr': {'rate': 1.0, 'burst': 2},
+            'xunfei_tts': {'rate': 5.0, 'burst': 5},
+        })
+        bucket = settings.get(name) or {'rate': 1.0, 'burst': 1}
+        state_path = None
+        if settings['state_dir']:
+            state_dir = resolve_path(settings['state_dir'])
+            os.makedirs(state_dir, exist_ok=True)
+            state_path = os.path.join(state_dir, f'{name}.bucket')
+        return cls(bucket['rate'], bucket['burst'], state_path)
+
+    @contextmanager
+    def _state(self) -> Iterator[list]:
+        """在锁内读取并写回(令牌数, 更新时间)"""
+        with self._lock:
+            if not self.state_path:
+                state = [self._tokens, self._updated]
+                yield state
+                self._tokens, self._updated = state
+                return
+            with open(self.state_path, 'a+b') as f:
+                f.seek(0)
+                if fcntl:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                else:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                try:
+                    f.seek(0)
+                    data = f.read(_STATE_SIZE)
+                    if len(data) == _STATE_SIZE:
+                        state = list(struct.unpack(_STATE_FORMAT, data))
+                    else:
+                        state = [self.burst, time.time()]
+                    yield state
+                    f.seek(0)
+                    f.truncate()
+                    f.write(struct.pack(_STATE_FORMAT, *state))
+                    f.flush()
+                finally:
+                    f.seek(0)
+                    if fcntl:
+                        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                    else:
+                        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def reserve(self, max_wait: Optional[float] = None) -> Optional[float]:
+        """预约一个令牌，返回需要等待的秒数；等待超过max_wait时不预约，返回None"""
+        with self._state() as state:
+            now = time.time()
+            tokens = min(self.burst, state[0] + (now - state[1]) * self.rate)
+            delay = 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+            if max_wait is not None and delay > max_wait:
+                state[0], state[1] = tokens, now
+                return None
+            state[0], state[1] = tokens - 1, now
+            return delay
+
+    def _refund(self) -> None:
+        with self._state() as state:
+            state[0] = min(self.burst, state[0] + 1)
+
+    def acquire(self, max_wait: Optional[float] = None, cancel: Optional[threading.Event] = None) -> bool:
+        """等待轮到自己；排队时间超过max_wait或cancel被设置时放弃并返回False"""
+        delay = self.reserve(max_wait)
+        if delay is None:
+            with self._lock:
+                self.rejected += 1
+            return False
+        if delay > 0:
+            with self._lock:
+                self._waiting += 1
+            try:
+                if cancel is not None:
+                    if cancel.wait(delay):
+                        # 放弃的请求归还令牌，排在后面的请求不必多等
+                        self._refund()
+                        return False
+                else:
+                    time.sleep(delay)
+            finally:
+                with self._lock:
+                    self._waiting -= 1
+        with self._lock:
+            self.acquired += 1
+            self.total_wait += delay
+            self.longest_wait = max(self.longest_wait, delay)
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'queue_depth': self._waiting,
+                'acquired': self.acquired,
+                'rejected': self.rejected,
+                'avg_wait': self.total_wait / self.acquired if self.acquired else 0.0,
+                'max_wait': self.longest_wait,
+            }
+
+# 初始化全局实例
+xunfei_asr_limiter = TokenBucket.from_config('xunfei_asr')
+xunfei_tts_limiter = TokenBucket.from_config('xunfei_tts')
@@ -0,0 +1,200 @@
+import math
+import random
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from config_loader import get_section
+
+# 类名中包含这些词的异常一般是网络或服务端的暂时性问题
+_TRANSIENT_NAME_HINTS = ('Timeout', 'Connect', 'Network', 'Remote', 'Protocol', 'Unavailable')
+_FATAL_TEXT_HINTS = ('not found', 'invalid', 'unauthorized', 'forbidden', 'license')
+
+class CircuitOpenError(Exception):
+    """熔断期间直接拒绝的请求"""
+
+    def __init__(self, backend: str, retry_after: float):
+        super().__init__(f"{backend}服务暂时不可用，请{max(1, math.ceil(retry_after))}秒后再试")
+        self.backend = backend
+        self.retry_after = retry_after
+
+class ErrorMessage(str):
+    """展示给用户的错误提示
+
+    是str的子类，可以像回答一样直接显示和播报，同时保留原始异常、是否可重试和出错的服务，
+    调用方用isinstance区分错误与模型回答，错误不会被清理或写入缓存。
+    """
+
+    def __new__(cls, text: str, error: Optional[BaseException] = None,
+                retryable: bool = False, backend: Optional[str] = None):
+        message = super().__new__(cls, text)
+        message.error = error
+        message.retryable = retryable
+        message.backend = backend
+        return message
+
+def is_retryable(error: BaseException) -> bool:
+    """判断异常是暂时性的（值得重试）还是致命的（重试也不会成功）"""
+    if isinstance(error, CircuitOpenError):
+        return False
+    status = getattr(error, 'status_code', None)
+    if isinstance(status, int):
+        return status == 408 or status == 429 or status >= 500
+    text = str(error).lower()
+    if any(hint in text for hint in _FATAL_TEXT_HINTS):
+        return False
+    if isinstance(error, (ConnectionError, TimeoutError, OSError)):
+        return True
+    if any(hint in type(error).__name__ for hint in _TRANSIENT_NAME_HINTS):
+        return True
+    # 编程错误和参数错误重试没有意义
+    return not isinstance(error, (ValueError, TypeError, KeyError, AttributeError, NotImplementedError))
+
+class DecorrelatedJitterBackoff:
+    """去相关抖动退避：下一次等待时间在[base, 上次等待 * multiplier]之间随机选取
+
+    多个调用方同时失败时重试时间被打散，不会在同一时刻一起冲击刚恢复的服务。
+    """
+
+    def __init__(self, base: float = 0.2, cap: float = 5.0, multiplier: float = 3.0):
+        self.base = base
+        self.cap = cap
+        self.multiplier = multiplier
+        self._last = base
+
+    def next_delay(self) -> float:
+        self._last = min(self.cap, random.uniform(self.base, self._last * self.multiplier))
+        return self._last
+
+class RetryBudget:
+    """全局重试预算
+
+    每个请求存入ratio个令牌，每次重试消耗一个；另外每秒补充min_per_second个，
+    保证低流量时也能重试。服务整体故障时重试次数被限制在请求量的一定比例内，不会放大负载。
+    """
+
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 1.0, max_tokens: float = 10.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.exhausted = 0
+
+    def _refill(self, amount: float) -> None:
+        now = time.monotonic()
+        amount += (now - self._updated) * self.min_per_second
+        self._updated = now
+        self._tokens = min(self.max_tokens, self._tokens + amount)
+
+    def record_request(self) -> None:
+        with self._lock:
+            self._refill(self.ratio)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            self._refill(0.0)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            self.exhausted += 1
+            return False
+
+class CircuitBreaker:
+    """单个后端服务的熔断器
+
+    连续failure_threshold次暂时性失败后进入打开状态，reset_timeout秒内的请求立即失败；
+    之后进入半开状态，只放行一个探测请求，成功则恢复，失败则重新打开。
+    探测请求超过reset_timeout仍未报告结果时（例如被取消），允许再放行一个。
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, failure_threshold: int = 3, reset_timeout: float = 10.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._probe_started: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            now = time.monotonic()
+            if self.state == self.OPEN and now - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._probe_started = None
+            if self.state == self.HALF_OPEN and (self._probe_started is None
+                                                 or now - self._probe_started >= self.reset_timeout):
+                self._probe_started = now
+                return True
+            self.rejected += 1
+            return False
+
+    def check(self) -> None:
+        """不允许请求时抛出CircuitOpenError"""
+        if not self.allow():
+            raise CircuitOpenError(self.name, self.retry_after)
+
+    @property
+    def retry_after(self) -> float:
+        return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probe_started = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_started = None
+
+    def release(self) -> None:
+        """放弃已放行的请求而不报告结果，例如改由另一个请求（流式失败后的普通生成）完成；
+        半开状态下让出探测名额"""
+        with self._lock:
+            self._probe_started = None
+
+    def record_error(self, error: BaseException) -> None:
+        """按异常类型记录：致命错误说明服务本身可以响应，不计为故障"""
+        if is_retryable(error):
+            self.record_failure()
+        elif not isinstance(error, CircuitOpenError):
+            self.record_success()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'state': self.state, 'failures': self.failures, 'rejected': self.rejected}
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """按服务名（ollama、xunfei、google）获取共享的熔断器"""
+    with _breakers_lock:
+        if name not in _breakers:
+            settings = get_section('resilience', {'failure_threshold': 3, 'reset_timeout': 10})
+            _breakers[name] = CircuitBreaker(name, settings['failure_threshold'], settings['reset_timeout'])
+        return _breakers[name]
+
+def get_breaker_stats() -> Dict[str, Dict[str, Any]]:
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.get_stats() for breaker in breakers}
+
+# 初始化全局实例
+_budget_settings = get_section('resilience', {'retry_budget_ratio': 0.2, 'retry_budget_per_second': 1.0})
+retry_budget = RetryBudget(_budget_settings['retry_budget_ratio'], _budget_settings['retry_budget_per_second'])
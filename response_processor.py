@@ -21,4 +21,85 @@ def clean_response(response: str) -> str:
     # 移除开头和结尾的空白字符
     response = response.strip()
     
-    return response
\ No newline at end of file
+    return response
+
+class StreamingResponseCleaner:
+    """增量清理流式输出，能够处理被分块截断的<think>标签
+
+    每次调用 feed() 传入模型新产生的文本片段，返回当前可以安全显示的文本；
+    可能属于未闭合标签的部分会暂存，直到后续片段到达或调用 flush()。
+    """
+
+    THINK_OPEN = '<think>'
+    THINK_CLOSE = '</think>'
+    # 超过该长度仍未出现'>'时，认为'<'只是普通字符
+    MAX_TAG_LENGTH = 64
+
+    def __init__(self):
+        self._buffer = ''
+        self._in_think = False
+        self._started = False
+
+    def feed(self, chunk: str) -> str:
+        """输入一个文本片段，返回可以显示的清理后文本"""
+        self._buffer += chunk
+        output = []
+
+        while self._buffer:
+            if self._in_think:
+                end = self._buffer.find(self.THINK_CLOSE)
+                if end == -1:
+                    # 保留可能是半个结束标签的尾部
+                    self._buffer = self._buffer[-(len(self.THINK_CLOSE) - 1):]
+                    break
+                self._buffer = self._buffer[end + len(self.THINK_CLOSE):]
+                self._in_think = False
+                continue
+
+            start = self._buffer.find('<')
+            if start == -1:
+                output.append(self._buffer)
+                self._buffer = ''
+                break
+
+            output.append(self._buffer[:start])
+            self._buffer = self._buffer[start:]
+
+            if self._buffer.startswith(self.THINK_OPEN):
+                self._buffer = self._buffer[len(self.THINK_OPEN):]
+                self._in_think = True
+                continue
+            if self.THINK_OPEN.startswith(self._buffer):
+                # 可能是被截断的<think>，等待更多内容
+                break
+
+            close = self._buffer.find('>')
+            if close == -1:
+                if len(self._buffer) < self.MAX_TAG_LENGTH:
+                    break
+                output.append('<')
+                self._buffer = self._buffer[1:]
+            elif close == 1:
+                # "<>"不是标签，与clean_response保持一致
+                output.append('<>')
+                self._buffer = self._buffer[2:]
+            else:
+                # 移除其他XML标签
+                self._buffer = self._buffer[close + 1:]
+
+        return self._emit(''.join(output))
+
+    def flush(self) -> str:
+        """流结束时调用，返回暂存的剩余文本"""
+        remaining = '' if self._in_think else self._buffer
+        self._buffer = ''
+        self._in_think = False
+        return self._emit(remaining)
+
+    def _emit(self, text: str) -> str:
+        # 去掉回答开头的空白（例如</think>之后的换行）
+        if not self._started:
+            text = text.lstrip()
+            if text:
+                self._started = True
+        return text
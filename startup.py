@@ -0,0 +1,114 @@
+"""启动加速：延迟导入重量级依赖，并统计首屏时间
+
+    python startup.py    # 按-X importtime统计导入utils和app依赖时各模块的耗时
+"""
+import importlib
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator, List, Optional, Tuple
+
+class LazyModule:
+    """模块代理，第一次访问属性时才真正导入
+
+    用法：ollama = lazy_import('ollama')，之后照常使用ollama.Client()。
+    """
+
+    def __init__(self, name: str):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+        self.__dict__['_lock'] = threading.Lock()
+
+    def _load(self) -> Any:
+        module = self.__dict__['_module']
+        if module is None:
+            with self.__dict__['_lock']:
+                module = self.__dict__['_module']
+                if module is None:
+                    start = time.perf_counter()
+                    module = importlib.import_module(self.__dict__['_name'])
+                    startup_profiler.record(f"延迟导入 {self.__dict__['_name']}", time.perf_counter() - start)
+                    self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr: str, value: Any) -> None:
+        setattr(self._load(), attr, value)
+
+    def __repr__(self) -> str:
+        state = '已导入' if self.__dict__['_module'] is not None else '未导入'
+        return f"<LazyModule {self.__dict__['_name']} ({state})>"
+
+def lazy_import(name: str) -> LazyModule:
+    return LazyModule(name)
+
+class StartupProfiler:
+    """记录启动各阶段耗时，首屏渲染完成时输出一次汇总"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sections: List[Tuple[str, float]] = []
+        self.first_paint: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.sections.append((name, seconds))
+
+    @contextmanager
+    def section(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def mark_first_paint(self) -> None:
+        """首次渲染完成时调用；每个进程只记录第一次"""
+        with self._lock:
+            if self.first_paint is not None:
+                return
+            self.first_paint = time.perf_counter() - self.started
+        print(self.report())
+
+    def report(self) -> str:
+        lines = [f"首屏时间: {self.first_paint * 1000:.0f} ms" if self.first_paint is not None else "尚未完成首屏渲染"]
+        with self._lock:
+            for name, seconds in self.sections:
+                lines.append(f"  {name}: {seconds * 1000:.1f} ms")
+        return '\n'.join(lines)
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int, int]]:
+    """解析-X importtime的输出，返回[(模块, 嵌套深度, 自身微秒, 累计微秒)]"""
+    timings = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        timings.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return timings
+
+# 初始化全局实例，导入本模块的时间即为启动计时起点
+startup_profiler = StartupProfiler()
+
+if __name__ == '__main__':
+    import subprocess
+    import sys
+
+    for target in ('utils', 'app_imports'):
+        code = 'import utils' if target == 'utils' else (
+            'import streamlit, utils, chat_pipeline, tts_pipeline, asr_orchestrator, rate_limiter, cache_manager')
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                                capture_output=True, text=True)
+        if result.returncode:
+            print(f"\n{target}: 导入失败 {result.stderr.strip().splitlines()[-1]}")
+            continue
+        top_level = [(name, cumulative) for name, depth, _, cumulative in parse_importtime(result.stderr)
+                     if depth == 0]
+        total = sum(cumulative for _, cumulative in top_level)
+        print(f"\n{target}: 导入共 {total / 1000:.0f} ms")
+        for name, cumulative in sorted(top_level, key=lambda item: -item[1])[:15]:
+            print(f"  {name:<30} {cumulative / 1000:8.1f} ms")
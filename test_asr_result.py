@@ -0,0 +1,69 @@
+import json
+import os
+from typing import List
+
+from asr_result import ASRResultAssembler
+
+# 每行一条讯飞实时语音转写服务端消息，按接收顺序排列
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_data', 'rtasr')
+
+def load_frames(name: str) -> List[str]:
+    with open(os.path.join(FIXTURE_DIR, f'{name}.jsonl'), encoding='utf-8') as f:
+        return [line.rstrip('\n') for line in f if line.strip()]
+
+def feed_all(assembler: ASRResultAssembler, frames: List[str]) -> List[bool]:
+    return [assembler.feed(frame) for frame in frames]
+
+def test_partial_results_are_reported_as_captions():
+    captions = []
+    assembler = ASRResultAssembler(on_partial=captions.append)
+    frames = load_frames('session')
+    # started消息不产生文本
+    assert feed_all(assembler, frames[:3]) == [False, True, True]
+    assert assembler.partial_text == '今天天气'
+    assert assembler.final_text == ''
+    assert captions == ['今天', '今天天气']
+
+def test_final_results_are_joined_once():
+    captions = []
+    assembler = ASRResultAssembler(on_partial=captions.append)
+    feed_all(assembler, load_frames('session'))
+    assert assembler.text == '今天天气怎么样？适合出门吗？'
+    assert assembler.final_text == assembler.text
+    assert assembler.partial_text == ''
+    assert captions == ['今天', '今天天气', '今天天气怎么样？', '今天天气怎么样？适合',
+                        '今天天气怎么样？适合出门', '今天天气怎么样？适合出门吗？']
+
+def test_repeated_final_replaces_its_segment():
+    assembler = ASRResultAssembler()
+    frames = load_frames('segment_replacement')
+    feed_all(assembler, frames[:4])
+    assert assembler.text == '我想订机票去上海'
+    # 同一分段再次收到最终结果时替换原文本，后面的中间结果保持不变
+    assert assembler.feed(frames[4])
+    assert assembler.text == '我想定机票，去上海'
+    assert assembler.feed(frames[5])
+    assert assembler.text == '我想定机票，去上海。'
+
+def test_late_partial_after_final_is_ignored():
+    assembler = ASRResultAssembler()
+    assert feed_all(assembler, load_frames('late_partial')) == [False, True, False]
+    assert assembler.text == '你好'
+
+def test_error_frame_sets_error():
+    assembler = ASRResultAssembler()
+    assert feed_all(assembler, load_frames('error')) == [False]
+    assert assembler.error == ('10110', 'license error')
+    assert assembler.text == ''
+
+def test_reset_clears_previous_session():
+    assembler = ASRResultAssembler()
+    feed_all(assembler, load_frames('error') + load_frames('session'))
+    assembler.reset()
+    assert assembler.error is None
+    assert assembler.text == ''
+
+def test_legacy_result_format_is_final():
+    assembler = ASRResultAssembler()
+    assert assembler.feed(json.dumps({'code': 0, 'sid': 'mock', 'data': json.dumps({'result': '模拟识别结果'})}))
+    assert assembler.final_text == '模拟识别结果'
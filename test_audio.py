@@ -1,41 +1,31 @@
-import pyaudio
+import sys
 import time
 from xunfei_speech import XunfeiASR
+from audio_capture import MicrophoneCapture, FileInputDevice
 
-def recognize_speech():
+def recognize_speech(capture):
     asr = XunfeiASR()
-    p = pyaudio.PyAudio()
-    
-    # 设置音频参数
-    CHUNK = 1024
-    FORMAT = pyaudio.paInt16
-    CHANNELS = 1
-    RATE = 16000
     
     print("正在初始化语音识别...")
-    stream = p.open(format=FORMAT,
-                   channels=CHANNELS,
-                   rate=RATE,
-                   input=True,
-                   frames_per_buffer=CHUNK)
+    # 启动讯飞语音识别，边录音边发送音频帧
+    if not asr.open_stream():
+        return None, "无法连接讯飞语音识别服务"
     
+    # 从预录部分开始读取，连接建立期间的音频不会丢失
+    reader = capture.open_reader()
     print("请说话...")
     try:
-        # 启动讯飞语音识别
-        asr.start_listening()
-        
         # 录音5秒
-        for i in range(0, int(RATE / CHUNK * 5)):
-            data = stream.read(CHUNK)
-            if not asr.is_listening:
+        for i in range(0, int(capture.sample_rate / capture.frame_samples * 5)):
+            data = reader.read_frame()
+            if not data or not asr.is_listening:
                 break
+            asr.send_audio(data)
         
-        # 停止录音和识别
-        stream.stop_stream()
-        stream.close()
-        p.terminate()
-        
-        text = asr.stop_listening()
+        # 停止识别
+        text = asr.finish_stream()
+        if capture.overruns:
+            print(f"音频缓冲区溢出 {capture.overruns} 次")
         if text:
             print("识别结果: " + text)
             return text, None
@@ -48,14 +38,20 @@ def recognize_speech():
         return None, f"发生未知错误: {e}"
 
 if __name__ == '__main__':
-    while True:
-        result, error = recognize_speech()
-        if result:
-            print(f"\n成功识别: {result}")
-        elif error:
-            print(f"\n错误: {error}")
-        
-        time.sleep(1)  # 添加短暂延迟以防止CPU过度使用
-        choice = input("\n是否继续语音识别？(y/n): ")
-        if choice.lower() != 'y':
-            break
\ No newline at end of file
+    # 可以传入一个16kHz单声道WAV文件代替麦克风：python test_audio.py sample.wav
+    device = FileInputDevice(sys.argv[1], loop=True) if len(sys.argv) > 1 else None
+    capture = MicrophoneCapture(device=device).start()
+    try:
+        while True:
+            result, error = recognize_speech(capture)
+            if result:
+                print(f"\n成功识别: {result}")
+            elif error:
+                print(f"\n错误: {error}")
+            
+            time.sleep(1)  # 添加短暂延迟以防止CPU过度使用
+            choice = input("\n是否继续语音识别？(y/n): ")
+            if choice.lower() != 'y':
+                break
+    finally:
+        capture.stop()
@@ -0,0 +1,99 @@
+import wave
+
+import numpy as np
+import pytest
+
+from audio_capture import AudioRingBuffer, FileInputDevice, MicrophoneCapture
+
+SAMPLE_RATE = 16000
+
+@pytest.fixture
+def ramp_wav(tmp_path):
+    """2秒的WAV，采样值为递增序列（对16bit取模），可以据此判断读到的是哪一段音频"""
+    samples = (np.arange(SAMPLE_RATE * 2) % 30000).astype(np.int16)
+    path = tmp_path / 'ramp.wav'
+    with wave.open(str(path), 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(samples.tobytes())
+    return str(path), samples
+
+def captured(path: str, buffer_seconds: float = 1.0) -> MicrophoneCapture:
+    device = FileInputDevice(path, realtime=False)
+    capture = MicrophoneCapture(SAMPLE_RATE, buffer_seconds=buffer_seconds, device=device).start()
+    assert device.finished.wait(5)
+    return capture
+
+def test_reader_starts_at_the_preroll(ramp_wav):
+    path, samples = ramp_wav
+    capture = captured(path)
+    try:
+        reader = capture.open_reader()
+        assert capture.buffer.write_pos - reader.cursor == capture.preroll_samples
+        start = reader.cursor
+        frame = reader.read_frame()
+        assert isinstance(frame, memoryview) and len(frame) == capture.frame_samples * 2
+        assert np.array_equal(np.frombuffer(frame, dtype=np.int16), samples[start:start + capture.frame_samples])
+        assert reader.cursor == start + capture.frame_samples
+    finally:
+        capture.stop()
+
+def test_reader_without_preroll_waits_for_new_audio(ramp_wav):
+    path, _ = ramp_wav
+    capture = captured(path)
+    try:
+        reader = capture.open_reader(preroll=False)
+        assert reader.cursor == capture.buffer.write_pos
+        # 输入已经结束，没有新数据时超时返回空
+        assert reader.read_frame(timeout=0.05) == b''
+    finally:
+        capture.stop()
+
+def test_history_reads_before_the_cursor_without_moving_it(ramp_wav):
+    path, samples = ramp_wav
+    capture = captured(path)
+    try:
+        reader = capture.open_reader()
+        cursor = reader.cursor
+        history = np.frombuffer(reader.history(300), dtype=np.int16)
+        assert reader.cursor == cursor
+        assert np.array_equal(history, samples[cursor - len(history):cursor])
+        assert len(history) == SAMPLE_RATE * 300 // 1000
+    finally:
+        capture.stop()
+
+def test_lagging_reader_counts_an_overrun(ramp_wav):
+    path, samples = ramp_wav
+    capture = captured(path, buffer_seconds=1.0)
+    try:
+        # 从头读取时前1秒已被覆盖，跳到仍然有效的最早一帧
+        frame, cursor = capture.buffer.read_frame(0, timeout=0)
+        assert capture.overruns == 1
+        start = cursor - capture.frame_samples
+        assert start >= capture.buffer.write_pos - capture.buffer.capacity
+        assert np.array_equal(np.frombuffer(frame, dtype=np.int16), samples[start:cursor])
+    finally:
+        capture.stop()
+
+def test_level_reports_latest_frame_rms(ramp_wav):
+    path, samples = ramp_wav
+    capture = captured(path)
+    try:
+        # 不足一个数据块的结尾不会送出，最近一帧以实际写入位置为准
+        end = capture.buffer.write_pos
+        latest = samples[end - capture.frame_samples:end].astype(np.float32)
+        assert capture.level() == pytest.approx(float(np.sqrt(np.mean(latest ** 2))), rel=1e-4)
+    finally:
+        capture.stop()
+
+def test_ring_buffer_read_range_wraps_around():
+    frame = 480
+    buffer = AudioRingBuffer(4 * frame, frame)
+    data = np.arange(7 * frame, dtype=np.int16)
+    for index in range(7):
+        buffer.write(data[index * frame:(index + 1) * frame].tobytes())
+    assert np.array_equal(np.frombuffer(buffer.read_range(4 * frame, 7 * frame), dtype=np.int16), data[4 * frame:])
+    # 已被覆盖的部分被截掉
+    assert np.array_equal(np.frombuffer(buffer.read_range(0, 7 * frame), dtype=np.int16), data[3 * frame:])
+    assert buffer.read_range(5 * frame, 5 * frame) == b''
@@ -0,0 +1,48 @@
+from model_residency import ModelResidencyManager
+from model_router import DEFAULT_ROUTING, ModelRouter
+
+class _StubClient:
+    """只实现ps()的Ollama客户端，loaded为当前已加载的模型"""
+
+    def __init__(self, loaded):
+        self.loaded = loaded
+
+    def ps(self):
+        return {'models': [{'model': f'{name}:latest'} for name in self.loaded]}
+
+def _setup(loaded):
+    router = ModelRouter(['qwen2', 'deepseek-r1'], DEFAULT_ROUTING)
+    client = _StubClient(loaded)
+    residency = ModelResidencyManager(lambda: client, {'switch_margin': 0.5})
+    assert residency.refresh()
+    return router, residency
+
+def _select(router, residency, prompt):
+    decision = router.route(prompt)
+    return decision, residency.prefer_resident(decision, router.available_models)
+
+def test_single_keyword_match_is_not_marginal():
+    router, residency = _setup(['qwen2'])
+    decision, model = _select(router, residency, '帮我写代码')
+    assert decision.model == 'deepseek-r1'
+    assert decision.margin == 1.0
+    assert model == 'deepseek-r1'
+    assert residency.rerouted == 0
+
+def test_default_model_keeps_its_margin():
+    router, residency = _setup(['deepseek-r1'])
+    decision, model = _select(router, residency, '你好')
+    assert decision.model == 'qwen2'
+    assert model == 'qwen2'
+
+def test_marginal_choice_prefers_resident_model():
+    router = ModelRouter(['qwen2', 'deepseek-r1'], dict(DEFAULT_ROUTING, rules=[
+        {'model': 'deepseek-r1', 'weight': 1.0, 'keywords': ['代码']},
+        {'model': 'qwen2', 'weight': 1.0, 'keywords': ['解释']},
+    ]))
+    client = _StubClient(['qwen2'])
+    residency = ModelResidencyManager(lambda: client, {'switch_margin': 0.5})
+    assert residency.refresh()
+    decision = router.route('解释一下代码')
+    assert decision.margin == 0.0
+    assert residency.prefer_resident(decision, router.available_models) == 'qwen2'
@@ -0,0 +1,178 @@
+import asyncio
+import time
+
+import pytest
+
+import error_handler
+from error_handler import ErrorHandler, RetryStrategy
+from resilience import (CircuitBreaker, CircuitOpenError, DecorrelatedJitterBackoff, ErrorMessage,
+                        RetryBudget, is_retryable)
+
+class _Status(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+
+class ReadTimeout(Exception):
+    pass
+
+@pytest.fixture(autouse=True)
+def fresh_budget(monkeypatch):
+    # 全局重试预算在测试之间不共享
+    monkeypatch.setattr(error_handler, 'retry_budget', RetryBudget(max_tokens=100))
+
+def fast_strategy(max_retries: int = 3) -> RetryStrategy:
+    return RetryStrategy(max_retries=max_retries, delay=0.001, backoff=2.0, max_delay=0.005)
+
+@pytest.mark.parametrize('error', [
+    ConnectionError("Failed to connect to Ollama"),
+    TimeoutError(),
+    ReadTimeout("read timed out"),
+    _Status(503),
+    _Status(429),
+    RuntimeError("server hiccup"),
+])
+def test_transient_errors_are_retryable(error):
+    assert is_retryable(error)
+
+@pytest.mark.parametrize('error', [
+    Exception("model 'qwen' not found, try pulling it first"),
+    _Status(400),
+    _Status(404),
+    ValueError("bad argument"),
+    ConnectionError("unauthorized"),
+    CircuitOpenError('ollama', 3.0),
+])
+def test_fatal_errors_are_not_retryable(error):
+    assert not is_retryable(error)
+
+def test_breaker_opens_after_threshold_and_rejects():
+    breaker = CircuitBreaker('test', failure_threshold=3, reset_timeout=60)
+    for _ in range(2):
+        breaker.record_failure()
+        assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    with pytest.raises(CircuitOpenError) as info:
+        breaker.check()
+    assert info.value.backend == 'test' and info.value.retry_after > 0
+    assert breaker.get_stats()['rejected'] == 2
+
+def test_half_open_allows_a_single_probe():
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow()
+
+def test_failed_probe_reopens():
+    breaker = CircuitBreaker('test', failure_threshold=3, reset_timeout=0.05)
+    for _ in range(3):
+        breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN and not breaker.allow()
+
+def test_unreported_probe_expires_and_release_hands_it_over():
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+
+def test_fatal_error_counts_as_a_response():
+    breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=60)
+    breaker.record_failure()
+    breaker.record_error(Exception("model 'qwen' not found"))
+    assert breaker.failures == 0 and breaker.state == CircuitBreaker.CLOSED
+    breaker.record_error(CircuitOpenError('test', 1.0))
+    assert breaker.failures == 0
+
+def test_retry_budget_limits_retries():
+    budget = RetryBudget(ratio=0.5, min_per_second=0.0, max_tokens=2)
+    assert budget.try_spend() and budget.try_spend()
+    assert not budget.try_spend()
+    assert budget.exhausted == 1
+    budget.record_request()
+    budget.record_request()
+    assert budget.try_spend()
+    assert not budget.try_spend()
+
+def test_backoff_stays_within_bounds():
+    backoff = DecorrelatedJitterBackoff(base=0.1, cap=1.0, multiplier=3.0)
+    delays = [backoff.next_delay() for _ in range(50)]
+    assert all(0.1 <= delay <= 1.0 for delay in delays)
+
+def test_outage_fails_fast_once_the_breaker_opens():
+    breaker = CircuitBreaker('ollama', failure_threshold=3, reset_timeout=60)
+    calls = []
+
+    @ErrorHandler.with_retry(fast_strategy(), breaker)
+    def unreachable() -> str:
+        calls.append(1)
+        raise ConnectionError("Failed to connect to Ollama")
+
+    first = unreachable()
+    assert isinstance(first, ErrorMessage) and first.retryable and first.backend == 'ollama'
+    assert len(calls) == 3 and breaker.state == CircuitBreaker.OPEN
+
+    start = time.perf_counter()
+    second = unreachable()
+    assert time.perf_counter() - start < 0.05
+    assert len(calls) == 3
+    assert isinstance(second.error, CircuitOpenError) and not second.retryable
+
+def test_fatal_error_is_not_retried():
+    breaker = CircuitBreaker('ollama', failure_threshold=3, reset_timeout=60)
+    calls = []
+
+    @ErrorHandler.with_retry(fast_strategy(), breaker)
+    def missing_model() -> str:
+        calls.append(1)
+        raise Exception("model 'qwen' not found, try pulling it first")
+
+    result = missing_model()
+    assert len(calls) == 1 and not result.retryable
+    assert breaker.state == CircuitBreaker.CLOSED
+
+def test_retries_stop_when_budget_is_spent(monkeypatch):
+    monkeypatch.setattr(error_handler, 'retry_budget', RetryBudget(ratio=0.0, min_per_second=0.0, max_tokens=1))
+    calls = []
+
+    @ErrorHandler.with_retry(fast_strategy(max_retries=5))
+    def flaky() -> str:
+        calls.append(1)
+        raise ConnectionError("reset")
+
+    assert ErrorHandler.is_error_message(flaky())
+    assert len(calls) == 2
+
+def test_async_retry_recovers_after_transient_failure():
+    breaker = CircuitBreaker('ollama', failure_threshold=3, reset_timeout=60)
+    calls = []
+
+    @ErrorHandler.with_async_retry(fast_strategy(), breaker)
+    async def generate() -> str:
+        calls.append(1)
+        if len(calls) < 2:
+            raise ConnectionError("reset")
+        return "回答"
+
+    assert asyncio.run(generate()) == "回答"
+    assert breaker.failures == 0 and breaker.state == CircuitBreaker.CLOSED
+
+def test_error_message_is_distinguished_from_answers():
+    message = ErrorHandler.format_error(ConnectionError("down"), 'ollama')
+    assert ErrorHandler.is_error_message(message)
+    assert message.startswith(ErrorHandler.ERROR_PREFIX)
+    assert not ErrorHandler.is_error_message("抱歉，我不太明白你的意思。")
+    assert ErrorHandler.format_error(Exception("502 Bad Gateway")) == ErrorHandler.SERVER_BUSY_MESSAGE
@@ -1,21 +1,25 @@
+import os
+import tempfile
 import time
 from xunfei_speech import XunfeiTTS
 
 def text_to_speech(text, rate=50, volume=50, voice_id=None):
+    """合成到临时文件，返回(文件路径, 错误信息)"""
     try:
         tts = XunfeiTTS()
         
-        # 设置输出文件名
-        output_file = 'temp_speech.wav'
+        # 每次合成使用单独的临时文件，多次或并发调用不会互相覆盖
+        fd, output_file = tempfile.mkstemp(prefix='tts_', suffix='.wav')
+        os.close(fd)
         
         # 调用讯飞语音合成
         success, error = tts.text_to_speech(text, output_file)
         if success:
-            return True, None
-        else:
-            return False, error
+            return output_file, None
+        os.remove(output_file)
+        return None, error
     except Exception as e:
-        return False, f"语音合成出错: {e}"
+        return None, f"语音合成出错: {e}"
 
 if __name__ == '__main__':
     test_texts = [
@@ -26,7 +30,9 @@ if __name__ == '__main__':
     
     for text in test_texts:
         print(f"\n正在合成: {text}")
-        success, error = text_to_speech(text)
-        if not success:
+        output_file, error = text_to_speech(text)
+        if output_file:
+            print(f"已保存到: {output_file}")
+        else:
             print(error)
         time.sleep(1)  # 测试间隔
\ No newline at end of file
@@ -0,0 +1,162 @@
+import itertools
+from typing import Iterable, List
+
+import numpy as np
+import pytest
+
+import vad
+from vad import EndpointDetector, VoiceActivityDetector, record_until_silence
+
+SAMPLE_RATE = 16000
+FRAME_SAMPLES = SAMPLE_RATE * 30 // 1000
+NOISE_RMS = 200.0
+
+@pytest.fixture(autouse=True)
+def energy_vad(monkeypatch):
+    # 固定使用能量/过零率判断，结果不依赖是否安装了webrtcvad
+    monkeypatch.setattr(vad, 'webrtcvad', None)
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
+
+def noise(rng, frames: int, rms: float = NOISE_RMS) -> List[bytes]:
+    """环境噪声：白噪声"""
+    samples = (rng.standard_normal(frames * FRAME_SAMPLES) * rms).astype(np.int16)
+    return [samples[i:i + FRAME_SAMPLES].tobytes() for i in range(0, len(samples), FRAME_SAMPLES)]
+
+def tone(frames: int, amplitude: int = 3000) -> List[bytes]:
+    """说话：440Hz正弦波"""
+    t = np.arange(frames * FRAME_SAMPLES) / SAMPLE_RATE
+    samples = (np.sin(2 * np.pi * 440 * t) * amplitude).astype(np.int16)
+    return [samples[i:i + FRAME_SAMPLES].tobytes() for i in range(0, len(samples), FRAME_SAMPLES)]
+
+def reader(frames: Iterable[bytes]):
+    """模拟录音读取，返回read_frame和已读取的帧列表"""
+    source = iter(frames)
+    consumed = []
+
+    def read_frame() -> bytes:
+        frame = next(source, b'')
+        if frame:
+            consumed.append(frame)
+        return frame
+    return read_frame, consumed
+
+def test_calibration_sets_threshold_from_noise(rng):
+    detector = VoiceActivityDetector()
+    assert not detector.calibrated
+    assert detector.energy_threshold == detector.min_threshold
+    detector.calibrate(b''.join(noise(rng, 10)))
+    assert detector.noise_level == pytest.approx(NOISE_RMS, rel=0.1)
+    assert detector.energy_threshold == pytest.approx(detector.noise_level * detector.threshold_ratio)
+
+def test_calibration_ignores_a_speech_onset(rng):
+    detector = VoiceActivityDetector()
+    # 校准音频中混入了说话开头，阈值仍以噪声为准
+    detector.calibrate(b''.join(noise(rng, 7) + tone(3)))
+    assert detector.noise_level == pytest.approx(NOISE_RMS, rel=0.1)
+
+def test_quiet_room_uses_min_threshold(rng):
+    detector = VoiceActivityDetector()
+    detector.calibrate(b''.join(noise(rng, 10, rms=20)))
+    assert detector.energy_threshold == detector.min_threshold
+
+def test_calibration_needs_a_full_frame():
+    detector = VoiceActivityDetector()
+    detector.calibrate(b'\x00' * 100)
+    assert not detector.calibrated
+
+def test_speech_and_noise_frames(rng):
+    detector = VoiceActivityDetector()
+    detector.calibrate(b''.join(noise(rng, 10)))
+    assert all(detector.is_speech(frame) for frame in tone(5))
+    assert not any(detector.is_speech(frame) for frame in noise(rng, 5))
+
+def test_noise_level_follows_the_room(rng):
+    detector = VoiceActivityDetector()
+    detector.calibrate(b''.join(noise(rng, 10)))
+    calibrated = detector.noise_level
+    # 环境变安静后阈值随之下降，语音帧不参与更新
+    for frame in noise(rng, 40, rms=50):
+        assert not detector.is_speech(frame)
+    assert detector.noise_level < calibrated / 2
+    level = detector.noise_level
+    for frame in tone(5):
+        detector.is_speech(frame)
+    assert detector.noise_level == level
+
+def test_trim_keeps_padding_around_speech(rng):
+    detector = VoiceActivityDetector()
+    detector.calibrate(b''.join(noise(rng, 10)))
+    speech = tone(10)
+    pcm = b''.join(noise(rng, 20) + speech + noise(rng, 20))
+    trimmed = detector.trim(pcm, padding_ms=150)
+    padding = 150 // detector.frame_ms * detector.frame_bytes
+    assert len(trimmed) == len(b''.join(speech)) + 2 * padding
+    assert trimmed[padding:-padding] == b''.join(speech)
+    assert detector.trim(b''.join(noise(rng, 10))) == b''
+
+def test_endpoint_detects_start_and_end(rng):
+    detector = VoiceActivityDetector()
+    detector.calibrate(b''.join(noise(rng, 10)))
+    endpoint = EndpointDetector(detector, start_ms=90, end_silence_ms=600)
+    speech = tone(5)
+    for frame in speech[:2]:
+        endpoint.feed(frame)
+    assert not endpoint.speech_started
+    endpoint.feed(speech[2])
+    assert endpoint.speech_started
+    for frame in speech[3:]:
+        endpoint.feed(frame)
+    silence = noise(rng, 20)
+    for frame in silence[:-1]:
+        endpoint.feed(frame)
+    assert not endpoint.ended
+    endpoint.feed(silence[-1])
+    assert endpoint.ended
+
+def test_short_pause_does_not_end_the_phrase(rng):
+    detector = VoiceActivityDetector()
+    detector.calibrate(b''.join(noise(rng, 10)))
+    endpoint = EndpointDetector(detector, end_silence_ms=600)
+    for frame in tone(5) + noise(rng, 10) + tone(5) + noise(rng, 10):
+        endpoint.feed(frame)
+    assert endpoint.speech_started and not endpoint.ended
+
+def test_record_returns_none_without_speech(rng):
+    read_frame, _ = reader(noise(rng, 40))
+    assert record_until_silence(read_frame, VoiceActivityDetector()) is None
+
+def test_record_times_out_waiting_for_speech(rng):
+    read_frame, _ = reader(itertools.cycle(noise(rng, 10)))
+    assert record_until_silence(read_frame, VoiceActivityDetector(), timeout=0.05) is None
+
+def test_record_stops_after_trailing_silence(rng):
+    detector = VoiceActivityDetector()
+    speech = tone(20)
+    frames = noise(rng, 15) + speech + noise(rng, 60)
+    read_frame, consumed = reader(frames)
+    audio = record_until_silence(read_frame, detector)
+    assert b''.join(speech) in audio
+    # 静音600毫秒后立即停止，不再读取后面的音频
+    assert len(consumed) == 15 + 20 + 20
+
+def test_record_keeps_speech_read_during_calibration(rng):
+    detector = VoiceActivityDetector()
+    speech = tone(10)
+    # 没有预录音频时用最先读到的帧校准，说话在校准期间就已开始
+    leading = noise(rng, 4)
+    read_frame, _ = reader(leading + speech + noise(rng, 30))
+    audio = record_until_silence(read_frame, detector, calibration_ms=300)
+    assert detector.noise_level == pytest.approx(NOISE_RMS, rel=0.2)
+    assert audio.startswith(b''.join(leading + speech))
+
+def test_record_uses_preroll_for_calibration(rng):
+    detector = VoiceActivityDetector()
+    speech = tone(10)
+    read_frame, consumed = reader(speech + noise(rng, 30))
+    audio = record_until_silence(read_frame, detector, calibration_pcm=b''.join(noise(rng, 10)))
+    assert detector.noise_level == pytest.approx(NOISE_RMS, rel=0.1)
+    assert audio.startswith(b''.join(speech))
+    assert len(consumed) == 10 + 20
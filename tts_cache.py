@@ -0,0 +1,141 @@
+import hashlib
+import logging
+import mmap
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Optional, Union
+
+from config_loader import get_section, resolve_path
+
+class TTSAudioCache:
+    """按内容寻址的语音合成缓存
+
+    以(文本, 发音人, 采样率, 格式)的哈希为文件名，把PCM保存在磁盘上；
+    读取时使用只读内存映射，播放时不必把音频复制进内存。
+    总大小超过上限时按最近使用时间淘汰，文件先写临时文件再原子替换，
+    多个会话同时合成同一句话也不会互相覆盖出半截文件。
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 64 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    @staticmethod
+    def make_key(text: str, vcn: str, rate: int, audio_format: str) -> str:
+        key_data = '\x00'.join([text, vcn, str(rate), audio_format])
+        return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f'{key}.pcm')
+
+    def _load_index(self) -> None:
+        # 按修改时间排序恢复LRU顺序，命中时会更新文件的修改时间
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith('.pcm'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self.current_bytes += size
+        with self._lock:
+            self._evict()
+
+    def _evict(self) -> None:
+        while self._index and self.current_bytes > self.max_bytes:
+            key, size = self._index.popitem(last=False)
+            self.current_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def get(self, key: str) -> Optional[mmap.mmap]:
+        """命中时返回只读内存映射，调用方用完后应close()"""
+        with self._lock:
+            if key not in self._index:
+                self.misses += 1
+                return None
+            self._index.move_to_end(key)
+            self.hits += 1
+        try:
+            path = self._path(key)
+            os.utime(path)
+            with open(path, 'rb') as f:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            logging.warning(f"读取语音缓存失败: {e}")
+            with self._lock:
+                size = self._index.pop(key, 0)
+                self.current_bytes -= size
+            return None
+
+    def put(self, key: str, audio: bytes) -> None:
+        if not audio:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(audio)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logging.warning(f"写入语音缓存失败: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            self.current_bytes += len(audio) - self._index.pop(key, 0)
+            self._index[key] = len(audio)
+            self._evict()
+
+    def get_or_synthesize(self, key: str,
+                          synthesize: Callable[[], Optional[bytes]]) -> Optional[Union[mmap.mmap, bytes]]:
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+        audio = synthesize()
+        if audio:
+            self.put(key, audio)
+        return audio
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'entries': len(self._index),
+                'bytes': self.current_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+def create_tts_cache() -> Optional[TTSAudioCache]:
+    settings = get_section('tts', {'cache_dir': 'tts_cache', 'cache_max_bytes': 64 * 1024 * 1024})
+    if not settings.get('cache_dir'):
+        return None
+    return TTSAudioCache(resolve_path(settings['cache_dir']), settings['cache_max_bytes'])
+
+def prewarm(phrases: Iterable[str], synthesize_sentence: Callable[[str], None]) -> threading.Thread:
+    """在后台依次合成常用短语，使其首次播报时即可命中缓存"""
+    def run():
+        for phrase in phrases:
+            try:
+                synthesize_sentence(phrase)
+            except Exception as e:
+                logging.warning(f"预合成语音失败: {e}")
+
+    thread = threading.Thread(target=run, name='tts-prewarm', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,198 @@
+import logging
+import queue
+import re
+import threading
+from typing import Any, Callable, Iterable, List, Optional
+
+from config_loader import get_section
+from metrics import metrics
+from tts_cache import TTSAudioCache, create_tts_cache, prewarm
+
+# 中英文句末标点；英文句号后需跟空白，避免切开小数和缩写
+_SENTENCE_END_RE = re.compile(r'([。！？!?；;…]+["”』」）)]*|\.(?=\s)|\n+)')
+
+class SentenceSplitter:
+    """把流式到达的文本切分成完整的句子"""
+
+    def __init__(self, min_length: int = 4):
+        # 过短的片段（如"好的。"）与下一句合并，减少合成请求次数
+        self.min_length = min_length
+        self._buffer = ''
+
+    def feed(self, text: str) -> List[str]:
+        """输入新文本，返回已经完整的句子"""
+        self._buffer += text
+        sentences = []
+        last_end = 0
+        for match in _SENTENCE_END_RE.finditer(self._buffer):
+            sentence = self._buffer[last_end:match.end()].strip()
+            if len(sentence) < self.min_length:
+                continue
+            sentences.append(sentence)
+            last_end = match.end()
+        self._buffer = self._buffer[last_end:]
+        return sentences
+
+    def flush(self) -> List[str]:
+        rest = self._buffer.strip()
+        self._buffer = ''
+        return [rest] if rest else []
+
+def split_sentences(text: str) -> List[str]:
+    splitter = SentenceSplitter()
+    return splitter.feed(text) + splitter.flush()
+
+class Pyttsx3Backend:
+    """本地pyttsx3语音，引擎在播放线程中只初始化一次；pyttsx3的合成与播放无法拆开"""
+
+    def __init__(self, rate: int = 150, volume: float = 0.9):
+        self.rate = rate
+        self.volume = volume
+        self._engine = None
+
+    def synthesize(self, sentence: str) -> Any:
+        return sentence
+
+    def play(self, sentence: Any) -> None:
+        if self._engine is None:
+            import pyttsx3
+            self._engine = pyttsx3.init()
+            self._engine.setProperty('rate', self.rate)
+            self._engine.setProperty('volume', self.volume)
+        self._engine.say(sentence)
+        self._engine.runAndWait()
+
+class XunfeiBackend:
+    """讯飞在线合成PCM，用PyAudio播放；合成下一句时上一句可以同时播放
+
+    合成结果按内容缓存在磁盘上，重复的句子直接从缓存内存映射读取，不再请求网络。
+    """
+
+    def __init__(self):
+        from xunfei_speech import XunfeiTTS
+        self.tts = XunfeiTTS()
+        self.cache = create_tts_cache()
+        self._audio = None
+        self._stream = None
+
+    def _synthesize_remote(self, sentence: str) -> Optional[bytes]:
+        audio, error = self.tts.synthesize(sentence)
+        if error:
+            logging.warning(f"语音合成失败: {error}")
+        return audio
+
+    def synthesize(self, sentence: str) -> Any:
+        if not self.cache:
+            return self._synthesize_remote(sentence)
+        key = TTSAudioCache.make_key(sentence, self.tts.vcn, self.tts.sample_rate, self.tts.aue)
+        return self.cache.get_or_synthesize(key, lambda: self._synthesize_remote(sentence))
+
+    def play(self, audio: Any) -> None:
+        if not audio:
+            return
+        try:
+            if self._stream is None:
+                import pyaudio
+                self._audio = pyaudio.PyAudio()
+                self._stream = self._audio.open(format=pyaudio.paInt16, channels=1,
+                                                rate=self.tts.sample_rate, output=True)
+            self._stream.write(audio)
+        finally:
+            # 缓存命中时是内存映射，播放完释放
+            if hasattr(audio, 'close'):
+                audio.close()
+
+    def prewarm(self, sentence: str) -> None:
+        audio = self.synthesize(sentence)
+        if hasattr(audio, 'close'):
+            audio.close()
+
+class SpeechPipeline:
+    """句子级流水线语音播报
+
+    文本按句切分后进入合成线程，合成结果放入有界队列，由播放线程依次播放：
+    第N句播放时第N+1句已在合成，队列上限避免合成远远跑在播放前面。
+    speak()立即返回，不阻塞Streamlit脚本线程。
+    """
+
+    def __init__(self, backend_factory: Callable[[], Any], max_pending: int = 2):
+        # 后端延迟到首次播报时才创建
+        self.backend_factory = backend_factory
+        self.backend = None
+        self._sentences: "queue.Queue[str]" = queue.Queue()
+        self._audio: "queue.Queue[Any]" = queue.Queue(maxsize=max_pending)
+        self._started = False
+        self._start_lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls) -> 'SpeechPipeline':
+        settings = get_section('tts', {'backend': 'pyttsx3', 'max_pending': 2, 'rate': 150, 'volume': 0.9})
+        if settings['backend'] == 'xunfei':
+            return cls(XunfeiBackend, settings['max_pending'])
+        return cls(lambda: Pyttsx3Backend(settings['rate'], settings['volume']), settings['max_pending'])
+
+    def _ensure_started(self) -> None:
+        with self._start_lock:
+            if self._started:
+                return
+            self.backend = self.backend_factory()
+            threading.Thread(target=self._synthesize_loop, name='tts-synthesizer', daemon=True).start()
+            threading.Thread(target=self._play_loop, name='tts-player', daemon=True).start()
+            self._started = True
+
+    def _synthesize_loop(self) -> None:
+        while True:
+            sentence = self._sentences.get()
+            try:
+                with metrics.span('tts_synthesis'):
+                    audio = self.backend.synthesize(sentence)
+            except Exception as e:
+                metrics.increment('errors_total', component='tts')
+                logging.error(f"语音合成出错: {e}")
+                continue
+            self._audio.put(audio)
+
+    def _play_loop(self) -> None:
+        while True:
+            audio = self._audio.get()
+            try:
+                self.backend.play(audio)
+            except Exception as e:
+                logging.error(f"语音播放出错: {e}")
+
+    def enqueue(self, sentence: str) -> None:
+        self._ensure_started()
+        self._sentences.put(sentence)
+
+    def speak(self, text: str) -> None:
+        for sentence in split_sentences(text):
+            self.enqueue(sentence)
+
+    def prewarm(self, phrases: Iterable[str]) -> None:
+        """后台预先合成固定短语（情感回应、错误提示等），只对支持缓存的后端生效"""
+        self._ensure_started()
+        if not hasattr(self.backend, 'prewarm'):
+            return
+        # 按播报时相同的方式分句，保证缓存键一致
+        sentences = [sentence for phrase in phrases for sentence in split_sentences(phrase)]
+        prewarm(sentences, self.backend.prewarm)
+
+    def open_utterance(self) -> 'Utterance':
+        """用于流式回答：边生成边送入文本，每凑齐一句就开始合成"""
+        return Utterance(self)
+
+class Utterance:
+    def __init__(self, pipeline: SpeechPipeline):
+        self._pipeline = pipeline
+        self._splitter = SentenceSplitter()
+
+    def feed(self, text: str) -> None:
+        for sentence in self._splitter.feed(text):
+            self._pipeline.enqueue(sentence)
+
+    def finish(self) -> None:
+        for sentence in self._splitter.flush():
+            self._pipeline.enqueue(sentence)
+
+# 初始化全局实例
+speech_pipeline = SpeechPipeline.from_config()
@@ -1,14 +1,38 @@
-import ollama
-from langdetect import detect
 import re
-import emoji
-from transformers import pipeline
+import json
 import logging
-from typing import Dict, Optional, Any
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Any, Callable, Iterable, Iterator
+from async_engine import AsyncGenerationEngine
+from config_loader import get_section
+from model_router import ModelRouter
+from chat_history import ChatMessage
+from language_detector import language_detector
+from model_residency import ModelResidencyManager
+from metrics import metrics
+from resilience import ErrorMessage
+from startup import lazy_import
+
+# ollama依赖较多，第一次使用时才导入
+ollama = lazy_import('ollama')
 
 class OllamaModelManager:
+    # 请求参数名到Ollama options字段的映射
+    OPTION_ALIASES = {
+        'max_tokens': 'num_predict',
+        'context_length': 'num_ctx',
+    }
+    # 允许透传给Ollama的生成参数
+    SUPPORTED_OPTIONS = {
+        'temperature', 'top_p', 'top_k', 'num_predict', 'num_ctx',
+        'repeat_penalty', 'seed', 'stop',
+    }
+
     def __init__(self):
-        self.client = ollama.Client()
+        self._client = None
         self.models = {
             'qwen2': {
                 'name': 'qwen2',
@@ -23,8 +47,47 @@ class OllamaModelManager:
                 'context_length': 4096
             }
         }
+        # 图片分析使用的多模态模型，不参与文本对话的模型选择
+        vision_model = get_section('vision', {'model': 'llava'})['model']
+        self.models.setdefault(vision_model, {
+            'name': vision_model,
+            'temperature': 0.2,
+            'top_p': 0.9,
+            'context_length': 4096,
+            'vision': True
+        })
         self.default_model = 'qwen2'
-        self._initialize_models()
+        self.installed_models: List[str] = []
+        self.models_ready: Optional[bool] = None  # None表示尚未完成检测
+        # 未安装的可选模型（如图片分析模型），缺少时只是对应功能不可用
+        self.missing_optional_models: List[str] = []
+        self._discovery_thread: Optional[threading.Thread] = None
+        self._discovery_lock = threading.Lock()
+        # 模型常驻管理：keep_alive、预加载和已加载模型跟踪
+        self.residency = ModelResidencyManager.from_config(lambda: self.client)
+        # 在后台检测已安装的模型，Ollama未启动时也不阻塞页面加载
+        self.discover_models()
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = ollama.Client()
+        return self._client
+
+    def discover_models(self) -> threading.Thread:
+        """在后台线程中重新检测已安装的模型，已有检测在进行时直接返回该线程"""
+        with self._discovery_lock:
+            if self._discovery_thread is None or not self._discovery_thread.is_alive():
+                self._discovery_thread = threading.Thread(target=self._run_discovery,
+                                                          name='ollama-discovery', daemon=True)
+                self._discovery_thread.start()
+            return self._discovery_thread
+
+    def _run_discovery(self) -> None:
+        self.models_ready = self._initialize_models()
+        if self.models_ready and self.residency.preload_enabled:
+            # 检测完成后预加载默认模型，第一个问题不必等待模型加载
+            self.residency.preload(self.resolve_model_name(self.default_model), self.default_model)
 
     def _check_ollama_service(self):
         import socket
@@ -33,10 +96,10 @@ class OllamaModelManager:
             sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             result = sock.connect_ex(('127.0.0.1', 11434))
             sock.close()
-            print(f"Ollama服务端口检查结果: {result == 0}")
+            logging.debug(f"Ollama服务端口检查结果: {result == 0}")
             return result == 0
         except Exception as e:
-            print(f"检查Ollama服务时出错: {e}")
+            logging.warning(f"检查Ollama服务时出错: {e}")
             return False
 
     def _initialize_models(self):
@@ -51,15 +114,19 @@ class OllamaModelManager:
             if hasattr(available_models, 'models'):
                 # 新版API返回ListResponse对象
                 model_names = [model.model.split(':')[0] for model in available_models.models]
+            self.installed_models = model_names
             
             # print(f"已安装的模型: {model_names}")
             
             # 检查所需模型是否都已安装，允许模型名称前缀匹配
+            # 只有对话模型是必需的，图片分析模型缺少时只影响图片分析
             missing_models = []
+            missing_optional = []
             for model in self.models.keys():
                 # 检查是否有匹配的模型名称（允许前缀匹配，如deepseek-r1匹配deepseek）
                 if not any(installed.startswith(model) or model.startswith(installed) for installed in model_names):
-                    missing_models.append(model)
+                    (missing_optional if self.models[model].get('vision') else missing_models).append(model)
+            self.missing_optional_models = missing_optional
             
             # 更新模型名称为实际安装的名称
             for model_key in list(self.models.keys()):
@@ -71,6 +138,9 @@ class OllamaModelManager:
                         config['name'] = installed
                         self.models[model_key] = config
             
+            for model in missing_optional:
+                print(f"可选模型 {model} 未安装，图片分析不可用；需要时请执行命令 'ollama pull {model}'")
+
             if missing_models:
                 print("\n需要安装以下模型:")
                 for model in missing_models:
@@ -86,34 +156,278 @@ class OllamaModelManager:
             print("请确保Ollama服务已启动，并且已安装所需模型")
             return False
 
-    def generate_response(self, prompt: str, model_name: str, **kwargs) -> str:
-        from error_handler import ErrorHandler, RetryStrategy
-        
-        @ErrorHandler.with_retry(RetryStrategy(max_retries=3, delay=1.0, backoff=2.0))
-        def _generate(self, prompt: str, model_name: str) -> str:
-            model_config = self.models.get(model_name, self.models[self.default_model])
-            result = self.client.generate(model_name, prompt)
-            return result['response']
-        
-        return _generate(self, prompt, model_name)
+    def chat_models(self) -> List[str]:
+        """可用于文本对话的模型"""
+        return [name for name, config in self.models.items() if not config.get('vision')]
+
+    def resolve_model_name(self, model_name: str) -> str:
+        """返回模型在Ollama中实际安装的名称，未知模型使用默认模型"""
+        return self.models.get(model_name, self.models[self.default_model])['name']
+
+    def build_generation_options(self, model_name: str, **kwargs) -> Dict[str, Any]:
+        """合并模型默认参数和本次请求参数
+
+        返回可直接传给client.generate/client.chat的关键字参数，
+        包括options（如num_ctx、num_predict）和keep_alive。
+        """
+        model_config = self.models.get(model_name, self.models[self.default_model])
+        options = {}
+        keep_alive = self.residency.keep_alive_for(model_name)
+        # 请求参数覆盖模型默认参数
+        for source in (model_config, kwargs):
+            for key, value in source.items():
+                if value is None:
+                    continue
+                if key == 'keep_alive':
+                    keep_alive = value
+                    continue
+                key = self.OPTION_ALIASES.get(key, key)
+                if key in self.SUPPORTED_OPTIONS:
+                    options[key] = value
+        return {'options': options, 'keep_alive': keep_alive}
+
+class ConversationContext:
+    """把会话历史转换为client.chat的消息列表，并控制在模型上下文长度之内
+
+    窗口起点只在超出预算时才一次性前移到低水位，之后若干轮保持不变，
+    这样发给Ollama的消息前缀稳定，服务端可以复用已计算的KV缓存，
+    每轮只需要预填充新增的内容。被移出窗口的早期提问压缩成一条摘要。
+    """
+
+    # 中日韩文字大致一个字对应一个token，其他字符约4个对应一个token
+    _CJK_RE = re.compile(r'[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af\uff00-\uffef]')
+    # 每条消息的格式开销
+    MESSAGE_OVERHEAD = 4
+
+    def __init__(self, low_water: float = 0.5, summary_ratio: float = 0.1):
+        self.low_water = low_water
+        self.summary_ratio = summary_ratio
+        self.window_start = 0
+
+    @classmethod
+    def estimate_tokens(cls, text: str) -> int:
+        cjk = len(cls._CJK_RE.findall(text))
+        return cjk + (len(text) - cjk + 3) // 4 + cls.MESSAGE_OVERHEAD
+
+    def build_messages(self, history: List[ChatMessage], prompt: str,
+                       context_length: int, reserve_tokens: int) -> List[Dict[str, str]]:
+        """history为会话中已有的消息（不含本次提问），只保留user/assistant消息"""
+        turns = [{'role': m.role, 'content': m.content}
+                 for m in history if m.role in ('user', 'assistant')]
+        if self.window_start > len(turns):
+            # 会话被清空过
+            self.window_start = 0
+
+        budget = context_length - reserve_tokens - self.estimate_tokens(prompt)
+        costs = [self.estimate_tokens(t['content']) for t in turns]
+
+        if sum(costs[self.window_start:]) > budget:
+            # 超出预算时一次性丢弃到低水位，而不是每轮滑动一条
+            target = int(budget * self.low_water)
+            used = 0
+            start = len(turns)
+            while start > 0 and used + costs[start - 1] <= target:
+                start -= 1
+                used += costs[start]
+            self.window_start = start
+
+        messages = []
+        summary = self._summarize(turns[:self.window_start], int(budget * self.summary_ratio))
+        if summary:
+            messages.append({'role': 'system', 'content': summary})
+        messages.extend(turns[self.window_start:])
+        messages.append({'role': 'user', 'content': prompt})
+        return messages
+
+    def _summarize(self, dropped: List[Dict[str, str]], max_tokens: int) -> str:
+        if not dropped or max_tokens <= 0:
+            return ''
+        header = '之前的对话中用户问过：'
+        lines = []
+        used = self.estimate_tokens(header)
+        # 从最近的问题往前取，直到用完摘要预算
+        for turn in reversed(dropped):
+            if turn['role'] != 'user':
+                continue
+            line = '- ' + turn['content'][:60].replace('\n', ' ')
+            cost = self.estimate_tokens(line)
+            if used + cost > max_tokens:
+                break
+            lines.append(line)
+            used += cost
+        if not lines:
+            return ''
+        return '\n'.join([header] + lines[::-1])
+
+class ResponseStream:
+    """可迭代的流式响应，边迭代边清理输出，并记录首字延迟和总耗时
+
+    生成失败时上游会送出ErrorMessage，它原样输出而不经过清理，保存在error中，
+    此时不调用on_complete，错误提示和中断的不完整回答都不会被缓存。开启指标统计时累计清理输出的耗时（clean_time）。
+    """
+
+    def __init__(self, chunks: Iterable[str], on_complete: Optional[Callable[[str], None]] = None):
+        from response_processor import StreamingResponseCleaner
+        self._chunks = chunks
+        self._on_complete = on_complete
+        self._cleaner = StreamingResponseCleaner()
+        self._parts = []
+        self._start = time.perf_counter()
+        self.ttft: Optional[float] = None
+        self.total_time: Optional[float] = None
+        self.error: Optional[ErrorMessage] = None
+        self.clean_time: Optional[float] = None
+
+    def __iter__(self) -> Iterator[str]:
+        timed = metrics.enabled
+        clean_ns = 0
+        for chunk in self._chunks:
+            if self.ttft is None:
+                self.ttft = time.perf_counter() - self._start
+            if isinstance(chunk, ErrorMessage):
+                self.error = chunk
+                yield f"\n\n{chunk}" if self._parts else chunk
+                continue
+            self._parts.append(chunk)
+            if timed:
+                clean_start = time.perf_counter_ns()
+                text = self._cleaner.feed(chunk)
+                clean_ns += time.perf_counter_ns() - clean_start
+            else:
+                text = self._cleaner.feed(chunk)
+            if text:
+                yield text
+        tail = self._cleaner.flush()
+        if timed:
+            self.clean_time = clean_ns / 1e9
+        if tail:
+            yield tail
+        self.total_time = time.perf_counter() - self._start
+        if self._on_complete and self.error is None:
+            self._on_complete(self.text)
+
+    @property
+    def raw_text(self) -> str:
+        return ''.join(self._parts)
+
+    @property
+    def text(self) -> str:
+        """完整的清理后回答，应在迭代结束后读取；生成失败时为错误结果，中途失败时为已生成部分加错误结果"""
+        from response_processor import clean_response
+        if self.error is None:
+            return clean_response(self.raw_text)
+        if not self._parts:
+            return self.error
+        return f"{clean_response(self.raw_text)}\n\n{self.error}"
 
 class LanguageProcessor:
+    def __init__(self, router: ModelRouter, model_manager: Optional[OllamaModelManager] = None):
+        self.router = router
+        self.model_manager = model_manager
+
     @staticmethod
     def detect_language(text: str) -> str:
+        # 中日韩文字走快速路径，其他文字才调用langdetect，结果有缓存
+        return language_detector.detect(text)
+
+    def select_model(self, prompt: str) -> str:
+        # 路由规则来自config.json，返回值一定是model_manager.models中的键
+        decision = self.router.route(prompt)
+        if self.model_manager is None:
+            return decision.model
+        # 选择勉强时优先使用已在内存中的模型，避免切换模型带来的加载等待
+        return self.model_manager.residency.prefer_resident(
+            decision, self.router.available_models, self.model_manager.resolve_model_name
+        )
+
+class SharedEmotionClassifier:
+    """进程内共享的情感分类模型
+
+    模型在后台线程中加载，加载完成前is_ready()为False，调用方应使用关键词分析；
+    并发的classify调用会在一个很短的收集窗口内合并，作为一个批次送入pipeline。
+    """
+
+    MODEL_NAME = "j-hartmann/emotion-english-distilroberta-base"
+
+    _instance: Optional['SharedEmotionClassifier'] = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, batch_window: float = 0.01, max_batch_size: int = 16):
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.state = 'idle'  # idle / loading / ready / failed
+        self._pipeline = None
+        self._queue: "queue.Queue[Any]" = queue.Queue()
+        self._state_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls) -> 'SharedEmotionClassifier':
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def start_loading(self) -> None:
+        """在后台开始加载模型，重复调用不会重复加载"""
+        with self._state_lock:
+            if self.state != 'idle':
+                return
+            self.state = 'loading'
+        threading.Thread(target=self._load, name='emotion-model-loader', daemon=True).start()
+
+    def is_ready(self) -> bool:
+        return self.state == 'ready'
+
+    def _load(self) -> None:
         try:
-            return detect(text)
-        except:
-            return 'en'
+            from transformers import pipeline
+            from transformers import logging as transformers_logging
+            transformers_logging.set_verbosity_error()
+            self._pipeline = pipeline("text-classification", model=self.MODEL_NAME)
+        except Exception as e:
+            logging.warning(f"无法加载情感分析模型: {e}")
+            self.state = 'failed'
+            return
+        threading.Thread(target=self._batch_loop, name='emotion-batcher', daemon=True).start()
+        self.state = 'ready'
 
-    @staticmethod
-    def select_model(prompt: str) -> str:
-        if re.search(r'\b(专业|技术|学术|代码|编程)\b', prompt):
-            return 'deepseek'
-        return 'qwen2'
+    def classify(self, text: str, timeout: float = 5.0) -> str:
+        """返回情感标签，模型未就绪时抛出RuntimeError"""
+        if not self.is_ready():
+            raise RuntimeError("情感分析模型尚未就绪")
+        future: Future = Future()
+        self._queue.put((text, future))
+        return future.result(timeout=timeout)
+
+    def _collect_batch(self) -> List[Any]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _batch_loop(self) -> None:
+        while True:
+            batch = self._collect_batch()
+            texts = [text for text, _ in batch]
+            try:
+                results = self._pipeline(texts, truncation=True)
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result['label'])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
 
 class EmotionAnalyzer:
     def __init__(self):
-        self.analyzer = self._initialize_analyzer()
+        self.classifier = SharedEmotionClassifier.get_instance()
         self.responses = {
             'joy': "太棒啦🎉 希望您一直保持这份好心情！",
             'sadness': "别难过😢 我会一直陪着您的。",
@@ -122,22 +436,15 @@ class EmotionAnalyzer:
             'neutral': "了解啦，请您继续说。"
         }
 
-    def _initialize_analyzer(self):
-        try:
-            from transformers import logging as transformers_logging
-            transformers_logging.set_verbosity_error()
-            return pipeline("text-classification", model="j-hartmann/emotion-english-distilroberta-base")
-        except Exception as e:
-            logging.warning(f"无法加载情感分析模型: {e}")
-            return None
-
     def analyze(self, text: str) -> str:
-        if not self.analyzer:
+        # 首次调用时开始后台加载，模型就绪前使用关键词分析
+        self.classifier.start_loading()
+        if not self.classifier.is_ready():
             return self._keyword_based_analysis(text)
         
         try:
-            result = self.analyzer(text)[0]
-            return self.responses.get(result['label'], self.responses['neutral'])
+            label = self.classifier.classify(text)
+            return self.responses.get(label, self.responses['neutral'])
         except Exception as e:
             logging.error(f"情感分析出错: {e}")
             return self.responses['neutral']
@@ -156,17 +463,80 @@ class EmotionAnalyzer:
 
 # 初始化全局实例
 model_manager = OllamaModelManager()
-language_processor = LanguageProcessor()
+language_processor = LanguageProcessor(
+    ModelRouter.from_config(model_manager.chat_models(), LanguageProcessor.detect_language),
+    model_manager
+)
 emotion_analyzer = EmotionAnalyzer()
+generation_engine = AsyncGenerationEngine(
+    model_manager,
+    max_concurrency_per_model=get_section('generation', {'max_concurrency_per_model': 2})['max_concurrency_per_model']
+)
+
+def _cache_if_valid(prompt: str, model: str, response: str, **kwargs) -> None:
+    from cache_manager import cache_manager
+    from error_handler import ErrorHandler
+    # 错误提示不能当作回答缓存
+    if cache_manager and response and not ErrorHandler.is_error_message(response):
+        cache_manager.cache_response(prompt, model_manager.resolve_model_name(model), response, **kwargs)
+
+def _get_cached(prompt: str, model: str, **kwargs) -> Optional[str]:
+    from cache_manager import cache_manager
+    if not cache_manager:
+        return None
+    return cache_manager.get_cached_response(prompt, model_manager.resolve_model_name(model), **kwargs)
 
 # 修改导出函数
 def generate_response(prompt: str, model: str, **kwargs) -> str:
-    # 获取原始响应
-    response = model_manager.generate_response(prompt, model, **kwargs)
+    # 相同的问题、模型和参数直接返回缓存的回答
+    cached = _get_cached(prompt, model, **kwargs)
+    if cached is not None:
+        return cached
+
+    # 获取原始响应，相同的进行中请求由生成引擎合并
+    from error_handler import ErrorHandler
+    response = generation_engine.generate(prompt, model, **kwargs)
+    if ErrorHandler.is_error_message(response):
+        # 错误结果保留类型直接返回，不清理也不缓存
+        return response
     
     # 导入并使用响应处理器清理输出
     from response_processor import clean_response
-    return clean_response(response)
+    response = clean_response(response)
+    _cache_if_valid(prompt, model, response, **kwargs)
+    return response
+
+def build_chat_messages(prompt: str, model: str, history: List[ChatMessage],
+                        conversation: ConversationContext, **kwargs) -> List[Dict[str, str]]:
+    options = model_manager.build_generation_options(model, **kwargs)['options']
+    context_length = options.get('num_ctx', 2048)
+    num_predict = options.get('num_predict', 0)
+    if num_predict <= 0:
+        num_predict = context_length // 4
+    # 为回答预留空间，但至多占用一半上下文
+    reserve_tokens = min(num_predict, context_length // 2)
+    return conversation.build_messages(history, prompt, context_length, reserve_tokens)
+
+def generate_response_stream(prompt: str, model: str,
+                             history: Optional[List[ChatMessage]] = None,
+                             conversation: Optional[ConversationContext] = None,
+                             **kwargs) -> ResponseStream:
+    if history is None:
+        cache_prompt = prompt
+        chunks = lambda: generation_engine.stream(prompt, model, **kwargs)
+    else:
+        messages = build_chat_messages(prompt, model, history, conversation or ConversationContext(), **kwargs)
+        # 多轮对话以完整消息列表作为缓存键
+        cache_prompt = json.dumps(messages, ensure_ascii=False)
+        chunks = lambda: generation_engine.stream(None, model, messages=messages, **kwargs)
+
+    cached = _get_cached(cache_prompt, model, **kwargs)
+    if cached is not None:
+        return ResponseStream(iter([cached]))
+    return ResponseStream(
+        chunks(),
+        on_complete=lambda text: _cache_if_valid(cache_prompt, model, text, **kwargs)
+    )
 
 def select_model(prompt: str) -> str:
     return language_processor.select_model(prompt)
@@ -175,4 +545,8 @@ def detect_language(text: str) -> str:
     return language_processor.detect_language(text)
 
 def emotional_response(prompt: str) -> str:
-    return emotion_analyzer.analyze(prompt)
\ No newline at end of file
+    return emotion_analyzer.analyze(prompt)
+
+def warm_up_emotion_analyzer() -> None:
+    """提前在后台加载情感分析模型，不阻塞调用方"""
+    emotion_analyzer.classifier.start_loading()
\ No newline at end of file
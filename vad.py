@@ -0,0 +1,157 @@
+import time
+from typing import Callable, List, Optional
+
+import numpy as np
+
+try:
+    import webrtcvad
+except ImportError:
+    webrtcvad = None
+
+class VoiceActivityDetector:
+    """语音活动检测，处理16kHz、16bit单声道PCM
+
+    安装了webrtcvad时使用它判断每一帧是否为语音，否则用NumPy计算短时能量和过零率。
+    能量阈值来自环境噪声校准，并在非语音帧上持续缓慢更新，同一会话只需校准一次。
+    """
+
+    def __init__(self, sample_rate: int = 16000, frame_ms: int = 30, aggressiveness: int = 2,
+                 threshold_ratio: float = 3.0, min_threshold: float = 300.0):
+        self.sample_rate = sample_rate
+        self.frame_ms = frame_ms
+        self.frame_samples = sample_rate * frame_ms // 1000
+        self.frame_bytes = self.frame_samples * 2
+        self.threshold_ratio = threshold_ratio
+        self.min_threshold = min_threshold
+        self.noise_level: Optional[float] = None
+        self._webrtc = webrtcvad.Vad(aggressiveness) if webrtcvad else None
+
+    @property
+    def calibrated(self) -> bool:
+        return self.noise_level is not None
+
+    @property
+    def energy_threshold(self) -> float:
+        if self.noise_level is None:
+            return self.min_threshold
+        return max(self.min_threshold, self.noise_level * self.threshold_ratio)
+
+    def calibrate(self, pcm: bytes) -> None:
+        """用一段环境噪声校准能量阈值
+
+        取各帧能量的较低分位数，校准音频中混入了说话开头时也不会把阈值抬得过高。
+        """
+        samples = np.frombuffer(pcm[:len(pcm) // 2 * 2], dtype=np.int16)
+        usable = len(samples) // self.frame_samples * self.frame_samples
+        if not usable:
+            return
+        frames = samples[:usable].reshape(-1, self.frame_samples).astype(np.float32)
+        self.noise_level = float(np.percentile(np.sqrt(np.mean(frames ** 2, axis=1)), 25))
+
+    def _frame_features(self, frame: np.ndarray):
+        samples = frame.astype(np.float32)
+        rms = float(np.sqrt(np.mean(samples ** 2)))
+        signs = np.signbit(frame)
+        zcr = float(np.count_nonzero(signs[1:] != signs[:-1])) / len(frame)
+        return rms, zcr
+
+    def is_speech(self, frame: bytes) -> bool:
+        """判断一帧（frame_ms毫秒）是否为语音"""
+        if self._webrtc is not None and len(frame) == self.frame_bytes:
+            return self._webrtc.is_speech(frame, self.sample_rate)
+
+        rms, zcr = self._frame_features(np.frombuffer(frame, dtype=np.int16))
+        threshold = self.energy_threshold
+        # 清辅音能量较低但过零率高
+        speech = rms >= threshold or (rms >= threshold * 0.6 and zcr > 0.25)
+        if not speech and self.noise_level is not None:
+            # 在非语音帧上跟踪环境噪声的缓慢变化
+            self.noise_level = 0.95 * self.noise_level + 0.05 * rms
+        return speech
+
+    def speech_flags(self, pcm: bytes) -> List[bool]:
+        return [self.is_speech(pcm[offset:offset + self.frame_bytes])
+                for offset in range(0, len(pcm) - self.frame_bytes + 1, self.frame_bytes)]
+
+    def trim(self, pcm: bytes, padding_ms: int = 150) -> bytes:
+        """去掉首尾的静音，保留少量余量避免截掉字头字尾"""
+        flags = self.speech_flags(pcm)
+        if not any(flags):
+            return b''
+        first = flags.index(True)
+        last = len(flags) - 1 - flags[::-1].index(True)
+        padding = padding_ms // self.frame_ms
+        start = max(0, first - padding) * self.frame_bytes
+        end = min(len(flags), last + 1 + padding) * self.frame_bytes
+        return pcm[start:end]
+
+class EndpointDetector:
+    """流式端点检测：连续若干帧语音视为开始说话，之后静音超过一定时长视为说完"""
+
+    def __init__(self, vad: VoiceActivityDetector, start_ms: int = 90, end_silence_ms: int = 600):
+        self.vad = vad
+        self.start_frames = max(1, start_ms // vad.frame_ms)
+        self.end_frames = max(1, end_silence_ms // vad.frame_ms)
+        self.speech_started = False
+        self.ended = False
+        self._speech_run = 0
+        self._silence_run = 0
+
+    def feed(self, frame: bytes) -> bool:
+        """输入一帧，返回该帧是否为语音"""
+        speech = self.vad.is_speech(frame)
+        if speech:
+            self._speech_run += 1
+            self._silence_run = 0
+            if self._speech_run >= self.start_frames:
+                self.speech_started = True
+        else:
+            self._speech_run = 0
+            self._silence_run += 1
+            if self.speech_started and self._silence_run >= self.end_frames:
+                self.ended = True
+        return speech
+
+def record_until_silence(read_frame: Callable[[], bytes], vad: VoiceActivityDetector,
+                         timeout: float = 5.0, phrase_time_limit: float = 10.0,
+                         calibration_ms: int = 300, calibration_pcm: bytes = b'') -> Optional[bytes]:
+    """从read_frame逐帧读取音频（每次vad.frame_bytes字节），说完后立即停止
+
+    vad尚未校准时用calibration_pcm（如录音缓冲区中读取位置之前的音频）校准；
+    不足calibration_ms毫秒时改用最先读到的calibration_ms毫秒，这些帧仍然计入录音，
+    校准后再做端点检测，预录的开头不会被丢掉。
+    timeout秒内没有开始说话时返回None；返回的音频已去掉首尾静音。
+    """
+    calibration_frames = max(1, calibration_ms // vad.frame_ms)
+    pending = []
+    if not vad.calibrated:
+        if len(calibration_pcm) >= calibration_frames * vad.frame_bytes:
+            vad.calibrate(calibration_pcm)
+        else:
+            for _ in range(calibration_frames):
+                frame = read_frame()
+                if not frame:
+                    break
+                pending.append(frame)
+            vad.calibrate(b''.join(pending))
+
+    endpoint = EndpointDetector(vad)
+    frames = []
+    start = time.monotonic()
+    while True:
+        frame = pending.pop(0) if pending else read_frame()
+        if not frame:
+            break
+        frames.append(frame)
+        endpoint.feed(frame)
+        if endpoint.ended:
+            break
+        elapsed = time.monotonic() - start
+        if not endpoint.speech_started and elapsed > timeout:
+            return None
+        if elapsed > phrase_time_limit:
+            break
+
+    if not endpoint.speech_started:
+        return None
+    return vad.trim(b''.join(frames))
@@ -1,181 +1,205 @@
+import logging
 import websocket
-import datetime
-import hashlib
 import base64
-import hmac
 import json
 import time
 import ssl
+import queue
 import threading
+from typing import Optional
 from urllib.parse import urlencode
-import requests
-from wsgiref.handlers import format_date_time
-from datetime import datetime
-from time import mktime
-import _thread as thread
 from xunfei_config import *
+from xunfei_transport import transport
+from rate_limiter import xunfei_asr_limiter, xunfei_tts_limiter
+from asr_result import ASRResultAssembler
+from resilience import get_breaker
+from metrics import metrics
 
 APPID = "259650ba"
 
 class XunfeiASR:
-    def __init__(self):
-        self.result = ""
+    # 16kHz、16bit单声道下40ms的音频
+    FRAME_BYTES = 1280
+    FRAME_INTERVAL = 0.04
+
+    def __init__(self, base_url: str = ASR_URL, on_partial=None):
+        self.base_url = base_url
+        # 按分段拼装识别结果，on_partial在文本变化时收到当前识别文本
+        self.assembler = ASRResultAssembler(on_partial=on_partial)
+        self.results = queue.Queue()  # 流式模式下的识别结果：('partial'|'final', 文本)
         self.ws = None
+        self._ws_thread = None
+        self._connected = threading.Event()  # 连接建立或失败后置位
+        self._closed = threading.Event()
+        self._closing = False  # 已发送结束标记或主动停止，之后的断开属于正常关闭
+        self.stream_error: Optional[str] = None  # 连接中断、发送失败或等待最终结果超时
+        self._pending = bytearray()
         self.is_listening = False
-        self.retry_count = 0
-        self.max_retries = 3  # 减少最大重试次数
-        self.retry_delay = 5.0  # 增加初始重试延迟
-        self.last_request_time = 0  # 记录上次请求时间
-        self.min_request_interval = 10.0  # 最小请求间隔时间（秒）
-
-    def exponential_backoff(self):
-        """指数退避算法计算下一次重试的延迟时间"""
-        delay = min(30, self.retry_delay * (2 ** self.retry_count))  # 最大延迟30秒
-        time.sleep(delay)
-        self.retry_count += 1
-        return self.retry_count < self.max_retries
+        self.max_queue_wait = 30.0  # 排队等待限流令牌的最长时间（秒）
+        self.queue_wait = 0.0  # 最近一次连接前的排队时间（秒）
+        self.breaker = get_breaker('xunfei')  # 与语音合成共用同一个熔断器
 
     def create_url(self):
-        # 生成RFC1123格式的时间戳
-        now = datetime.now()
-        date = format_date_time(mktime(now.timetuple()))
-
-        # 拼接字符串
-        signature_origin = f'host: rtasr.xfyun.cn\ndate: {date}\nGET /v1/ws HTTP/1.1'
-        
-        # 进行hmac-sha256进行加密
-        signature_sha = hmac.new(API_SECRET.encode('utf-8'),
-                                signature_origin.encode('utf-8'),
-                                digestmod=hashlib.sha256).digest()
-        signature_sha_base64 = base64.b64encode(signature_sha).decode(encoding='utf-8')
-
-        authorization_origin = f'api_key="{API_KEY}", algorithm="hmac-sha256", headers="host date request-line", signature="{signature_sha_base64}"'
-        authorization = base64.b64encode(authorization_origin.encode('utf-8')).decode(encoding='utf-8')
-
+        # 签名在有效期内复用，不必每次连接都重新计算
+        date, authorization = transport.signer.sign('rtasr.xfyun.cn', 'GET /v1/ws HTTP/1.1')
         params = {'authorization': authorization, 'date': date, 'host': 'rtasr.xfyun.cn'}
-        return f'{ASR_URL}?{urlencode(params)}'
+        return f'{self.base_url}?{urlencode(params)}'
+
+    @property
+    def result(self) -> str:
+        return self.assembler.text
 
     def on_message(self, ws, message):
         try:
-            code = json.loads(message)["code"]
-            sid = json.loads(message)["sid"]
-            if code != 0:
-                print(f"错误码：{code}，错误详情：{ERROR_CODES.get(str(code), '未知错误')}")
+            if self.assembler.feed(message):
+                self.results.put(('partial', self.result))
+            elif self.assembler.error:
+                code = self.assembler.error[0]
+                metrics.increment('errors_total', component='xunfei_asr', code=code)
+                logging.error(f"讯飞语音识别返回错误: code={code} desc={ERROR_CODES.get(code, '未知错误')}")
                 ws.close()
-                return
-            
-            data = json.loads(message)["data"]
-            text = json.loads(data)["result"]
-            if text:
-                self.result += text
         except Exception as e:
-            print(f"处理消息时发生错误：{e}")
+            metrics.increment('errors_total', component='xunfei_asr', code='parse')
+            logging.error(f"讯飞语音识别消息处理失败: {e}")
+
+    def _is_normal_close(self, error) -> bool:
+        # 连接已关闭后的报错，或本端结束后服务端关闭连接（状态码1000）引发的异常，都不是故障
+        if self._closed.is_set():
+            return True
+        return self._closing and isinstance(error, websocket.WebSocketConnectionClosedException)
 
     def on_error(self, ws, error):
-        print(f"### error: {error}")
+        if self._is_normal_close(error):
+            logging.debug(f"讯飞语音识别连接关闭: {type(error).__name__}: {error}")
+        else:
+            metrics.increment('errors_total', component='xunfei_asr', code='connection')
+            logging.error(f"讯飞语音识别连接错误: {type(error).__name__}: {error}")
+            self.stream_error = f"连接错误: {type(error).__name__}: {error}"
+        self._closed.set()
+        self._connected.set()
 
     def on_close(self, ws, *args):
-        print("### closed ###")
+        logging.debug("讯飞语音识别连接已关闭")
         self.is_listening = False
+        self._closed.set()
+        self._connected.set()
 
-    def on_open(self, ws):
-        def run(*args):
-            try:
-                if not self.is_listening:
-                    return
-                data = {"common": {"app_id": APPID},
-                       "business": {"language": DEFAULT_LANGUAGE, "accent": DEFAULT_ACCENT},
-                       "data": {"status": 2, "format": DEFAULT_FORMAT,
-                               "encoding": "raw"}}
-                ws.send(json.dumps(data))
-            except Exception as e:
-                print(f"发送初始化数据时发生错误：{e}")
-                self.is_listening = False
-                ws.close()
-        thread.start_new_thread(run, ())
+    def open_stream(self, timeout: float = 5.0, max_queue_wait: Optional[float] = 5.0) -> bool:
+        """在后台线程中建立websocket连接，之后可以边录音边调用send_audio
+
+        连接前先在全局限流队列中排队，排队超过max_queue_wait秒时放弃（None表示一直等待）。
+        讯飞服务熔断期间立即返回False，不排队也不等待连接超时。
+        """
+        self.queue_wait = 0.0
+        if not self.breaker.allow():
+            logging.warning("讯飞语音识别服务暂时不可用")
+            return False
+        queue_start = time.perf_counter()
+        acquired = xunfei_asr_limiter.acquire(max_wait=max_queue_wait)
+        self.queue_wait = time.perf_counter() - queue_start
+        if not acquired:
+            logging.warning("讯飞语音识别请求过于频繁，排队超时")
+            return False
+        self.assembler.reset()
+        self.results = queue.Queue()
+        self._pending = bytearray()
+        self._connected.clear()
+        self._closed.clear()
+        self._closing = False
+        self.stream_error = None
+
+        websocket.enableTrace(False)
+        self.ws = websocket.WebSocketApp(self.create_url(),
+                                         on_message=self.on_message,
+                                         on_error=self.on_error,
+                                         on_close=self.on_close,
+                                         on_open=lambda ws: self._connected.set())
+        self._ws_thread = threading.Thread(
+            target=self.ws.run_forever,
+            kwargs={'sslopt': {"cert_reqs": ssl.CERT_NONE}, 'ping_interval': 30, 'ping_timeout': 10},
+            name='xunfei-asr-stream',
+            daemon=True
+        )
+        self._ws_thread.start()
 
-    def start_listening(self):
-        self.result = ""
-        self.retry_count = 0
+        if not self._connected.wait(timeout) or self._closed.is_set():
+            self.breaker.record_failure()
+            logging.error("讯飞语音识别连接失败")
+            self.ws.close()
+            return False
+        self.breaker.record_success()
         self.is_listening = True
-        base_delay = 10.0  # 增加基础延迟到10秒
-        max_consecutive_errors = 2  # 减少连续错误次数限制
-        consecutive_errors = 0  # 当前连续错误次数
-        
-        while True:
-            try:
-                if not self.is_listening:
-                    break
-                    
-                # 检查距离上次请求的时间间隔
-                current_time = time.time()
-                time_since_last_request = current_time - self.last_request_time
-                min_interval = max(self.min_request_interval, base_delay * (1 + self.retry_count))  # 更激进的动态增加请求间隔
-                if time_since_last_request < min_interval:
-                    wait_time = min_interval - time_since_last_request
-                    print(f"等待{wait_time:.1f}秒以遵守访问频率限制...")
-                    time.sleep(wait_time)
-                
-                # 重置WebSocket连接
-                if self.ws:
-                    try:
-                        self.ws.close()
-                    except:
-                        pass
-                    self.ws = None
-                
-                websocket.enableTrace(False)
-                wsUrl = self.create_url()
-                self.ws = websocket.WebSocketApp(wsUrl,
-                                           on_message=self.on_message,
-                                           on_error=self.on_error,
-                                           on_close=self.on_close,
-                                           on_open=self.on_open)
-                self.is_listening = True
-                self.last_request_time = time.time()  # 更新请求时间
-                
-                # 设置连接超时
-                self.ws.run_forever(sslopt={"cert_reqs": ssl.CERT_NONE}, ping_interval=30, ping_timeout=10)
-                
-                # 如果连接正常关闭，跳出循环
+        return True
+
+    def send_audio(self, data: bytes, pace: bool = False):
+        """发送PCM音频，按40ms一帧切分；不足一帧的部分留到下次发送
+
+        pace为True时每帧间隔40ms，用于发送事先录好的音频，模拟实时输入。
+        """
+        self._pending.extend(data)
+        while len(self._pending) >= self.FRAME_BYTES and self.is_listening:
+            frame = bytes(self._pending[:self.FRAME_BYTES])
+            del self._pending[:self.FRAME_BYTES]
+            self.ws.send(frame, websocket.ABNF.OPCODE_BINARY)
+            if pace:
+                time.sleep(self.FRAME_INTERVAL)
+
+    def finish_stream(self, timeout: float = 10.0) -> str:
+        """发送结束标记，等待服务端返回最终结果并关闭连接"""
+        self._closing = True
+        try:
+            if self.is_listening:
+                if self._pending:
+                    self.ws.send(bytes(self._pending), websocket.ABNF.OPCODE_BINARY)
+                    self._pending = bytearray()
+                self.ws.send(json.dumps({"end": True}))
+            # 服务端发送完最终结果后会主动关闭连接
+            if not self._closed.wait(timeout):
+                logging.warning("等待讯飞最终识别结果超时")
+                self.stream_error = "等待最终识别结果超时"
+        except (websocket.WebSocketException, BrokenPipeError) as e:
+            logging.error(f"发送音频数据时发生错误：{e}")
+            self.stream_error = f"发送音频数据失败: {e}"
+        finally:
+            self.ws.close()
+            self.is_listening = False
+            if self._ws_thread:
+                self._ws_thread.join(timeout=1.0)
+        self.results.put(('final', self.result))
+        return self.result
+
+    def raise_for_error(self) -> None:
+        """服务端返回错误，或没有完整收到最终结果时抛出异常；识别文本可能不完整"""
+        if self.assembler.error:
+            code, desc = self.assembler.error
+            raise RuntimeError(f"讯飞语音识别返回错误: code={code} desc={desc or ERROR_CODES.get(code, '未知错误')}")
+        if self.stream_error:
+            raise ConnectionError(f"讯飞语音识别失败: {self.stream_error}")
+
+    def transcribe_stream(self, chunks, pace: bool = False) -> str:
+        """边产生边发送音频块（例如麦克风读到的数据），返回最终识别文本"""
+        if not self.open_stream():
+            return ""
+        try:
+            for chunk in chunks:
                 if not self.is_listening:
                     break
-                
-                # 重置连续错误计数
-                consecutive_errors = 0
-                
-                # 如果遇到错误，尝试重试
-                if self.exponential_backoff():
-                    print(f"正在进行第{self.retry_count}次重试...等待{min_interval}秒")
-                    continue
-                else:
-                    print("达到最大重试次数，停止重试")
-                    break
-                    
-            except Exception as e:
-                print(f"连接发生错误: {e}")
-                consecutive_errors += 1
-                
-                # 如果连续错误次数过多，终止重试
-                if consecutive_errors >= max_consecutive_errors:
-                    print("连续错误次数过多，终止重试")
-                    break
-                    
-                if not self.exponential_backoff():
-                    break
-                time.sleep(min_interval)  # 发生错误时也需要等待
+                self.send_audio(chunk, pace=pace)
+        finally:
+            result = self.finish_stream()
+        return result
 
     def stop_listening(self):
+        self._closing = True
         if self.ws:
             self.ws.close()
         self.is_listening = False
         return self.result
 
-def recognize_with_xunfei(audio_data):
-    """使用讯飞语音识别处理音频数据"""
+def recognize_with_xunfei(audio_data, cancel: Optional[threading.Event] = None):
+    """使用讯飞语音识别处理音频数据；cancel被设置时停止发送并尽快返回"""
     try:
         asr = XunfeiASR()
-        asr.start_listening()
         
         # 处理音频数据
         if isinstance(audio_data, bytes):
@@ -185,46 +209,75 @@ def recognize_with_xunfei(audio_data):
             # 如果不是bytes类型，尝试转换
             audio_bytes = bytes(audio_data)
         
-        # 发送音频数据进行识别
-        try:
-            if asr.ws and asr.is_listening:
-                asr.ws.send(audio_bytes, websocket.ABNF.OPCODE_BINARY)
-                time.sleep(1)  # 等待处理完成
-                
-                # 获取识别结果
-                result = asr.stop_listening()
-                if result:
-                    return result.strip()
-        except (websocket.WebSocketException, BrokenPipeError) as e:
-            print(f"发送音频数据时发生错误：{e}")
-        finally:
-            if asr.ws:
-                asr.stop_listening()
+        # 以流式方式按帧发送，服务端确认结束后立即返回结果
+        frames = (audio_bytes[offset:offset + XunfeiASR.FRAME_BYTES]
+                  for offset in range(0, len(audio_bytes), XunfeiASR.FRAME_BYTES)
+                  if not (cancel and cancel.is_set()))
+        result = asr.transcribe_stream(frames)
+        if result:
+            return result.strip()
         return None
     except Exception as e:
         print(f"讯飞语音识别出错: {e}")
         return None
 
-class XunfeiTTS:
-    def __init__(self):
-        self.URL = TTS_URL
+class XunfeiStreamingSession:
+    """边录音边识别：录音过程中每读到一帧就发送给讯飞，说完后只需等待最终结果
 
-    def create_header(self):
-        now = datetime.now()
-        date = format_date_time(mktime(now.timetuple()))
+    连接失败或发送中断时退回recognize_with_xunfei，把完整录音一次发送。
+    recognize(audio, cancel)可直接作为ASROrchestrator.recognize的streams参数中的识别函数。
+    """
 
-        # 拼接字符串
-        signature_origin = f'host: tts-api.xfyun.cn\ndate: {date}\nGET /v2/tts HTTP/1.1'
-        
-        # hmac-sha256加密
-        signature_sha = hmac.new(API_SECRET.encode('utf-8'),
-                                signature_origin.encode('utf-8'),
-                                digestmod=hashlib.sha256).digest()
-        signature_sha_base64 = base64.b64encode(signature_sha).decode(encoding='utf-8')
+    def __init__(self, timeout: float = 5.0, max_queue_wait: Optional[float] = 5.0):
+        self.asr = XunfeiASR()
+        self.active = self.asr.open_stream(timeout=timeout, max_queue_wait=max_queue_wait)
+        self.sent_bytes = 0
 
-        authorization_origin = f'api_key="{API_KEY}", algorithm="hmac-sha256", headers="host date request-line", signature="{signature_sha_base64}"'
-        authorization = base64.b64encode(authorization_origin.encode('utf-8')).decode(encoding='utf-8')
-        
+    def feed(self, frame) -> None:
+        if not self.active:
+            return
+        if not self.asr.is_listening:
+            # 服务端提前关闭了连接（例如返回错误），改为识别时整体发送
+            self.active = False
+            return
+        try:
+            self.asr.send_audio(frame)
+            self.sent_bytes += len(frame)
+        except (websocket.WebSocketException, OSError) as e:
+            logging.warning(f"讯飞语音识别边录边发中断，改为录音结束后发送: {e}")
+            self.active = False
+            self.asr.stop_listening()
+
+    def recognize(self, audio_data, cancel: Optional[threading.Event] = None) -> Optional[str]:
+        """audio_data为完整录音（PCM或speech_recognition.AudioData），只在边录边发失败时使用"""
+        if cancel and cancel.is_set():
+            return None
+        if not self.active:
+            if hasattr(audio_data, 'get_raw_data'):
+                audio_data = audio_data.get_raw_data(convert_rate=16000, convert_width=2)
+            return recognize_with_xunfei(audio_data, cancel)
+        self.active = False
+        text = self.asr.finish_stream()
+        self.asr.raise_for_error()
+        return text.strip() or None
+
+    def close(self) -> None:
+        """没有进行识别（例如没有检测到语音）时关闭连接"""
+        if self.active:
+            self.active = False
+            self.asr.stop_listening()
+
+class XunfeiTTS:
+    def __init__(self, url: str = TTS_URL, vcn: str = 'xiaoyan', sample_rate: int = 16000):
+        self.URL = url
+        self.vcn = vcn
+        self.sample_rate = sample_rate
+        self.aue = 'raw'
+        self.max_queue_wait = 10.0  # 排队等待限流令牌的最长时间（秒）
+        self.breaker = get_breaker('xunfei')
+
+    def create_header(self):
+        date, authorization = transport.signer.sign('tts-api.xfyun.cn', 'GET /v2/tts HTTP/1.1')
         return {
             'Content-Type': 'application/json',
             'Authorization': authorization,
@@ -232,14 +285,15 @@ class XunfeiTTS:
             'Host': 'tts-api.xfyun.cn'
         }
 
-    def text_to_speech(self, text, output_file='output.wav'):
+    def synthesize(self, text):
+        """合成语音，返回(PCM音频数据, 错误信息)"""
         try:
             data = {
                 'common': {'app_id': APPID},
                 'business': {
-                    'aue': 'raw',
-                    'auf': 'audio/L16;rate=16000',
-                    'vcn': 'xiaoyan',
+                    'aue': self.aue,
+                    'auf': f'audio/L16;rate={self.sample_rate}',
+                    'vcn': self.vcn,
                     'tte': 'utf8'
                 },
                 'data': {
@@ -248,17 +302,39 @@ class XunfeiTTS:
                 }
             }
 
-            response = requests.post(self.URL, json=data, headers=self.create_header())
+            if not self.breaker.allow():
+                return None, "讯飞语音合成服务暂时不可用，请稍后再试"
+            if not xunfei_tts_limiter.acquire(max_wait=self.max_queue_wait):
+                return None, "语音合成请求过于频繁，请稍后再试"
+            # 复用连接池中的长连接，避免每次合成都重新握手
+            try:
+                response = transport.post_json(self.URL, data, headers=self.create_header())
+            except Exception as e:
+                self.breaker.record_error(e)
+                raise
+            if response.status_code >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
             if response.status_code == 200:
                 result = response.json()
                 if result['code'] == 0:
-                    audio_data = base64.b64decode(result['data']['audio'])
-                    with open(output_file, 'wb') as f:
-                        f.write(audio_data)
-                    return True, None
+                    return base64.b64decode(result['data']['audio']), None
                 else:
-                    return False, f"合成失败，错误码：{result['code']}"
+                    return None, f"合成失败，错误码：{result['code']}"
             else:
-                return False, f"请求失败，状态码：{response.status_code}"
+                return None, f"请求失败，状态码：{response.status_code}"
+        except Exception as e:
+            return None, f"语音合成出错: {e}"
+
+    def text_to_speech(self, text, output_file):
+        """合成语音并写入output_file；并发调用时各自使用不同的文件"""
+        audio_data, error = self.synthesize(text)
+        if error:
+            return False, error
+        try:
+            with open(output_file, 'wb') as f:
+                f.write(audio_data)
+            return True, None
         except Exception as e:
             return False, f"语音合成出错: {e}"
\ No newline at end of file
@@ -0,0 +1,128 @@
+import base64
+import hashlib
+import hmac
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+from wsgiref.handlers import format_date_time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config_loader import get_section
+from xunfei_config import API_KEY, API_SECRET
+
+class XunfeiSigner:
+    """讯飞接口的HMAC-SHA256签名，签名结果在有效期内复用
+
+    签名只依赖请求行、host和date，讯飞允许date与服务器时间相差数分钟，
+    因此同一个签名可以在ttl秒内重复使用，不必每次请求都重新计算。
+    """
+
+    def __init__(self, api_key: str = API_KEY, api_secret: str = API_SECRET, ttl: float = 60.0):
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.ttl = ttl
+        self._cache: Dict[Tuple[str, str], Tuple[float, str, str]] = {}
+        self._lock = threading.Lock()
+
+    def sign(self, host: str, request_line: str) -> Tuple[str, str]:
+        """返回(date, authorization)"""
+        now = time.time()
+        key = (host, request_line)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached and now - cached[0] < self.ttl:
+                return cached[1], cached[2]
+
+        # 生成RFC1123格式的时间戳
+        date = format_date_time(now)
+        signature_origin = f'host: {host}\ndate: {date}\n{request_line}'
+        signature_sha = hmac.new(self.api_secret.encode('utf-8'),
+                                 signature_origin.encode('utf-8'),
+                                 digestmod=hashlib.sha256).digest()
+        signature_sha_base64 = base64.b64encode(signature_sha).decode(encoding='utf-8')
+
+        authorization_origin = (f'api_key="{self.api_key}", algorithm="hmac-sha256", '
+                                f'headers="host date request-line", signature="{signature_sha_base64}"')
+        authorization = base64.b64encode(authorization_origin.encode('utf-8')).decode(encoding='utf-8')
+
+        with self._lock:
+            self._cache[key] = (now, date, authorization)
+        return date, authorization
+
+class XunfeiTransport:
+    """讯飞HTTP请求的公共连接池
+
+    所有请求共用一个requests.Session，连接保持复用，避免每次都重新进行TCP和TLS握手；
+    超时和证书校验等参数来自config.json的connection_settings。
+    """
+
+    def __init__(self, timeout: float = 30, pool_size: int = 4, keep_alive: bool = True,
+                 verify_ssl: bool = True, signature_ttl: float = 60.0):
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self.verify_ssl = verify_ssl
+        self.signer = XunfeiSigner(ttl=signature_ttl)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=False)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        if not keep_alive:
+            self.session.headers['Connection'] = 'close'
+
+    @classmethod
+    def from_config(cls) -> 'XunfeiTransport':
+        settings = get_section('connection_settings', {
+            'timeout': 30,
+            'pool_size': 4,
+            'keep_alive': True,
+            'verify_ssl': True,
+            'signature_ttl': 60,
+        })
+        return cls(timeout=settings['timeout'], pool_size=settings['pool_size'],
+                   keep_alive=settings['keep_alive'], verify_ssl=settings['verify_ssl'],
+                   signature_ttl=settings['signature_ttl'])
+
+    def post_json(self, url: str, data: Dict[str, Any],
+                  headers: Optional[Dict[str, str]] = None) -> requests.Response:
+        return self.session.post(url, json=data, headers=headers,
+                                 timeout=self.timeout, verify=self.verify_ssl)
+
+# 初始化全局实例
+transport = XunfeiTransport.from_config()
+
+if __name__ == '__main__':
+    # 基准测试：对本地模拟服务比较每次新建连接与复用连接池的耗时和握手次数
+    from mock_xunfei_server import MockXunfeiServer
+
+    requests_count = 200
+    payload = {'data': {'text': base64.b64encode('你好'.encode('utf-8')).decode('utf-8'), 'status': 2}}
+
+    server = MockXunfeiServer().start()
+    start = time.perf_counter()
+    for _ in range(requests_count):
+        requests.post(server.tts_url, json=payload, timeout=5)
+    plain = time.perf_counter() - start
+    plain_handshakes = server.handshakes
+
+    server.handshakes = 0
+    pooled_transport = XunfeiTransport(timeout=5)
+    start = time.perf_counter()
+    for _ in range(requests_count):
+        pooled_transport.post_json(server.tts_url, payload)
+    pooled = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(requests_count):
+        XunfeiSigner(ttl=0).sign('tts-api.xfyun.cn', 'GET /v2/tts HTTP/1.1')
+    unsigned = time.perf_counter() - start
+    signer = XunfeiSigner()
+    start = time.perf_counter()
+    for _ in range(requests_count):
+        signer.sign('tts-api.xfyun.cn', 'GET /v2/tts HTTP/1.1')
+    cached = time.perf_counter() - start
+
+    print(f"每次新建连接: {plain / requests_count * 1000:.2f} ms/请求, 握手 {plain_handshakes} 次")
+    print(f"复用连接池:   {pooled / requests_count * 1000:.2f} ms/请求, 握手 {server.handshakes} 次")
+    print(f"签名: 每次计算 {unsigned / requests_count * 1e6:.1f} 微秒, 缓存 {cached / requests_count * 1e6:.1f} 微秒")